@@ -1,107 +1,297 @@
-from multiprocessing import Queue, Process
-from netmiko import ConnectHandler
-from netmiko.ssh_exception import NetMikoTimeoutException, NetMikoAuthenticationException
+from ShowImports import netmiko
 from datetime import datetime
 from getpass import getpass
-import csv
+from ShowAsync import run_async
+from ShowPool import run_pool, close_pool, DEFAULT_WORKERS, RETRIES
+from ShowCapture import capture_path, open_capture
+from ShowSchedule import DeviceHistory
+from ShowProbe import probe_devices, PROBE_TIMEOUT
+from ShowParse import render, ParseCache, CISCO_PARSERS, PARSE_TTL
+from ShowLogin import logins
+from ShowSession import stream_pipelined, sessions, JUMP_HOST
+from ShowTiming import RunReport, timing, SLOWEST
+from ShowWriter import ShowWriter
+from ShowLog import start_logging, stop_logging
+from ShowResults import ResultStore, ResultSink
+from ShowJournal import RunJournal, run_id
+from ConfigStore import ConfigStore, STORE
+from DeviceInventory import load_inventory, parse_selector
+from ShowOptions import add_run_options, apply_run_options
+import argparse
 import logging
+import os
+import shutil
+
+log = logging.getLogger('CiscoShow')
+
+# Menu keyword -> (show command, dev_type, srx, view), the same shape as JUNOS_COMMANDS. A view renders
+# the parsed output, and all views of one show command share a single fetch.
+CISCO_COMMANDS = {
+    'arp': ('arp', '', '', None),
+    'bgp': ('ip bgp summary', '', '', None),
+    'bgp down': ('ip bgp summary', '', '', 'down'),
+    'bgp summary': ('ip bgp summary', '', '', 'summary'),
+    'configuration': ('run', '', '', None),
+    'hardware': ('hardware', '', '', None),
+    'interface brief': ('ip int brie', '', '', None),
+    'interfaces up': ('ip int brie', '', '', 'up'),
+    'interfaces down': ('ip int brie', '', '', 'down'),
+    'interfaces summary': ('ip int brie', '', '', 'summary'),
+    'ospf': ('ip ospf neigh', '', '', None),
+    'ospf down': ('ip ospf neigh', '', '', 'down'),
+    'ospf summary': ('ip ospf neigh', '', '', 'summary'),
+    'ipsec': ('crypto ipsec sa active', '', '', None),
+    'ntp': ('ntp associations', '', '', None),
+    'version': ('version | include image', '', '', None),
+    'vlans': ('vlans', '', '', None),
+}
 
 
 class CiscoShow:
 
-    def __init__(self, username, password, ip, show_command):
+    def __init__(self, username, password, ip, show_command, workers=DEFAULT_WORKERS, engine='process',
+                 order='completion', echo=True, selector='', stream=False, compress=None, view=None,
+                 parse_ttl=PARSE_TTL, slowest=SLOWEST, prometheus=None,
+                 retries=RETRIES, probe=False, probe_timeout=PROBE_TIMEOUT, results=None):
         self.user = username
         self.passw = password
         self.ip_add = ip
         self.show = show_command
+        self.workers = workers
+        self.engine = engine
+        self.order = order
+        self.echo = echo
+        self.selector = selector
+        self.stream = stream
+        self.compress = compress
+        self.view = view
+        self.parse_ttl = parse_ttl
+        self.slowest = slowest
+        self.prometheus = prometheus
+        self.retries = retries
+        self.probe = probe
+        self.probe_timeout = probe_timeout
+        self.results = results
+
+    def block_parts(self, hostname):
+        header = f"\n==================== Begin {hostname} ====================\n"
+        footer = f"\n====================  End  {hostname} ====================\n"
+        return header, footer
+
+    def block(self, hostname, output):
+        header, footer = self.block_parts(hostname)
+        return header + output + footer
+
+    def capture(self, net_connect, command, path, header='', footer='', compress=None):
+        # Streams one command's output to path as it arrives so worker memory stays flat.
+        with open_capture(path, compress) as capture:
+            capture.write(header)
+            stream_pipelined(net_connect, [command], lambda index, line: capture.write(line))
+            capture.write(footer)
+
+    def save_config(self, today, hostname, output):
+        # Unchanged configs only add a history line; changes are stored once and diffed.
+        if self.echo:
+            print(self.block(hostname, output))
+        with timing.phase('write'):
+            entry, diff = ConfigStore().save(hostname, output, today)
+        if diff:
+            log.info(f'Configuration changed, see {ConfigStore().diff_path(hostname, today)}',
+                     extra={'hostname': hostname})
+
+    def save_config_capture(self, today, hostname, path):
+        with timing.phase('write'):
+            entry, diff = ConfigStore().save_file(hostname, path, today)
+        os.remove(path)
+        if diff:
+            log.info(f'Configuration changed, see {ConfigStore().diff_path(hostname, today)}',
+                     extra={'hostname': hostname})
+
+    def failure(self, hostname, error):
+        # Sent to the log listener in the parent; the console only counts failures on the progress line.
+        timing.fail(error)
+        if isinstance(error, netmiko.NetMikoTimeoutException):
+            message = 'SSH is not working. Insure device is reachable. Verify correct IP in [juniper devices.csv]'
+        elif isinstance(error, netmiko.NetMikoAuthenticationException):
+            message = 'Check your username/password. Make sure you have an account on this device.'
+        elif type(error) is ValueError:
+            message = 'Check your username/password. Make sure you have the correct permissions on this device.'
+        else:
+            message = f'Unexpected {type(error).__name__} while collecting from this device.'
+        # One line per record; netmiko appends a multi-line list of common causes.
+        detail = (str(error).splitlines() or [''])[0]
+        log.warning(f'{message} ({detail})', extra={'hostname': hostname, 'error': type(error).__name__})
 
     def configuration(self, today, device, hostname):
-        logging.basicConfig(filename='logs\CiscoShowFailure.log', level=logging.WARNING)
         try:
-            save_file = open(f'output\Configs\{hostname} {today}.txt', mode='w')
-            net_connect = ConnectHandler(**device, timeout=60)
-            output = f"\n==================== Begin {hostname} ====================\n"
-            output += net_connect.send_command(f'show {self.show}')
-            output += f"\n====================  End  {hostname} ====================\n"
-            net_connect.disconnect()
-            print(output)
-            save_file.write(output)
-            save_file.close()
-        except NetMikoTimeoutException:
-            print(f"SSH is not working to {hostname}. Insure device is reachable")
-            logging.warning(f"{datetime.now()}: SSH is not working to {hostname}. Insure device is reachable."
-                            "Verify correct IP in [juniper devices.csv]")
-        except NetMikoAuthenticationException:
-            print(f"Check your Username/Password on {hostname}. Make sure you have an account on this device.")
-            logging.warning(f"{datetime.now()}: Check your username/password on {hostname}."
-                            " Make sure you have an account on this device.")
-        except ValueError:
-            print('There has been an error ensure you have the correct permissions to run this command.')
-            logging.warning(f"{datetime.now()}: Check your username/password."
-                            " Make sure you have the correct permissions to access this device.")
-
-    def command(self, today, device, filename, hostname):
-        logging.basicConfig(filename='logs\CiscoShowFailure.log', level=logging.WARNING)
+            if self.stream:
+                os.makedirs(STORE, exist_ok=True)
+                path = os.path.join(STORE, f'{hostname} {today}.tmp')
+                # Left uncompressed, the config store reads it back line by line and compresses what it keeps.
+                with sessions.checkout(device, timeout=60) as net_connect, timing.phase('command'):
+                    self.capture(net_connect, f'show {self.show}', path)
+                self.save_config_capture(today, hostname, path)
+                return
+            with sessions.checkout(device, timeout=60) as net_connect, timing.phase('command'):
+                output = net_connect.send_command(f'show {self.show}')
+            self.save_config(today, hostname, output)
+        except (netmiko.NetMikoTimeoutException, netmiko.NetMikoAuthenticationException, ValueError) as error:
+            self.failure(hostname, error)
+
+    def command(self, device, hostname, parts=None):
+        # Returns the output block to the parent, which hands it to the single ShowWriter.
+        # When streaming, the block goes to a file under parts and only its path is returned.
         try:
-            save_file = open(f'output\{filename} {today}.txt', mode='a')
-            net_connect = ConnectHandler(**device, timeout=60)
-            output = f"\n==================== Begin {hostname} ====================\n"
-            output += net_connect.send_command(f'show {self.show}')
-            output += f"\n====================  End  {hostname} ====================\n"
-            net_connect.disconnect()
-            print(output)
-            save_file.write(output)
-            save_file.close()
-        except NetMikoTimeoutException:
-            print(f"SSH is not working to {hostname}. Insure device is reachable")
-            logging.warning(f"{datetime.now()}: SSH is not working to {hostname}. Insure device is reachable."
-                            "Verify correct IP in [juniper devices.csv]")
-        except NetMikoAuthenticationException:
-            print(f"Check your Username/Password. Make sure you have an account on this device.")
-            logging.warning(f"{datetime.now()}: Check your username/password."
-                            " Make sure you have an account on this device.")
-        except ValueError:
-            print('There has been an error ensure you have the correct permissions to run this command.')
-            logging.warning(f"{datetime.now()}: Check your username/password."
-                            " Make sure you have the correct permissions to access this device.")
-
-    def all(self):
+            if self.stream and parts is not None:
+                path = capture_path(os.path.join(parts, f'{hostname}.txt'), self.compress)
+                header, footer = self.block_parts(hostname)
+                with sessions.checkout(device, timeout=60) as net_connect, timing.phase('command'):
+                    self.capture(net_connect, f'show {self.show}', path, header, footer, self.compress)
+                return hostname, path
+            with sessions.checkout(device, timeout=60) as net_connect, timing.phase('command'):
+                output = net_connect.send_command(f'show {self.show}')
+            return hostname, self.block(hostname, output)
+        except (netmiko.NetMikoTimeoutException, netmiko.NetMikoAuthenticationException, ValueError) as error:
+            self.failure(hostname, error)
+
+    def parsed(self, device, hostname):
+        # Parsed records come from the cache while fresh; otherwise one fetch refreshes every view.
+        kind, parser = CISCO_PARSERS[self.show]
+        cache = ParseCache(self.parse_ttl)
+        records = cache.get(hostname, kind)
+        if records is None:
+            with sessions.checkout(device, timeout=60) as net_connect, timing.phase('command'):
+                output = net_connect.send_command(f'show {self.show}')
+            records = parser(output)
+            cache.put(hostname, kind, records)
+        return records
+
+    def render(self, records):
+        return render(CISCO_PARSERS[self.show][0], self.view, records)
+
+    def command_parsed(self, device, hostname):
+        try:
+            return hostname, self.parsed(device, hostname)
+        except (netmiko.NetMikoTimeoutException, netmiko.NetMikoAuthenticationException, ValueError) as error:
+            self.failure(hostname, error)
+
+    def sweep_parsed(self, selected, writer, report=None, journal=None):
+        # Devices with fresh cached records are answered without opening a session.
+        kind = CISCO_PARSERS[self.show][0]
+        cache = ParseCache(self.parse_ttl)
+        stale = []
+        for hostname, device in selected:
+            records = cache.get(hostname, kind)
+            if records is None:
+                stale.append((device, hostname))
+            else:
+                writer.put(hostname, self.block(hostname, self.render(records)))
+
+        def on_result(hostname, records):
+            writer.put(hostname, self.block(hostname, self.render(records)))
+        print(f'{len(selected) - len(stale)} devices answered from parsed records, {len(stale)} to fetch.')
+        run_pool(self.command_parsed, stale, self.workers, on_result, report, retries=self.retries, journal=journal)
+
+    def result_sink(self, report):
+        if self.results is None:
+            return None
+        command = f'{self.show} [{self.view}]' if self.view else self.show
+        return ResultSink(ResultStore(self.results), report.name, command, report)
+
+    def select_devices(self):
+        # Filters come from the indexed inventory instead of scanning DeviceDB.csv row by row.
+        terms = parse_selector(self.selector)
+        terms['device_type'] = ['cisco_ios']
+        selected = []
+        for row in load_inventory().select(terms):
+            device = {
+                'device_type': row['device_type'],
+                'ip': row['IP_Address'],
+                'username': self.user,
+                'password': self.passw
+            }
+            if row.get('port'):
+                device['port'] = int(row['port'])
+            if row.get(JUMP_HOST):
+                device[JUMP_HOST] = row[JUMP_HOST]
+            selected.append((row['HostName'], logins.tag(device, row)))
+        return selected
+
+    def all(self, filename=None, journal=None, failed_only=False):
+        # A new run journals every device as pending; a resumed one only goes back to the devices its
+        # journal does not have as done, or only the failed ones.
         today = datetime.now().strftime('%Y%m%d-%H%M')
         start = datetime.now()
-        Queue(maxsize=20)
-        process = []
-        filename = ''
-        if 'run' in self.show:
+        if journal is not None:
+            today = journal.header['today']
+            filename = journal.header['filename']
+        elif 'run' in self.show:
             pass
-        else:
+        elif filename is None:
             filename = input('\nFilename for output: ')
-        with open("DeviceDB.csv", mode='r') as devices:
-            reader = csv.DictReader(devices)
-            for row in reader:
-                device_type = row['device_type']
-                ip = row['IP_Address']
-                hostname = row['HostName']
-                device = {
-                    'device_type': device_type,
-                    'ip': ip,
-                    'username': self.user,
-                    'password': self.passw
-                }
-                if device_type == 'cisco_ios':
-                    pass
-                else:
-                    continue
-                if 'run' in self.show:
-                    my_process = Process(target=self.configuration, args=(today, device, hostname))
-                    my_process.start()
-                    process.append(my_process)
-                else:
-                    my_process = Process(target=self.command, args=(today, device, filename, hostname))
-                    my_process.start()
-                    process.append(my_process)
+        history = DeviceHistory()
+        devices = self.select_devices()
+        if journal is None:
+            journal = RunJournal(run_id(today, 'cisco', filename or 'configuration'))
+            journal.start({'vendor': 'cisco', 'today': today, 'filename': filename, 'show': self.show,
+                           'view': self.view, 'selector': self.selector, 'stream': self.stream,
+                           'compress': self.compress}, [hostname for hostname, device in devices])
+            print(f'Run {journal.run}')
+        else:
+            remaining = journal.remaining(failed_only)
+            devices = [(hostname, device) for hostname, device in devices if hostname in remaining]
+            print(f'Resuming run {journal.run}: {len(devices)} devices to collect, '
+                  f'{len(remaining) - len(devices)} no longer in the inventory.')
+        selected = history.schedule(devices, self.show)
+        report = RunReport(f"{today} cisco {filename or 'configuration'}", self.slowest, self.prometheus)
+        if self.probe:
+            def on_unreachable(hostname, error):
+                self.failure(hostname, error)
+                journal.failed(hostname, type(error).__name__)
+            selected = probe_devices(selected, on_unreachable, report, self.probe_timeout)
+        collection = datetime.now()
 
-        for a_process in process:
-            a_process.join()
+        try:
+            if 'run' in self.show:
+                if self.engine == 'async':
+                    def on_config(hostname, output):
+                        self.save_config(today, hostname, output)
+                        journal.done([hostname])
+                    run_async(selected, f'show {self.show}', on_config, self.failure, self.workers, report=report,
+                              journal=journal)
+                else:
+                    run_pool(self.configuration, [(today, device, hostname) for hostname, device in selected],
+                             self.workers, report=report, retries=self.retries, journal=journal)
+            else:
+                path = capture_path(os.path.join('output', f'{filename} {today}.txt'), self.compress)
+                journal.trim(path)
+                writer = ShowWriter(path, self.order, self.echo, self.compress, report, self.result_sink(report),
+                                    journal)
+                parts = os.path.join('output', f'{filename} {today}.parts')
+                try:
+                    if self.view:
+                        self.sweep_parsed(selected, writer, report, journal)
+                    elif self.engine == 'async':
+                        def on_output(hostname, output):
+                            writer.put(hostname, self.block(hostname, output))
+                        run_async(selected, f'show {self.show}', on_output, self.failure, self.workers,
+                                  report=report, journal=journal)
+                    elif self.stream:
+                        os.makedirs(parts, exist_ok=True)
+                        run_pool(self.command, [(device, hostname, parts) for hostname, device in selected],
+                                 self.workers, writer.put_file, report, retries=self.retries, journal=journal)
+                    else:
+                        run_pool(self.command, [(device, hostname) for hostname, device in selected],
+                                 self.workers, writer.put, report, retries=self.retries, journal=journal)
+                finally:
+                    writer.close()
+                    shutil.rmtree(parts, ignore_errors=True)
+        finally:
+            journal.close()
+        report.stage('collection', (datetime.now() - collection).total_seconds())
+        history.update(report, self.show)
+        history.save()
+        report.close()
 
         end_time = datetime.now() - start
         print(f'Total time to run = {end_time}')
@@ -123,7 +313,17 @@ class CiscoShow:
         else:
 
             filename = input('\nFilename for output: ')
-            self.command(today, device, filename, hostname)
+            path = capture_path(os.path.join('output', f'{filename} {today}.txt'), self.compress)
+            writer = ShowWriter(path, echo=self.echo, compress=self.compress)
+            if self.view:
+                result = self.command_parsed(device, hostname)
+                if result is not None:
+                    writer.put(hostname, self.block(hostname, self.render(result[1])))
+            else:
+                result = self.command(device, hostname)
+                if result is not None:
+                    writer.put(*result)
+            writer.close()
 
 
 def help_commands():
@@ -131,6 +331,8 @@ def help_commands():
           '   arp - Shows ARP on all devices,\n'
           '         (This command takes time and may cause timeout on some devices.)\n'
           '   bgp - Shows all BGP peers, summary statement is assumed.\n'
+          '   bgp down - Shows BGP peers that are not established.\n'
+          '   bgp summary - Shows BGP peer counts per device.\n'
           '   configuration - Shows the current running configuration.\n'
           '   custom - Allows a custom show command. Do not add the show statement\n'
           '            since it is already added for you.\n'
@@ -139,19 +341,46 @@ def help_commands():
           '   interface brief- Shows all interface statuses.\n'
           '   interfaces up - Shows interfaces that are up.\n'
           '   interfaces down - Shows interfaces that are down.\n'
+          '   interfaces summary - Shows interface up/down counts per device.\n'
           '   ospf - Shows all OSPF neighbor information the neighbor statement is assumed.\n'
+          '   ospf down - Shows OSPF neighbors that are not Full.\n'
+          '   ospf summary - Shows OSPF neighbor counts per device.\n'
           '   ipsec - Shows ipsec security associations. \n'
           '   ntp - Shows NTP associations.\n'
           '   version - Will show the version on the device.\n'
           '   vlans - Will show device vlan information.\n\n')
 
 
-def cisco_show():
+def cisco_show(journal=None, failed_only=False, **options):
     username = input('Username: ')
     password = getpass('Password: ')
+    # Keeps prompting until exit so the worker pool and cached sessions are reused between commands.
+    start_logging()
+    try:
+        if journal is not None:
+            cisco_resume(username, password, journal, failed_only, options)
+        else:
+            while cisco_show_command(username, password, options):
+                pass
+    finally:
+        close_pool()
+        stop_logging()
+        print(sessions.stats())
+
+
+def cisco_resume(username, password, journal, failed_only, options):
+    # The journal header brings back the command, filters and output format of the original run.
+    header = journal.header
+    options = dict(options, selector=header['selector'], stream=header['stream'], compress=header['compress'])
+    CiscoShow(username, password, '', header['show'], view=header['view'], **options).all(
+        journal=journal, failed_only=failed_only)
+
+
+def cisco_show_command(username, password, options):
     print('Insert the show command you wish to run.')
     loop = True
     show_command = ''
+    view = None
     while loop:
         command = input("Show: ")
         if command.lower() == 'help'or command == '?':
@@ -159,46 +388,13 @@ def cisco_show():
         elif command == '':
             pass
         elif command.lower() == 'exit':
-            return
-        elif command.lower() == 'arp':
-            show_command = 'arp'
-            loop = False
-        elif command.lower() == 'bgp':
-            show_command = 'ip bgp summary'
-            loop = False
-        elif command.lower() == 'configuration':
-            show_command = 'run'
-            loop = False
+            return False
         elif command.lower() == 'custom':
             print('\n Enter the command without the word show.\n')
             show_command = input('show ')
             loop = False
-        elif command.lower() == 'hardware':
-            show_command = 'hardware'
-            loop = False
-        elif command.lower() == 'interface brief':
-            show_command = 'ip int brie'
-            loop = False
-        elif command.lower() == 'interfaces up':
-            show_command = 'ip int brie | include  up                    up'
-            loop = False
-        elif command.lower() == 'interfaces down':
-            show_command = 'ip int brie | include  up                    down'
-            loop = False
-        elif command.lower() == 'ospf':
-            show_command = 'ip ospf neigh'
-            loop = False
-        elif command.lower() == 'ipsec':
-            show_command = 'crypto ipsec sa active'
-            loop = False
-        elif command.lower() == 'ntp':
-            show_command = 'ntp associations'
-            loop = False
-        elif command.lower() == 'version':
-            show_command = 'version | include image'
-            loop = False
-        elif command.lower() == 'vlans':
-            show_command = 'vlans'
+        elif command.lower() in CISCO_COMMANDS:
+            show_command, _, _, view = CISCO_COMMANDS[command.lower()]
             loop = False
         else:
             print('Please enter a valid show command.')
@@ -208,14 +404,14 @@ def cisco_show():
         if one_or_all.lower() == "one":
             ip = input('Please enter the target IP address: ')
             start_time = datetime.now()
-            CiscoShow(username, password, ip, show_command).one()
+            CiscoShow(username, password, ip, show_command, view=view, **options).one()
             end_time = datetime.now()
             total_time = end_time - start_time
             one_or_all_q = False
         elif one_or_all.lower() == "all":
             print(f'All devices will be issued {command}.\n\n')
             start_time = datetime.now()
-            CiscoShow(username, password, ip='', show_command=show_command).all()
+            CiscoShow(username, password, ip='', show_command=show_command, view=view, **options).all()
             end_time = datetime.now()
             total_time = end_time - start_time
             one_or_all_q = False
@@ -225,6 +421,11 @@ def cisco_show():
           "Complete! See JunosShowFailure log for errors!\n"
           f"Total time: {total_time}\n\n"
           "###################################################\n")
+    return True
 
 if __name__ == '__main__':
-    cisco_show()
+    parser = argparse.ArgumentParser(description='Run show commands against Cisco devices.')
+    add_run_options(parser)
+    options = vars(parser.parse_args())
+    journal, retry_failed = apply_run_options(parser, options, 'cisco')
+    cisco_show(journal, retry_failed, **options)
@@ -0,0 +1,152 @@
+from datetime import datetime
+import argparse
+import difflib
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+
+STORE = os.path.join('output', 'configs')
+# Compressed blobs larger than this are not diffed, difflib needs both versions in memory.
+DIFF_LIMIT = 8 * 1024 * 1024
+
+# Lines that change on every read without the configuration itself changing.
+VOLATILE = re.compile(r'^(## Last (commit|changed):|! Last configuration change|! NVRAM config last updated'
+                      r'|Building configuration|Current configuration :|ntp clock-period)')
+
+
+def normalized_lines(lines):
+    for line in lines:
+        line = line.rstrip()
+        if line and not VOLATILE.match(line):
+            yield line + '\n'
+
+
+def normalize(text):
+    return ''.join(normalized_lines(text.splitlines()))
+
+
+class ConfigStore:
+
+    def __init__(self, root=STORE):
+        self.root = root
+
+    def blob_path(self, digest):
+        return os.path.join(self.root, 'objects', digest[:2], f'{digest[2:]}.gz')
+
+    def history_path(self, hostname):
+        return os.path.join(self.root, 'history', f'{hostname}.jsonl')
+
+    def diff_path(self, hostname, stamp):
+        return os.path.join(self.root, 'diffs', f'{hostname} {stamp}.diff')
+
+    def history(self, hostname):
+        try:
+            with open(self.history_path(hostname), mode='r') as history:
+                return [json.loads(line) for line in history if line.strip()]
+        except FileNotFoundError:
+            return []
+
+    def read(self, digest):
+        with gzip.open(self.blob_path(digest), mode='rt') as blob:
+            return blob.read()
+
+    def write_blob(self, digest, lines):
+        path = self.blob_path(digest)
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # The ShowCluster coordinator saves from one thread per collector, so a temp name per thread as well.
+        temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with gzip.open(temp_path, mode='wt') as blob:
+            blob.writelines(lines)
+        os.replace(temp_path, path)
+
+    def diff(self, hostname, old, new):
+        return ''.join(difflib.unified_diff(self.read(old['sha256']).splitlines(keepends=True),
+                                            self.read(new['sha256']).splitlines(keepends=True),
+                                            fromfile=f"{hostname} {old['time']}",
+                                            tofile=f"{hostname} {new['time']}"))
+
+    def save(self, hostname, output, stamp):
+        # Identical configs share one compressed blob; only the history line is new.
+        config = normalize(output)
+        digest = hashlib.sha256(config.encode()).hexdigest()
+        self.write_blob(digest, [config])
+        return self.record(hostname, digest, stamp)
+
+    def save_file(self, hostname, path, stamp):
+        # Two passes over a streamed capture so a large config is never held in memory.
+        digest = hashlib.sha256()
+        with open(path, mode='r') as capture:
+            for line in normalized_lines(capture):
+                digest.update(line.encode())
+        digest = digest.hexdigest()
+        with open(path, mode='r') as capture:
+            self.write_blob(digest, normalized_lines(capture))
+        return self.record(hostname, digest, stamp)
+
+    def record(self, hostname, digest, stamp):
+        history = self.history(hostname)
+        previous = history[-1] if history else None
+        entry = {'time': stamp, 'sha256': digest, 'changed': previous is None or previous['sha256'] != digest}
+        os.makedirs(os.path.dirname(self.history_path(hostname)), exist_ok=True)
+        with open(self.history_path(hostname), mode='a') as history_file:
+            history_file.write(json.dumps(entry) + '\n')
+        if previous is None or not entry['changed']:
+            return entry, ''
+        sizes = [os.path.getsize(self.blob_path(version)) for version in (previous['sha256'], digest)]
+        if max(sizes) > DIFF_LIMIT:
+            diff = f"{hostname} changed between {previous['time']} and {stamp}; too large to diff.\n"
+        else:
+            diff = self.diff(hostname, previous, entry)
+        os.makedirs(os.path.dirname(self.diff_path(hostname, stamp)), exist_ok=True)
+        with open(self.diff_path(hostname, stamp), mode='w') as diff_file:
+            diff_file.write(diff)
+        return entry, diff
+
+    def changes(self, since):
+        history_dir = os.path.join(self.root, 'history')
+        if not os.path.isdir(history_dir):
+            return []
+        changed = []
+        for name in sorted(os.listdir(history_dir)):
+            hostname = name[:-len('.jsonl')]
+            history = self.history(hostname)
+            for number, entry in enumerate(history):
+                if number and entry['changed'] and entry['time'] >= since:
+                    changed.append((hostname, entry['time'], self.diff_path(hostname, entry['time'])))
+        return changed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Query the configuration backup store.')
+    commands = parser.add_subparsers(dest='action', required=True)
+    changes = commands.add_parser('changes', help='List devices whose configuration changed.')
+    changes.add_argument('--since', default=datetime.now().strftime('%Y%m%d'),
+                         help='Timestamp prefix to start from, e.g. 20240131 or 20240131-0200.')
+    diff = commands.add_parser('diff', help='Show the diff between two saved versions of a device.')
+    diff.add_argument('hostname')
+    diff.add_argument('--back', type=int, default=1, help='How many versions back to compare against.')
+    show = commands.add_parser('show', help='Print a saved configuration.')
+    show.add_argument('hostname')
+    show.add_argument('--back', type=int, default=0, help='How many versions back to print.')
+    args = parser.parse_args()
+    store = ConfigStore()
+    if args.action == 'changes':
+        for hostname, stamp, path in store.changes(args.since):
+            print(f'{stamp}  {hostname}  {path}')
+        return
+    versions = [entry for entry in store.history(args.hostname) if entry['changed']]
+    if len(versions) <= args.back:
+        print(f'Only {len(versions)} saved versions of {args.hostname}.')
+    elif args.action == 'diff':
+        print(store.diff(args.hostname, versions[-1 - args.back], versions[-1]))
+    else:
+        print(store.read(versions[-1 - args.back]['sha256']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+from fnmatch import fnmatchcase
+import csv
+import hashlib
+import os
+import pickle
+import shlex
+
+CACHE_VERSION = 1
+
+_loaded = {}
+
+
+def parse_selector(selector):
+    # 'device_type=juniper dev_type=router site=DAL*,HOU*' -> {'device_type': ['juniper'], ...}
+    terms = {}
+    if isinstance(selector, dict):
+        items = selector.items()
+    else:
+        items = [term.split('=', 1) for term in shlex.split(selector or '')]
+    for item in items:
+        if len(item) != 2:
+            raise ValueError(f'Selector terms must look like column=value, not {item[0]!r}')
+        column, value = item
+        if isinstance(value, str):
+            value = value.split(',')
+        terms.setdefault(column, []).extend(value)
+    return terms
+
+
+class DeviceInventory:
+
+    def __init__(self, path='DeviceDB.csv', verify_hash=False):
+        self.path = path
+        self.cache_path = path + '.idx'
+        self.verify_hash = verify_hash
+        self.signature = None
+        self.rows = []
+        self.indexes = {}
+        self.load()
+
+    def current_signature(self):
+        stat = os.stat(self.path)
+        signature = (CACHE_VERSION, stat.st_mtime_ns, stat.st_size)
+        if self.verify_hash:
+            with open(self.path, mode='rb') as devices:
+                signature += (hashlib.sha256(devices.read()).hexdigest(),)
+        return signature
+
+    def load(self):
+        signature = self.current_signature()
+        if signature == self.signature:
+            return
+        try:
+            with open(self.cache_path, mode='rb') as cache:
+                cached = pickle.load(cache)
+            if cached['signature'] == signature:
+                self.signature, self.rows, self.indexes = signature, cached['rows'], cached['indexes']
+                return
+        except (OSError, EOFError, pickle.UnpicklingError, KeyError, TypeError):
+            pass
+        self.compile(signature)
+
+    def compile(self, signature):
+        # One pass over the CSV builds a value -> row numbers index for every column.
+        with open(self.path, mode='r', newline='') as devices:
+            rows = list(csv.DictReader(devices))
+        indexes = {}
+        for number, row in enumerate(rows):
+            for column, value in row.items():
+                indexes.setdefault(column, {}).setdefault(value or '', []).append(number)
+        self.signature, self.rows, self.indexes = signature, rows, indexes
+        temp_path = self.cache_path + '.tmp'
+        try:
+            with open(temp_path, mode='wb') as cache:
+                pickle.dump({'signature': signature, 'rows': rows, 'indexes': indexes}, cache,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, self.cache_path)
+        except OSError:
+            pass
+
+    def lookup(self, column, patterns):
+        if column not in self.indexes:
+            raise KeyError(f'{self.path} has no column named {column}')
+        index = self.indexes[column]
+        matches = set()
+        for pattern in patterns:
+            if any(char in pattern for char in '*?['):
+                # Wildcards are matched against the distinct values, never the rows.
+                for value, numbers in index.items():
+                    if fnmatchcase(value, pattern):
+                        matches.update(numbers)
+            else:
+                matches.update(index.get(pattern, ()))
+        return matches
+
+    def select(self, selector=''):
+        self.load()
+        terms = parse_selector(selector)
+        numbers = None
+        for column, patterns in terms.items():
+            matches = self.lookup(column, patterns)
+            numbers = matches if numbers is None else numbers & matches
+            if not numbers:
+                return []
+        if numbers is None:
+            return list(self.rows)
+        return [self.rows[number] for number in sorted(numbers)]
+
+
+def load_inventory(path='DeviceDB.csv'):
+    # Kept per process; load() only re-reads when DeviceDB.csv has changed on disk.
+    inventory = _loaded.get(path)
+    if inventory is None:
+        inventory = _loaded[path] = DeviceInventory(path)
+    return inventory
@@ -1,10 +1,69 @@
-from multiprocessing import Queue, Process
-from netmiko import ConnectHandler
-from netmiko.ssh_exception import NetMikoTimeoutException, NetMikoAuthenticationException
+from ShowImports import netmiko
 from datetime import datetime
 from getpass import getpass
-import csv
+from ShowAsync import run_async
+from ShowPool import run_pool, close_pool, DEFAULT_WORKERS, RETRIES
+from ShowCapture import capture_path, open_capture
+from ShowSchedule import DeviceHistory
+from ShowProbe import probe_devices, PROBE_TIMEOUT
+from ShowParse import render, ParseCache, JUNOS_PARSERS, JUNOS_INTERFACES, PARSE_TTL
+from ShowLogin import logins
+from ShowSession import send_commands, stream_pipelined, sessions, JUMP_HOST
+from ShowTiming import RunReport, timing, SLOWEST
+from ShowWriter import ShowWriter
+from ShowLog import start_logging, stop_logging
+from ShowResults import ResultStore, ResultSink
+from ShowJournal import RunJournal, run_id
+from ConfigStore import ConfigStore, STORE
+from DeviceInventory import load_inventory, parse_selector
+from ShowOptions import add_run_options, apply_run_options
+import argparse
 import logging
+import os
+import shutil
+
+log = logging.getLogger('JunosShow')
+
+INSPECTION_COMMANDS = [
+    ('Version', 'show version'),
+    ('Chassis Hardware', 'show chassis hardware'),
+    ('Chassis Alarms', 'show chassis alarms'),
+    ('System Alarms', 'show system alarms'),
+    ('Interfaces Terse', 'show interfaces terse'),
+    ('Interface Descriptions', 'show interfaces descriptions'),
+    ('Interfaces', 'show interfaces'),
+    ('Routing Engine', 'show chassis routing-engine'),
+    ('Environment', 'show chassis environment'),
+    ('System Storage', 'show system storage'),
+    ('Commits', 'show system commit'),
+    ('Boot Messages', 'show system boot-messages'),
+    ('NTP Associations', 'show ntp associations'),
+    ('NTP Status', 'show ntp status'),
+]
+
+# Menu keyword -> (show command, dev_type, srx, view). dev_type and srx narrow the devices it runs on;
+# a view renders the parsed output, and all views of one show command share a single fetch.
+JUNOS_COMMANDS = {
+    'arp': ('arp', '', '', None),
+    'bgp': ('bgp summary', 'router', '', None),
+    'bgp down': ('bgp summary', 'router', '', 'down'),
+    'bgp summary': ('bgp summary', 'router', '', 'summary'),
+    'chassis': ('chassis hardware', '', '', None),
+    'chassis alarms': ('chassis alarms', '', '', None),
+    'configuration': ('configuration | display set | no-more', '', '', None),
+    'interfaces': ('interfaces terse', '', '', None),
+    'interfaces up': ('interfaces terse', '', '', 'up'),
+    'interfaces down': ('interfaces terse', '', '', 'down'),
+    'interfaces summary': ('interfaces terse', '', '', 'summary'),
+    'ospf': ('ospf neighbor', 'router', '', None),
+    'ospf down': ('ospf neighbor', 'router', '', 'down'),
+    'ospf summary': ('ospf neighbor', 'router', '', 'summary'),
+    'security ipsec': ('security ipsec security-associations', 'router', 'srx', None),
+    'services ipsec': ('services ipsec-vpn ipsec security-associations', 'router', 'nonsrx', None),
+    'system alarms': ('system alarms', '', '', None),
+    'version': ('version', '', '', None),
+    'vlans': ('vlans', 'switch', '', None),
+}
 
 
 def help_commands():
@@ -12,18 +71,23 @@ def help_commands():
           '   arp - Shows ARP on all devices,\n'
           '         (This command takes time and may cause timeout on some devices.)\n'
           '   bgp - Shows all BGP peers, summary statement is assumed.\n'
+          '   bgp down - Shows BGP peers that are not established.\n'
+          '   bgp summary - Shows BGP peer counts per device.\n'
           '   chassis - Shows the chassis hardware information.\n'
           '   chassis alarms - Shows the chassis alarms on one or many devices.\n'
           '   configuration - Shows configuration in the display set format.\n'
           '   custom - Allows a custom show command. Do not add the show statement\n'
           '            since it is already added for you.\n'
           '            ex: ntp associations, security ipsec security-associations \n'
-          '   inspection - Inspect a single device showing a wide range of criteria\n'
-          '                and outputs the information to a file.\n'
+          '   inspection - Inspect one device or every router/switch showing a wide range\n'
+          '                of criteria and outputs the information to a file per device.\n'
           '   interfaces - Shows interfaces in terse.\n'
           '   interfaces up - Shows interfaces that are up.\n'
           '   interfaces down - Shows interfaces that are down.\n'
+          '   interfaces summary - Shows interface up/down counts per device.\n'
           '   ospf - Shows all OSPF neighbor information the neighbor statement is assumed.\n'
+          '   ospf down - Shows OSPF neighbors that are not Full.\n'
+          '   ospf summary - Shows OSPF neighbor counts per device.\n'
           '   security ipsec - Shows ipsec for SRX\'s only.\n'
           '   services ipsec - Shows ipsec for M series devices only.\n'
           '   system alarms - Shows the system alarms on one or many devices.\n'
@@ -33,11 +97,85 @@ def help_commands():
 
 class JunosShow:
 
-    def __init__(self, username, password, ip, show_command):
+    def __init__(self, username, password, ip, show_command, workers=DEFAULT_WORKERS, engine='process',
+                 order='completion', echo=True, selector='', stream=False, compress=None, view=None,
+                 parse_ttl=PARSE_TTL, slowest=SLOWEST, prometheus=None,
+                 retries=RETRIES, probe=False, probe_timeout=PROBE_TIMEOUT, results=None):
         self.user = username
         self.passw = password
         self.ip_add = ip
         self.show = show_command
+        self.workers = workers
+        self.engine = engine
+        self.order = order
+        self.echo = echo
+        self.selector = selector
+        self.stream = stream
+        self.compress = compress
+        self.view = view
+        self.parse_ttl = parse_ttl
+        self.slowest = slowest
+        self.prometheus = prometheus
+        self.retries = retries
+        self.probe = probe
+        self.probe_timeout = probe_timeout
+        self.results = results
+
+    def inspect(self, device, hostname, path):
+        # All inspection commands share one session and are pipelined, then written as sections.
+        commands = [command for title, command in INSPECTION_COMMANDS]
+        with sessions.checkout(device, timeout=60) as net_connect:
+            outputs = None
+            if not self.stream:
+                with timing.phase('command'):
+                    outputs = send_commands(net_connect, commands)
+            with open_capture(capture_path(path, self.compress), self.compress) as save_file:
+                save_file.write(f'#############{hostname}############')
+                if outputs is None:
+                    sections = []
+
+                    def write(index, line):
+                        while len(sections) <= index:
+                            save_file.write(f'\n------- {INSPECTION_COMMANDS[len(sections)][0]} -------\n')
+                            sections.append(index)
+                        save_file.write(line)
+                    with timing.phase('command'):
+                        stream_pipelined(net_connect, commands, write)
+                else:
+                    with timing.phase('write'):
+                        for (title, command), output in zip(INSPECTION_COMMANDS, outputs):
+                            save_file.write(f'\n------- {title} -------\n')
+                            save_file.write(output)
+                save_file.write(f'###################{hostname}###############')
+        log.info(f'Inspection saved to {path}', extra={'hostname': hostname})
+
+    def junos_inspection(self, today, device, hostname):
+        try:
+            self.inspect(device, hostname, os.path.join('output', 'inspection', f'{hostname} {today}.txt'))
+        except (netmiko.NetMikoTimeoutException, netmiko.NetMikoAuthenticationException, ValueError) as error:
+            self.failure(hostname, error)
+
+    def junos_inspection_many(self, set_dev_type, srx_non_srx):
+        today = datetime.now().strftime('%Y%m%d-%H%M')
+        start = datetime.now()
+        os.makedirs(os.path.join('output', 'inspection'), exist_ok=True)
+        history = DeviceHistory()
+        selected = history.schedule(self.select_devices(set_dev_type, srx_non_srx), 'inspection')
+        report = RunReport(f'{today} junos inspection', self.slowest, self.prometheus)
+        if self.probe:
+            selected = probe_devices(selected, self.failure, report, self.probe_timeout)
+        collection = datetime.now()
+        run_pool(self.junos_inspection, [(today, device, hostname) for hostname, device in selected], self.workers,
+                 report=report, retries=self.retries)
+        report.stage('collection', (datetime.now() - collection).total_seconds())
+        history.update(report, 'inspection')
+        history.save()
+        report.close()
+        end_time = datetime.now() - start
+        print(f'Total time to run = {end_time}')
+        print("##########################################################\n\n"
+              f"Complete! See {os.path.join('output', 'inspection')} to review the output!\n\n"
+              "##########################################################\n")
 
     def junos_device_inspection(self):
         print('Enter the target IP you would like to run this inspection on. \n CTRL-C to cancel at anytime\n')
@@ -51,181 +189,255 @@ class JunosShow:
         try:
             print('Device inspection requires output to a file.\n Please enter the output filename.\n')
             filename = input('Filename:')
-            save_file = open(f'output\{filename}.txt', mode='w')
-            print(f"\n--------------- Begin {ip} ---------------")
-            print('Running Inspection process.....')
-            net_connect = ConnectHandler(**device, global_delay_factor=4, timeout=60)
-            version = net_connect.send_command('show version')
-            chassis_hardware = net_connect.send_command('show chassis hardware')
-            chassis_alarms = net_connect.send_command('show chassis alarms')
-            system_alarms = net_connect.send_command('show system alarms')
-            interfaces_terse = net_connect.send_command('show interfaces terse')
-            descriptions = net_connect.send_command('show interfaces descriptions')
-            interfaces = net_connect.send_command('show interfaces')
-            print('Almost Done.')
-            routing_engine = net_connect.send_command('show chassis routing-engine')
-            environment = net_connect.send_command('show chassis environment')
-            storage = net_connect.send_command('show system storage')
-            commits = net_connect.send_command('show system commit')
-            boot_messages = net_connect.send_command('show system boot-messages')
-            ntp_associations = net_connect.send_command('show ntp associations')
-            ntp_status = net_connect.send_command('show ntp status')
-            print('Show commands complete Finalizing.')
-            net_connect.disconnect()
-            print(f"--------------- END {ip} ---------------\n")
-            save_file.write(f'#############{ip}############')
-            save_file.write('\n-------Version-------')
-            save_file.write(f'{version}')
-            save_file.write('\n------- Chassis Hardware -------')
-            save_file.write(f'{chassis_hardware}')
-            save_file.write('\n------- Chassis Alarms -------')
-            save_file.write(f'{chassis_alarms}')
-            save_file.write('\n------- System Alarms -------')
-            save_file.write(f'{system_alarms}')
-            save_file.write('\n------- Interfaces Terse -------')
-            save_file.write(f'{interfaces_terse}')
-            save_file.write('\n------- Interface Descriptions -------')
-            save_file.write(f'{descriptions}')
-            save_file.write('\n------- Interfaces -------')
-            save_file.write(f'{interfaces}')
-            save_file.write('\n------- Routing Engine -------')
-            save_file.write(f'{routing_engine}')
-            save_file.write('\n------- Environment -------')
-            save_file.write(f'{environment}')
-            save_file.write('\n------- System Storage -------')
-            save_file.write(f'{storage}')
-            save_file.write('\n------- Commits -------')
-            save_file.write(f'{commits}')
-            save_file.write('\n------- Boot Messages -------')
-            save_file.write(f'{boot_messages}')
-            save_file.write('\n------- NTP Associations -------')
-            save_file.write(f'{ntp_associations}')
-            save_file.write('\n------- NTP Status-------')
-            save_file.write(f'{ntp_status}')
-            save_file.write(f'###################{ip}###############')
-            save_file.close()
+            path = os.path.join('output', f'{filename}.txt')
+            self.inspect(device, ip, path)
             print("##########################################################\n\n"
-                  f"Complete! See output\{filename}.txt to review the output!\n"
+                  f"Complete! See {path} to review the output!\n"
                   "##########################################################\n")
-        except NetMikoTimeoutException:
+        except netmiko.NetMikoTimeoutException as error:
             print(f"SSH is not working to {ip}. Insure device is reachable")
-            logging.warning(f"{datetime.now()}: SSH is not working to {ip}. Insure device is reachable."
-                            "Verify CSV file has the correct IP.")
-        except NetMikoAuthenticationException:
+            self.failure(ip, error)
+        except netmiko.NetMikoAuthenticationException as error:
             print(f"Check your Username/Password. Make sure you have an account on {ip}.")
-            logging.warning(f"{datetime.now()}: Check your username/password."
-                            " Make sure you have an account on this device.")
-        except ValueError:
+            self.failure(ip, error)
+        except ValueError as error:
             print(f'There has been an error ensure you have the correct permissions to run this command. on {ip}')
-            logging.warning(f'{datetime.now()}: Check your username/password.'
-                            f' Make sure you have the correct permissions to access {ip}.')
+            self.failure(ip, error)
+
+    def block_parts(self, hostname):
+        header = f"\n--------------- Begin {hostname} ---------------"
+        footer = f"--------------- END {hostname} ---------------\n"
+        return header, footer
+
+    def block(self, hostname, output):
+        header, footer = self.block_parts(hostname)
+        return header + output + footer
+
+    def capture(self, net_connect, command, path, header='', footer='', compress=None):
+        # Streams one command's output to path as it arrives so worker memory stays flat.
+        with open_capture(path, compress) as capture:
+            capture.write(header)
+            stream_pipelined(net_connect, [command], lambda index, line: capture.write(line))
+            capture.write(footer)
+
+    def save_config(self, today, hostname, output):
+        # Unchanged configs only add a history line; changes are stored once and diffed.
+        if self.echo:
+            print(self.block(hostname, output))
+        with timing.phase('write'):
+            entry, diff = ConfigStore().save(hostname, output, today)
+        if diff:
+            log.info(f'Configuration changed, see {ConfigStore().diff_path(hostname, today)}',
+                     extra={'hostname': hostname})
+
+    def save_config_capture(self, today, hostname, path):
+        with timing.phase('write'):
+            entry, diff = ConfigStore().save_file(hostname, path, today)
+        os.remove(path)
+        if diff:
+            log.info(f'Configuration changed, see {ConfigStore().diff_path(hostname, today)}',
+                     extra={'hostname': hostname})
+
+    def failure(self, hostname, error):
+        # Sent to the log listener in the parent; the console only counts failures on the progress line.
+        timing.fail(error)
+        if isinstance(error, netmiko.NetMikoTimeoutException):
+            message = 'SSH is not working. Insure device is reachable. Verify correct IP in [juniper devices.csv]'
+        elif isinstance(error, netmiko.NetMikoAuthenticationException):
+            message = 'Check your username/password. Make sure you have an account on this device.'
+        elif type(error) is ValueError:
+            message = 'Check your username/password. Make sure you have the correct permissions on this device.'
+        else:
+            message = f'Unexpected {type(error).__name__} while collecting from this device.'
+        # One line per record; netmiko appends a multi-line list of common causes.
+        detail = (str(error).splitlines() or [''])[0]
+        log.warning(f'{message} ({detail})', extra={'hostname': hostname, 'error': type(error).__name__})
 
     def junos_config(self, today, device, hostname):
-        logging.basicConfig(filename='logs\JunosShowFailure.log', level=logging.WARNING)
-        # Turns on logging to a file named JunosShowFailure.
         try:
-            save_file = open(f'output\configs\{hostname} {today}.txt', mode='w')
-            net_connect = ConnectHandler(**device, timeout=60)
-            output = f"\n--------------- Begin {hostname} ---------------"
-            output += net_connect.send_command(f'show {self.show}')
-            output += f"--------------- END {hostname} ---------------\n"
-            net_connect.disconnect()
-            print(output)
-            save_file.write(output)
-            save_file.close()
-        except NetMikoTimeoutException:
-            print(f"SSH is not working to {hostname}. Insure device is reachable")
-            logging.warning(f"{datetime.now()}: SSH is not working to {hostname}. Insure device is reachable."
-                            "Verify correct IP in [juniper devices.csv]")
-            pass
-        except NetMikoAuthenticationException:
-            print(f"Check your Username/Password for {hostname}. Make sure you have an account on this device.")
-            logging.warning(f"{datetime.now()}: Check your username/password for {hostname}."
-                            " Make sure you have an account on this device.")
-            pass
-        except ValueError:
-            print(f'There has been an error ensure you have the correct permissions to run this command. on {hostname}')
-            logging.warning(f'{datetime.now()}: Check your username/password.'
-                            f' Make sure you have the correct permissions to access {hostname}.')
-            pass
+            if self.stream:
+                os.makedirs(STORE, exist_ok=True)
+                path = os.path.join(STORE, f'{hostname} {today}.tmp')
+                # Left uncompressed, the config store reads it back line by line and compresses what it keeps.
+                with sessions.checkout(device, timeout=60) as net_connect, timing.phase('command'):
+                    self.capture(net_connect, f'show {self.show}', path)
+                self.save_config_capture(today, hostname, path)
+                return
+            with sessions.checkout(device, timeout=60) as net_connect, timing.phase('command'):
+                output = net_connect.send_command(f'show {self.show}')
+            self.save_config(today, hostname, output)
+        except (netmiko.NetMikoTimeoutException, netmiko.NetMikoAuthenticationException, ValueError) as error:
+            self.failure(hostname, error)
 
-    def junos_command(self, today, device, filename, hostname):
-        logging.basicConfig(filename='logs\JunosShowFailure.log', level=logging.WARNING)
-        # Turns on logging to a file named JunosShowFailure.
+    def parsed(self, device, hostname):
+        # Parsed records come from the cache while fresh; otherwise one fetch refreshes every view.
+        kind, parser = JUNOS_PARSERS[self.show]
+        cache = ParseCache(self.parse_ttl)
+        records = cache.get(hostname, kind)
+        if records is None:
+            with sessions.checkout(device, timeout=60) as net_connect, timing.phase('command'):
+                output = net_connect.send_command(f'show {self.show}')
+            records = parser(output)
+            cache.put(hostname, kind, records)
+        return records
+
+    def render(self, records):
+        kind = JUNOS_PARSERS[self.show][0]
+        return render(kind, self.view, records, JUNOS_INTERFACES if kind == 'interfaces' else None)
+
+    def show_output(self, device, hostname):
+        if self.view:
+            return self.render(self.parsed(device, hostname))
+        with sessions.checkout(device) as net_connect, timing.phase('command'):
+            output = net_connect.send_command(f'show {self.show}')
+        return output
+
+    def junos_parsed(self, device, hostname):
         try:
-            save_file = open(f'output\{filename} {today}.txt', mode='a')
-            net_connect = ConnectHandler(**device, timeout=60)
-            output = f"\n--------------- Begin {hostname} ---------------"
-            output += net_connect.send_command('show ' + self.show)
-            output += f"--------------- END {hostname} ---------------\n"
-            net_connect.disconnect()
-            print(output)
-            save_file.write(output)
-            save_file.close()
-        except NetMikoTimeoutException:
-            print(f"SSH is not working to {hostname}. Insure device is reachable")
-            logging.warning(f"{datetime.now()}: SSH is not working to {hostname}. Insure device is reachable."
-                            "Verify correct IP in [juniper devices.csv]")
-            pass
-        except NetMikoAuthenticationException:
-            print(f"Check your Username/Password for {hostname}. Make sure you have an account on this device.")
-            logging.warning(f"{datetime.now()}: Check your username/password for {hostname}."
-                            " Make sure you have an account on this device.")
-            pass
-        except ValueError:
-            print(f'There has been an error ensure you have the correct permissions to run this command. on {hostname}')
-            logging.warning(f'{datetime.now()}: Check your username/password.'
-                            f' Make sure you have the correct permissions to access {hostname}.')
-            pass
+            return hostname, self.parsed(device, hostname)
+        except (netmiko.NetMikoTimeoutException, netmiko.NetMikoAuthenticationException, ValueError) as error:
+            self.failure(hostname, error)
+
+    def sweep_parsed(self, selected, writer, report=None, journal=None):
+        # Devices with fresh cached records are answered without opening a session.
+        kind = JUNOS_PARSERS[self.show][0]
+        cache = ParseCache(self.parse_ttl)
+        stale = []
+        for hostname, device in selected:
+            records = cache.get(hostname, kind)
+            if records is None:
+                stale.append((device, hostname))
+            else:
+                writer.put(hostname, self.block(hostname, self.render(records)))
 
-    def junos_show_many(self, set_dev_type, srx_non_srx):
+        def on_result(hostname, records):
+            writer.put(hostname, self.block(hostname, self.render(records)))
+        print(f'{len(selected) - len(stale)} devices answered from parsed records, {len(stale)} to fetch.')
+        run_pool(self.junos_parsed, stale, self.workers, on_result, report, retries=self.retries, journal=journal)
+
+    def junos_command(self, device, hostname, parts=None):
+        # Returns the output block to the parent, which hands it to the single ShowWriter.
+        # When streaming, the block goes to a file under parts and only its path is returned.
+        try:
+            if self.stream and parts is not None:
+                path = capture_path(os.path.join(parts, f'{hostname}.txt'), self.compress)
+                header, footer = self.block_parts(hostname)
+                with sessions.checkout(device, timeout=60) as net_connect, timing.phase('command'):
+                    self.capture(net_connect, 'show ' + self.show, path, header + '\n', footer, self.compress)
+                return hostname, path
+            with sessions.checkout(device, timeout=60) as net_connect, timing.phase('command'):
+                output = net_connect.send_command('show ' + self.show)
+            return hostname, self.block(hostname, output)
+        except (netmiko.NetMikoTimeoutException, netmiko.NetMikoAuthenticationException, ValueError) as error:
+            self.failure(hostname, error)
+
+    def result_sink(self, report):
+        if self.results is None:
+            return None
+        command = f'{self.show} [{self.view}]' if self.view else self.show
+        return ResultSink(ResultStore(self.results), report.name, command, report)
+
+    def select_devices(self, set_dev_type, srx_non_srx):
+        # Filters come from the indexed inventory instead of scanning DeviceDB.csv row by row.
+        terms = parse_selector(self.selector)
+        terms['device_type'] = ['juniper']
+        if set_dev_type:
+            terms['dev_type'] = [set_dev_type]
+        if srx_non_srx:
+            terms['srx'] = [srx_non_srx]
+        selected = []
+        for row in load_inventory().select(terms):
+            device = {
+                'device_type': row['device_type'],
+                'ip': row['IP_Address'],
+                'username': self.user,
+                'password': self.passw,
+            }
+            if row.get('port'):
+                device['port'] = int(row['port'])
+            if row.get(JUMP_HOST):
+                device[JUMP_HOST] = row[JUMP_HOST]
+            selected.append((row['HostName'], logins.tag(device, row)))
+        return selected
+
+    def junos_show_many(self, set_dev_type, srx_non_srx, filename=None, journal=None, failed_only=False):
+        # A new run journals every device as pending; a resumed one only goes back to the devices its
+        # journal does not have as done, or only the failed ones.
         today = datetime.now().strftime('%Y%m%d-%H%M')
         start = datetime.now()
-        Queue(maxsize=20)
-        process = []
-        filename = ''
-        if 'configuration' in self.show:
+        if journal is not None:
+            today = journal.header['today']
+            filename = journal.header['filename']
+        elif 'configuration' in self.show:
             pass
-        else:
+        elif filename is None:
             filename = input('\nFilename for output: ')
-        with open("DeviceDB.csv", mode='r') as devices:
-            reader = csv.DictReader(devices)
-            for row in reader:
-                device_type = row['device_type']
-                ip = row['IP_Address']
-                hostname = row['HostName']
-                dev_type = row['dev_type']
-                srx = row['srx']
-                device = {
-                    'device_type': device_type,
-                    'ip': ip,
-                    'username': self.user,
-                    'password': self.passw,
-                }
-                if device_type == 'juniper':
-                    pass
-                else:
-                    continue
-                if dev_type == set_dev_type and srx == srx_non_srx:
-                    pass
-                elif dev_type == set_dev_type and srx_non_srx == '':
-                    pass
-                elif set_dev_type == '' and srx_non_srx == '':
-                    pass
-                else:
-                    continue
-                if 'configuration' in self.show:
-                    my_process = Process(target=self.junos_config, args=(today, device, hostname))
-                    my_process.start()
-                    process.append(my_process)
-                else:
-                    my_process = Process(target=self.junos_command,
-                                         args=(today, device, filename, hostname))
-                    my_process.start()
-                    process.append(my_process)
+        history = DeviceHistory()
+        devices = self.select_devices(set_dev_type, srx_non_srx)
+        if journal is None:
+            journal = RunJournal(run_id(today, 'junos', filename or 'configuration'))
+            journal.start({'vendor': 'junos', 'today': today, 'filename': filename, 'show': self.show,
+                           'view': self.view, 'selector': self.selector, 'dev_type': set_dev_type,
+                           'srx': srx_non_srx, 'stream': self.stream, 'compress': self.compress},
+                          [hostname for hostname, device in devices])
+            print(f'Run {journal.run}')
+        else:
+            remaining = journal.remaining(failed_only)
+            devices = [(hostname, device) for hostname, device in devices if hostname in remaining]
+            print(f'Resuming run {journal.run}: {len(devices)} devices to collect, '
+                  f'{len(remaining) - len(devices)} no longer in the inventory.')
+        selected = history.schedule(devices, self.show)
+        report = RunReport(f"{today} junos {filename or 'configuration'}", self.slowest, self.prometheus)
+        if self.probe:
+            def on_unreachable(hostname, error):
+                self.failure(hostname, error)
+                journal.failed(hostname, type(error).__name__)
+            selected = probe_devices(selected, on_unreachable, report, self.probe_timeout)
+        collection = datetime.now()
 
-        for a_process in process:
-            a_process.join()
+        command = f'show {self.show}'
+        if 'no-more' not in command:
+            command += ' | no-more'
+        try:
+            if 'configuration' in self.show:
+                if self.engine == 'async':
+                    def on_config(hostname, output):
+                        self.save_config(today, hostname, output)
+                        journal.done([hostname])
+                    run_async(selected, command, on_config, self.failure, self.workers, report=report, journal=journal)
+                else:
+                    run_pool(self.junos_config, [(today, device, hostname) for hostname, device in selected],
+                             self.workers, report=report, retries=self.retries, journal=journal)
+            else:
+                path = capture_path(os.path.join('output', f'{filename} {today}.txt'), self.compress)
+                journal.trim(path)
+                writer = ShowWriter(path, self.order, self.echo, self.compress, report, self.result_sink(report),
+                                    journal)
+                parts = os.path.join('output', f'{filename} {today}.parts')
+                try:
+                    if self.view:
+                        self.sweep_parsed(selected, writer, report, journal)
+                    elif self.engine == 'async':
+                        def on_output(hostname, output):
+                            writer.put(hostname, self.block(hostname, output))
+                        run_async(selected, command, on_output, self.failure, self.workers, report=report,
+                                  journal=journal)
+                    elif self.stream:
+                        os.makedirs(parts, exist_ok=True)
+                        run_pool(self.junos_command, [(device, hostname, parts) for hostname, device in selected],
+                                 self.workers, writer.put_file, report, retries=self.retries, journal=journal)
+                    else:
+                        run_pool(self.junos_command, [(device, hostname) for hostname, device in selected],
+                                 self.workers, writer.put, report, retries=self.retries, journal=journal)
+                finally:
+                    writer.close()
+                    shutil.rmtree(parts, ignore_errors=True)
+        finally:
+            journal.close()
+        report.stage('collection', (datetime.now() - collection).total_seconds())
+        history.update(report, self.show)
+        history.save()
+        report.close()
 
         end_time = datetime.now() - start
         print(f'Total time to run = {end_time}')
@@ -234,8 +446,6 @@ class JunosShow:
               "##########################################################\n")
 
     def junos_show_one(self):
-        logging.basicConfig(filename='logs\JunosShowFailure.log', level=logging.WARNING)
-        # Turns on logging to a file named JunosShowFailure.
         device = {
             'device_type': 'juniper',
             'ip': self.ip_add,
@@ -246,10 +456,9 @@ class JunosShow:
             save = input('Would you like to save this output to a file? (yes/no)')
             if save.lower() == 'yes' or save.lower() == 'y':
                 filename = input('Filename:')
-                save_file = open(f'output\{filename}.txt', mode='w')
-                net_connect = ConnectHandler(**device)
-                show = net_connect.send_command(f'show {self.show}')
-                net_connect.disconnect()
+                path = os.path.join('output', f'{filename}.txt')
+                save_file = open(path, mode='w')
+                show = self.show_output(device, self.ip_add)
                 print(f"\n--------------- Begin {self.ip_add} ---------------")
                 print(show)
                 print(f"--------------- END {self.ip_add} ---------------\n")
@@ -258,38 +467,57 @@ class JunosShow:
                 save_file.write(f'###################{self.ip_add}###############')
                 save_file.close()
                 print("##########################################################\n\n"
-                      f"Complete! See output\{filename}.txt to review the output!\n"
+                      f"Complete! See {path} to review the output!\n"
                       "##########################################################\n")
             else:
-                net_connect = ConnectHandler(**device)
-                show = net_connect.send_command(f'show {self.show}')
-                net_connect.disconnect()
+                show = self.show_output(device, self.ip_add)
                 print(f"\n--------------- Begin {self.ip_add} ---------------")
                 print(show)
                 print(f"--------------- END {self.ip_add} ---------------\n")
-        except NetMikoTimeoutException:
+        except netmiko.NetMikoTimeoutException as error:
             print(f"SSH is not working to {self.ip_add}. Insure device is reachable")
-            logging.warning(f"{datetime.now()}: SSH is not working to {self.ip_add}. Insure device is reachable."
-                            "Verify CSV file has the correct IP.")
-        except NetMikoAuthenticationException:
+            self.failure(self.ip_add, error)
+        except netmiko.NetMikoAuthenticationException as error:
             print(f"Check your Username/Password. Make sure you have an account on this device.")
-            logging.warning(f"{datetime.now()}: Check your username/password."
-                            " Make sure you have an account on this device.")
-        except ValueError:
+            self.failure(self.ip_add, error)
+        except ValueError as error:
             print('There has been an error ensure you have the correct permissions'
                   f' to run this command. on {self.ip_add}')
-            logging.warning(f'{datetime.now()}: Check your username/password.'
-                            f' Make sure you have the correct permissions to access {self.ip_add}.')
+            self.failure(self.ip_add, error)
 
 
-def junos_show():
+def junos_show(journal=None, failed_only=False, **options):
     username = input('Username: ')
     password = getpass('Password: ')
+    # Keeps prompting until exit so the worker pool and cached sessions are reused between commands.
+    start_logging()
+    try:
+        if journal is not None:
+            junos_resume(username, password, journal, failed_only, options)
+        else:
+            while junos_show_command(username, password, options):
+                pass
+    finally:
+        close_pool()
+        stop_logging()
+        print(sessions.stats())
+
+
+def junos_resume(username, password, journal, failed_only, options):
+    # The journal header brings back the command, filters and output format of the original run.
+    header = journal.header
+    options = dict(options, selector=header['selector'], stream=header['stream'], compress=header['compress'])
+    JunosShow(username, password, '', header['show'], view=header['view'], **options).junos_show_many(
+        header['dev_type'], header['srx'], journal=journal, failed_only=failed_only)
+
+
+def junos_show_command(username, password, options):
     print('Insert the show command you wish to run.')
     loop = True
     show_command = ''
     set_dev_type = ''
     srx_non_srx = ''
+    view = None
     while loop:
         command = input("Show:")
         if command.lower() == 'help'or command == '?':
@@ -297,24 +525,7 @@ def junos_show():
         elif command == '':
             pass
         elif command.lower() == 'exit':
-            return
-        elif command.lower() == 'arp':
-            print('Arp may have a hard time showing on some devices keep an eye out for failures.')
-            show_command = 'arp'
-            loop = False
-        elif command.lower() == 'bgp':
-            set_dev_type = 'router'
-            show_command = 'bgp summary'
-            loop = False
-        elif command.lower() == 'chassis alarms':
-            show_command = 'chassis alarms'
-            loop = False
-        elif command.lower() == 'chassis':
-            show_command = 'chassis hardware'
-            loop = False
-        elif command.lower() == 'configuration':
-            show_command = 'configuration | display set | no-more'
-            loop = False
+            return False
         elif command.lower() == 'custom':
             question = input('Show on Router or Switch? ')
             if question.lower() == 'router':
@@ -334,39 +545,20 @@ def junos_show():
             show_command = input('show ')
             loop = False
         elif command.lower() == 'inspection':
-            JunosShow(username, password, ip='', show_command='').junos_device_inspection()
-        elif command.lower() == 'interfaces':
-            show_command = 'interfaces terse'
-            loop = False
-        elif command.lower() == 'interfaces up':
-            show_command = 'interfaces terse| match "ge-|fe-|lo0.0|gr-|te|st0|sp-|vlan|ae|reth" | match "up    up"'
-            loop = False
-        elif command.lower() == 'interfaces down':
-            show_command = 'interfaces terse| match "ge-|fe-|lo0.0|gr-|te|st0|sp-|vlan|ae|reth" | match "up    down"'
-            loop = False
-        elif command.lower() == 'ospf':
-            set_dev_type = 'router'
-            show_command = 'ospf neighbor'
-            loop = False
-        elif command.lower() == 'security ipsec':
-            set_dev_type = 'router'
-            srx_non_srx = "srx"
-            show_command = 'security ipsec security-associations'
-            loop = False
-        elif command.lower() == 'services ipsec':
-            set_dev_type = 'router'
-            srx_non_srx = "nonsrx"
-            show_command = 'services ipsec-vpn ipsec security-associations'
-            loop = False
-        elif command.lower() == 'system alarms':
-            show_command = 'system alarms'
-            loop = False
-        elif command.lower() == 'version':
-            show_command = 'version'
-            loop = False
-        elif command.lower() == 'vlans':
-            set_dev_type = 'switch'
-            show_command = 'vlans'
+            one_or_all = input('Inspect one device or all? (one/all): ')
+            if one_or_all.lower() == 'all':
+                question = input('Inspect Routers, Switches or all? (router/switch/all): ')
+                if question.lower() in ('router', 'switch'):
+                    set_dev_type = question.lower()
+                JunosShow(username, password, ip='', show_command='',
+                          **options).junos_inspection_many(set_dev_type, srx_non_srx)
+                set_dev_type = ''
+            else:
+                JunosShow(username, password, ip='', show_command='', **options).junos_device_inspection()
+        elif command.lower() in JUNOS_COMMANDS:
+            if command.lower() == 'arp':
+                print('Arp may have a hard time showing on some devices keep an eye out for failures.')
+            show_command, set_dev_type, srx_non_srx, view = JUNOS_COMMANDS[command.lower()]
             loop = False
         else:
             print('Please enter a valid show command.')
@@ -376,7 +568,7 @@ def junos_show():
         if one_or_all.lower() == "one":
             ip = input('Please enter the target IP address: ')
             start_time = datetime.now()
-            JunosShow(username, password, ip, show_command).junos_show_one()
+            JunosShow(username, password, ip, show_command, view=view, **options).junos_show_one()
             end_time = datetime.now()
             total_time = end_time - start_time
             one_or_all_q = False
@@ -384,7 +576,8 @@ def junos_show():
             print(f'All {set_dev_type} devices will be issued {command}.\n\n')
             start_time = datetime.now()
             ip = ''
-            JunosShow(username, password, ip, show_command).junos_show_many(set_dev_type, srx_non_srx)
+            JunosShow(username, password, ip, show_command, view=view,
+                      **options).junos_show_many(set_dev_type, srx_non_srx)
             end_time = datetime.now()
             total_time = end_time - start_time
             one_or_all_q = False
@@ -394,6 +587,11 @@ def junos_show():
           "Complete! See JunosShowFailure log for errors!\n"
           f"Total time: {total_time}\n\n"
           "###################################################\n")
+    return True
 
 if __name__ == '__main__':
-    junos_show()
+    parser = argparse.ArgumentParser(description='Run show commands against Juniper devices.')
+    add_run_options(parser)
+    options = vars(parser.parse_args())
+    journal, retry_failed = apply_run_options(parser, options, 'junos')
+    junos_show(journal, retry_failed, **options)
@@ -0,0 +1,80 @@
+from ShowImports import netmiko, load, LazyModule
+from ShowLog import Progress
+from ShowLogin import logins
+from ShowSession import JUMP_HOST
+from datetime import datetime
+import asyncio
+import time
+
+asyncssh = LazyModule('asyncssh')
+
+
+async def _collect(hostname, device, command, semaphore, timeout):
+    # asyncssh opens TCP and authenticates in one call, so both are timed as the auth phase.
+    async with semaphore:
+        started = time.monotonic()
+        events = []
+        error = None
+        phase_start = time.time()
+        try:
+            timeout = device.get('timeout', timeout)
+            if logins.buckets is not None:
+                for key in logins.keys(device):
+                    await asyncio.sleep(logins.buckets.reserve(key))
+                events.append({'phase': 'queue', 'start': phase_start, 'seconds': time.time() - phase_start})
+                phase_start = time.time()
+            conn = await asyncssh.connect(device['ip'], port=device.get('port', 22),
+                                          username=device['username'], password=device['password'],
+                                          known_hosts=None, connect_timeout=timeout)
+            events.append({'phase': 'auth', 'start': phase_start, 'seconds': time.time() - phase_start})
+            phase_start = time.time()
+            async with conn:
+                result = await asyncio.wait_for(conn.run(command, check=False), timeout)
+            events.append({'phase': 'command', 'start': phase_start, 'seconds': time.time() - phase_start})
+        except asyncssh.PermissionDenied as denied:
+            error = netmiko.NetMikoAuthenticationException(str(denied))
+        except (OSError, asyncio.TimeoutError, asyncssh.Error) as failed:
+            error = netmiko.NetMikoTimeoutException(str(failed))
+    record = {'hostname': hostname, 'seconds': time.monotonic() - started, 'events': events,
+              'error': type(error).__name__ if error else None}
+    return hostname, None if error else result.stdout, error, record
+
+
+async def _sweep(jobs, command, on_output, on_failure, sessions, timeout, report, progress, journal):
+    semaphore = asyncio.Semaphore(sessions)
+    tasks = [_collect(hostname, device, command, semaphore, timeout) for hostname, device in jobs]
+    done = 0
+    for task in asyncio.as_completed(tasks):
+        hostname, output, error, record = await task
+        if report is not None:
+            report.add(record)
+        progress.update(record['error'])
+        if error is None:
+            on_output(hostname, output)
+            done += 1
+        else:
+            on_failure(hostname, error)
+            if journal is not None:
+                journal.failed(hostname, record['error'])
+    return done
+
+
+def run_async(jobs, command, on_output, on_failure, sessions, timeout=60, report=None, journal=None):
+    # One event loop holds every SSH session; the semaphore caps how many are open at once.
+    # Only failures are journaled here; on_output journals a device once its output is stored.
+    try:
+        load('asyncssh')
+    except ImportError:
+        raise RuntimeError('The async engine requires asyncssh. Install it with "pip install asyncssh".')
+    if any(device.get(JUMP_HOST) for hostname, device in jobs):
+        raise RuntimeError('Devices behind a jump host are only reached by the process engine.')
+    logins.start()
+    start = datetime.now()
+    progress = Progress(len(jobs), sessions)
+    done = asyncio.run(_sweep(jobs, command, on_output, on_failure, sessions, timeout, report, progress,
+                              journal))
+    progress.close()
+    elapsed = (datetime.now() - start).total_seconds()
+    rate = len(jobs) / elapsed if elapsed else 0.0
+    print(f'Devices: {len(jobs)}  Sessions: {sessions}  Throughput: {rate:.2f} devices/sec')
+    return done
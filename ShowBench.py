@@ -0,0 +1,577 @@
+from multiprocessing import Process, Pipe
+from datetime import datetime
+from threading import Thread, Event, Lock
+from collections import deque
+from JunosShow import JunosShow
+from CiscoShow import CiscoShow
+from ShowPool import close_pool, DEFAULT_WORKERS, RETRIES
+from ShowTiming import percentiles, read_phases, TIMING_DIR
+from ShowJournal import JOURNAL_DIR
+from ShowLog import start_logging, stop_logging
+from ShowLogin import logins
+from ShowSession import sessions
+import argparse
+import csv
+import json
+import logging
+import os
+import random
+import selectors
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import paramiko
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+RESULTS = os.path.join('bench', 'results.jsonl')
+
+# Replies to the paging and terminal commands netmiko sends while it sets up a session.
+SETUP_REPLIES = {
+    'set cli screen-length': 'Screen length set to 0\r\n',
+    'set cli screen-width': 'Screen width set to 511\r\n',
+    'set cli complete-on-space': 'Disabling complete-on-space\r\n',
+    'terminal length': '',
+    'terminal width': '',
+}
+
+ENTRIES = {
+    'show': 'Fleet show command (junos_show_many / CiscoShow.all).',
+    'config': 'Configuration backup into the config store.',
+    'inspection': 'Junos inspection of every device (junos_inspection_many).',
+}
+
+
+def peak_rss():
+    # ru_maxrss is KiB on Linux; the children figure is the largest pool worker that has exited.
+    if resource is None:
+        return None
+    return {'parent_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            'worker_kb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss}
+
+
+class SimDevice(paramiko.ServerInterface):
+
+    def __init__(self, hostname, behavior, admit):
+        self.hostname = hostname
+        self.behavior = behavior
+        self.admit = admit
+        self.username = ''
+        self.authed = None
+        self.exec_command = None
+        self.ready = Event()
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_auth_password(self, username, password):
+        if self.behavior == 'auth' or not self.admit():
+            return paramiko.AUTH_FAILED
+        self.username = username
+        self.authed = time.monotonic()
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_pty_request(self, channel, term, width, height, pixelwidth, pixelheight, modes):
+        return True
+
+    def check_channel_shell_request(self, channel):
+        self.ready.set()
+        return True
+
+    def check_channel_exec_request(self, channel, command):
+        self.exec_command = command.decode(errors='replace')
+        self.ready.set()
+        return True
+
+
+class DeviceFarm:
+
+    def __init__(self, options, behaviors):
+        # One listening socket per simulated device, all accepted from a single selector loop.
+        self.options = options
+        self.behaviors = behaviors
+        self.random = random.Random(options['seed'])
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self.selector = selectors.DefaultSelector()
+        self.ports = {}
+        self.records = []
+        self.outputs = {}
+        self.logins = deque()
+        self.logins_lock = Lock()
+
+    def admit(self):
+        # One AAA server behind every device that turns logins away past aaa_rate a second, like an
+        # overloaded TACACS+ or RADIUS backend.
+        rate = self.options.get('aaa_rate')
+        if not rate:
+            return True
+        with self.logins_lock:
+            now = time.monotonic()
+            while self.logins and now - self.logins[0] > 1.0:
+                self.logins.popleft()
+            if len(self.logins) >= rate:
+                return False
+            self.logins.append(now)
+            return True
+
+    def listen(self):
+        for hostname in self.behaviors:
+            listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            listener.bind(('127.0.0.1', 0))
+            self.ports[hostname] = listener.getsockname()[1]
+            if self.behaviors[hostname] == 'down':
+                # The port is closed again so connections to it are refused, like a device that is off.
+                listener.close()
+                continue
+            listener.listen(64)
+            listener.setblocking(False)
+            self.selector.register(listener, selectors.EVENT_READ, hostname)
+        return self.ports
+
+    def serve(self, conn):
+        while not conn.poll():
+            for key, events in self.selector.select(0.2):
+                try:
+                    client, address = key.fileobj.accept()
+                except BlockingIOError:
+                    continue
+                client.setblocking(True)
+                Thread(target=self.session, args=(client, key.data), daemon=True).start()
+        for key in list(self.selector.get_map().values()):
+            key.fileobj.close()
+
+    def prompt(self, device):
+        if self.options['vendor'] == 'junos':
+            return f'{device.username}@{device.hostname}> '
+        return f'{device.hostname}#'
+
+    def output(self, command):
+        # Interface-table shaped lines, so parsed views have something to work on too.
+        if command not in self.outputs:
+            lines = []
+            for number in range(self.options['lines']):
+                address = f'10.{number // 65536 % 256}.{number // 256 % 256}.{number % 256}'
+                if self.options['vendor'] == 'junos':
+                    lines.append(f'ge-0/{number // 48 % 8}/{number % 48}.{number // 384:<10} up    up   inet     '
+                                 f'{address}/31')
+                else:
+                    lines.append(f'GigabitEthernet{number // 48}/{number % 48:<8} {address:<15} YES NVRAM  '
+                                 'up                    up')
+            self.outputs[command] = '\r\n'.join(lines) + '\r\n'
+        return self.outputs[command]
+
+    def reply(self, device, command, record):
+        if not command:
+            return ''
+        if command.startswith('show'):
+            if 'setup' not in record:
+                record['setup'] = time.monotonic() - device.authed
+            jitter = self.options['jitter']
+            time.sleep(max(0.0, self.options['latency'] * (1 + self.random.uniform(-jitter, jitter))))
+            return self.output(command)
+        for prefix, reply in SETUP_REPLIES.items():
+            if command.startswith(prefix):
+                return reply
+        if self.options['vendor'] == 'junos':
+            return f"{' ' * len(self.prompt(device))}^\r\nunknown command.\r\n"
+        return "% Invalid input detected at '^' marker.\r\n"
+
+    def shell(self, channel, device, record):
+        prompt = self.prompt(device)
+        time.sleep(self.options['prompt_delay'])
+        channel.sendall(''.join(f'Simulated {device.hostname} banner line {number}\r\n'
+                                for number in range(self.options['banner'])) + '\r\n' + prompt)
+        pending = ''
+        while True:
+            data = channel.recv(65536)
+            if not data:
+                return
+            pending += data.decode(errors='replace').replace('\r\n', '\n').replace('\r', '\n')
+            while '\n' in pending:
+                line, pending = pending.split('\n', 1)
+                command = line.strip()
+                if command in ('exit', 'quit'):
+                    return
+                started = time.monotonic()
+                channel.sendall(line + '\r\n' + self.reply(device, command, record) + prompt)
+                if command.startswith('show'):
+                    record['commands'].append(time.monotonic() - started)
+
+    def session(self, client, hostname):
+        behavior = self.behaviors[hostname]
+        record = {'hostname': hostname, 'behavior': behavior, 'commands': [], 'time': time.time()}
+        accepted = time.monotonic()
+        transport = paramiko.Transport(client)
+        transport.add_server_key(self.host_key)
+        device = SimDevice(hostname, behavior, self.admit)
+        try:
+            transport.start_server(server=device)
+            channel = transport.accept(60)
+            if channel is not None and device.ready.wait(10):
+                record['connect'] = device.authed - accepted
+                if behavior == 'timeout':
+                    # Logs in and then never shows a prompt, like a hung control plane.
+                    time.sleep(self.options['hang'])
+                elif device.exec_command is not None:
+                    started = time.monotonic()
+                    channel.sendall(self.reply(device, device.exec_command.strip(), record))
+                    record['commands'].append(time.monotonic() - started)
+                    channel.send_exit_status(0)
+                else:
+                    self.shell(channel, device, record)
+        except Exception:
+            pass
+        finally:
+            record['session'] = time.monotonic() - accepted
+            self.records.append(record)
+            transport.close()
+
+
+class SimBastion(paramiko.ServerInterface):
+
+    def __init__(self):
+        # Channel id -> (host, port) the client asked to be forwarded to.
+        self.destinations = {}
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_direct_tcpip_request(self, chanid, origin, destination):
+        self.destinations[chanid] = destination
+        return paramiko.OPEN_SUCCEEDED
+
+
+def pump(source, target):
+    try:
+        while True:
+            data = source.recv(65536)
+            if not data:
+                break
+            target.sendall(data)
+    except (OSError, EOFError):
+        pass
+    finally:
+        # shutdown() wakes the other direction's recv(); close() alone waits for it to return.
+        for end in (source, target):
+            try:
+                end.shutdown(socket.SHUT_RDWR)
+                end.close()
+            except (OSError, EOFError):
+                # A channel whose bastion transport is already gone cannot send its close.
+                pass
+
+
+class Bastion:
+
+    def __init__(self):
+        # A jump host forwarding direct-tcpip channels to the simulated devices; counts logins and channels.
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self.logins = 0
+        self.channels = 0
+
+    def session(self, client):
+        transport = paramiko.Transport(client)
+        transport.add_server_key(self.host_key)
+        server = SimBastion()
+        try:
+            transport.start_server(server=server)
+            self.logins += 1
+            while transport.is_active():
+                channel = transport.accept(1)
+                if channel is None:
+                    continue
+                self.channels += 1
+                device = socket.create_connection(server.destinations.pop(channel.get_id()))
+                Thread(target=pump, args=(channel, device), daemon=True).start()
+                Thread(target=pump, args=(device, channel), daemon=True).start()
+        except Exception:
+            pass
+        finally:
+            transport.close()
+
+    def serve(self, conn):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(64)
+        listener.settimeout(0.2)
+        conn.send(listener.getsockname()[1])
+        while not conn.poll():
+            try:
+                client, address = listener.accept()
+            except socket.timeout:
+                continue
+            client.settimeout(None)
+            Thread(target=self.session, args=(client,), daemon=True).start()
+        listener.close()
+        conn.recv()
+        conn.send({'logins': self.logins, 'channels': self.channels})
+
+
+def serve_bastion(conn):
+    logging.getLogger('paramiko').setLevel(logging.CRITICAL)
+    Bastion().serve(conn)
+
+
+def serve_farm(options, behaviors, conn):
+    logging.getLogger('paramiko').setLevel(logging.CRITICAL)
+    farm = DeviceFarm(options, behaviors)
+    conn.send(farm.listen())
+    farm.serve(conn)
+    conn.send(farm.records)
+
+
+def assign_behaviors(hostnames, options):
+    rng = random.Random(options['seed'])
+    behaviors = {}
+    for hostname in hostnames:
+        roll = rng.random()
+        if roll < options['fail_rate']:
+            behaviors[hostname] = 'auth'
+        elif roll < options['fail_rate'] + options['timeout_rate']:
+            behaviors[hostname] = 'timeout'
+        elif roll < options['fail_rate'] + options['timeout_rate'] + options['down_rate']:
+            behaviors[hostname] = 'down'
+        else:
+            behaviors[hostname] = 'ok'
+    return behaviors
+
+
+def write_inventory(path, ports, vendor, jump_host=''):
+    with open(path, mode='w', newline='') as devices:
+        writer = csv.writer(devices)
+        writer.writerow(['HostName', 'IP_Address', 'device_type', 'dev_type', 'srx', 'port', 'jump_host'])
+        for hostname, port in sorted(ports.items()):
+            writer.writerow([hostname, '127.0.0.1', 'juniper' if vendor == 'junos' else 'cisco_ios', 'router', '',
+                             port, jump_host])
+
+
+def run_entry(args):
+    options = {'workers': args.workers, 'engine': args.engine, 'order': args.order, 'echo': False,
+               'stream': args.stream, 'compress': args.compress, 'retries': args.retries,
+               'probe': args.probe}
+    if args.vendor == 'junos':
+        if args.entry == 'inspection':
+            JunosShow('bench', 'bench', '', '', **options).junos_inspection_many('', '')
+        elif args.entry == 'config':
+            JunosShow('bench', 'bench', '', 'configuration | display set | no-more',
+                      **options).junos_show_many('', '')
+        else:
+            JunosShow('bench', 'bench', '', args.command, **options).junos_show_many('', '', filename='bench')
+    elif args.entry == 'inspection':
+        raise SystemExit('Inspection is only available for Junos.')
+    elif args.entry == 'config':
+        CiscoShow('bench', 'bench', '', 'run', **options).all()
+    else:
+        CiscoShow('bench', 'bench', '', args.command, **options).all(filename='bench')
+
+
+def journals():
+    # Run IDs journaled in the scratch directory so far; inspection runs keep no journal.
+    return set(os.listdir(JOURNAL_DIR)) if os.path.isdir(JOURNAL_DIR) else set()
+
+
+def cold_start(modules, runs=3):
+    # Best of a few fresh interpreters, each timing only the import of the given modules.
+    code = f'import time; start = time.perf_counter(); import {modules}; print(time.perf_counter() - start)'
+    times = []
+    for run in range(runs):
+        output = subprocess.run([sys.executable, '-W', 'ignore', '-c', code], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+        times.append(float(output))
+    return round(min(times), 4)
+
+
+def version():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the show tools against simulated SSH devices on '
+                                                 'localhost.')
+    parser.add_argument('--devices', type=int, default=50, help='Number of simulated devices.')
+    parser.add_argument('--vendor', choices=['junos', 'ios'], default='junos')
+    parser.add_argument('--entry', choices=sorted(ENTRIES), default='show',
+                        help=' '.join(f'{name}: {text}' for name, text in sorted(ENTRIES.items())))
+    parser.add_argument('--command', default='version', help='Show command for the show entry, without "show".')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+    parser.add_argument('--engine', choices=['process', 'async'], default='process')
+    parser.add_argument('--order', choices=['completion', 'hostname'], default='completion')
+    parser.add_argument('--stream', action='store_true')
+    parser.add_argument('--retries', type=int, default=RETRIES)
+    parser.add_argument('--probe', action='store_true')
+    parser.add_argument('--compress', choices=['gzip', 'zstd'])
+    parser.add_argument('--latency', type=float, default=0.2, help='Seconds each show command takes.')
+    parser.add_argument('--jitter', type=float, default=0.25, help='Latency varies by up to this fraction.')
+    parser.add_argument('--lines', type=int, default=200, help='Output lines per show command.')
+    parser.add_argument('--banner', type=int, default=2, help='Banner lines sent before the first prompt.')
+    parser.add_argument('--prompt-delay', type=float, default=0.0,
+                        help='Seconds between login and the first prompt.')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='Fraction of devices that reject the login.')
+    parser.add_argument('--timeout-rate', type=float, default=0.0,
+                        help='Fraction of devices that log in but never show a prompt.')
+    parser.add_argument('--down-rate', type=float, default=0.0,
+                        help='Fraction of devices whose SSH port refuses connections.')
+    parser.add_argument('--aaa-rate', type=float, default=0.0,
+                        help='Logins a second the simulated AAA server accepts before rejecting them, 0 for no limit.')
+    parser.add_argument('--login-rate', type=float, help='Client side logins a second, see --login-rate of the tools.')
+    parser.add_argument('--fast-setup', action='store_true',
+                        help='Time a run with --fast-setup after an untimed run that learns every device\'s setup.')
+    parser.add_argument('--bastion', action='store_true',
+                        help='Reach every device through a simulated jump host on localhost.')
+    parser.add_argument('--hang', type=float, default=120.0, help='Seconds a timing-out device holds its session.')
+    parser.add_argument('--farm-processes', type=int, default=1,
+                        help='Processes serving the simulated devices, for runs with thousands of devices.')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--label', default='', help='Free text stored with the result, e.g. a branch name.')
+    parser.add_argument('--results', default=RESULTS, help='JSON lines file the result is appended to.')
+    parser.add_argument('--keep', action='store_true', help='Keep the temporary working directory.')
+    args = parser.parse_args()
+
+    results = os.path.abspath(args.results)
+    options = {'vendor': args.vendor, 'latency': args.latency, 'jitter': args.jitter, 'lines': args.lines,
+               'banner': args.banner, 'prompt_delay': args.prompt_delay, 'hang': args.hang, 'seed': args.seed,
+               'fail_rate': args.fail_rate, 'timeout_rate': args.timeout_rate, 'down_rate': args.down_rate,
+               'aaa_rate': args.aaa_rate}
+    hostnames = [f'sim{number:05d}' for number in range(args.devices)]
+    behaviors = assign_behaviors(hostnames, options)
+    farms = []
+    for shard in range(args.farm_processes):
+        conn, farm_conn = Pipe()
+        process = Process(target=serve_farm, daemon=True,
+                          args=(options, {hostname: behaviors[hostname]
+                                          for hostname in hostnames[shard::args.farm_processes]}, farm_conn))
+        process.start()
+        farms.append((process, conn))
+    ports = {}
+    for process, conn in farms:
+        ports.update(conn.recv())
+    bastion = None
+    jump_host = ''
+    if args.bastion:
+        conn, bastion_conn = Pipe()
+        bastion = Process(target=serve_bastion, args=(bastion_conn,), daemon=True), conn
+        bastion[0].start()
+        jump_host = f'bench@127.0.0.1:{conn.recv()}'
+
+    # The entry points use relative output, logs and DeviceDB.csv paths, so they run in a scratch directory.
+    home = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix='showbench-')
+    os.chdir(workdir)
+    os.makedirs('logs')
+    os.makedirs('output')
+    write_inventory('DeviceDB.csv', ports, args.vendor, jump_host)
+    print(f'{args.devices} simulated {args.vendor} devices ready, running {args.entry} in {workdir}')
+    logins.rate = args.login_rate
+    sessions.setups.enabled = args.fast_setup
+    start_logging()
+    try:
+        timed = time.time()
+        if args.fast_setup:
+            # The learning run is left out of every figure; a new pool makes the timed run log in again.
+            run_entry(args)
+            close_pool()
+            shutil.rmtree(TIMING_DIR)
+            timed = time.time()
+        learned = journals()
+        start = time.monotonic()
+        run_entry(args)
+        wall = time.monotonic() - start
+        close_pool()
+        stop_logging()
+        if learned and len(journals() - learned) != 1:
+            raise RuntimeError(f'The timed run did not write a journal of its own next to {sorted(learned)}')
+        rss = peak_rss()
+        client = {}
+        for name in os.listdir(TIMING_DIR):
+            for phase, values in read_phases(os.path.join(TIMING_DIR, name)).items():
+                client.setdefault(phase, []).extend(values)
+    finally:
+        os.chdir(home)
+        records = []
+        for process, conn in farms:
+            conn.send('stop')
+            records.extend(record for record in conn.recv() if record['time'] >= timed)
+            process.join()
+        bastion_stats = None
+        if bastion is not None:
+            process, conn = bastion
+            conn.send('stop')
+            bastion_stats = conn.recv()
+            process.join()
+        if args.keep:
+            print(f'Working directory kept at {workdir}')
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    answered = len({record['hostname'] for record in records if record['commands']})
+    result = {
+        'time': datetime.now().isoformat(timespec='seconds'),
+        'version': version(),
+        'label': args.label,
+        'entry': args.entry,
+        'vendor': args.vendor,
+        'command': args.command,
+        'devices': args.devices,
+        'workers': args.workers,
+        'engine': args.engine,
+        'stream': args.stream,
+        'compress': args.compress,
+        'retries': args.retries,
+        'probe': args.probe,
+        'login_rate': args.login_rate,
+        'fast_setup': args.fast_setup,
+        'bastion': bastion_stats,
+        'farm': options,
+        'wall_seconds': round(wall, 3),
+        'devices_per_sec': round(args.devices / wall, 3) if wall else None,
+        'answered': answered,
+        'sessions': len(records),
+        'peak_rss': rss,
+        'cold_start': {'menus': cold_start('JunosShow, CiscoShow'), 'netmiko': cold_start('netmiko')},
+        'phases': {
+            'connect': percentiles([record['connect'] for record in records if 'connect' in record]),
+            'setup': percentiles([record['setup'] for record in records if 'setup' in record]),
+            'command': percentiles([seconds for record in records for seconds in record['commands']]),
+            'session': percentiles([record['session'] for record in records]),
+        },
+        'client_phases': {phase: percentiles(values) for phase, values in client.items()},
+    }
+    os.makedirs(os.path.dirname(results) or '.', exist_ok=True)
+    with open(results, mode='a') as results_file:
+        results_file.write(json.dumps(result) + '\n')
+    print(f"\nWall: {result['wall_seconds']}s  Devices/sec: {result['devices_per_sec']}  "
+          f"Answered: {answered}/{args.devices}  Peak RSS: {rss}")
+    if bastion_stats is not None:
+        print(f"Bastion: {bastion_stats['logins']} logins, {bastion_stats['channels']} channels")
+    print(f"Cold start: menus {result['cold_start']['menus']}s, netmiko {result['cold_start']['netmiko']}s")
+    for phase, summary in result['phases'].items():
+        print(f'device {phase:<8} {summary}')
+    for phase, summary in result['client_phases'].items():
+        print(f'client {phase:<8} {summary}')
+    print(f'Result appended to {results}')
+
+
+if __name__ == '__main__':
+    main()
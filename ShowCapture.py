@@ -0,0 +1,51 @@
+import gzip
+import io
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+SUFFIXES = {None: '', 'gzip': '.gz', 'zstd': '.zst'}
+# Characters read back from a capture at a time.
+READ_SIZE = 4 * 1024 * 1024
+
+
+def capture_path(path, compress=None):
+    return path + SUFFIXES[compress]
+
+
+def open_capture(path, compress=None):
+    # Text file that compresses as it is written; compressed captures can be concatenated byte for byte.
+    if compress == 'gzip':
+        return gzip.open(path, mode='wt', compresslevel=6)
+    if compress == 'zstd':
+        if zstandard is None:
+            raise RuntimeError('zstd output requires zstandard. Install it with "pip install zstandard".')
+        return io.TextIOWrapper(zstandard.ZstdCompressor().stream_writer(open(path, mode='wb')))
+    return open(path, mode='w')
+
+
+def compress_bytes(data, compress=None):
+    if compress == 'gzip':
+        return gzip.compress(data, compresslevel=6)
+    if compress == 'zstd':
+        if zstandard is None:
+            raise RuntimeError('zstd output requires zstandard. Install it with "pip install zstandard".')
+        return zstandard.ZstdCompressor().compress(data)
+    return data
+
+
+def capture_chunks(path, compress=None, size=READ_SIZE):
+    # Yields the text of a capture a piece at a time, so a large one is never read into memory whole.
+    if compress == 'gzip':
+        capture = gzip.open(path, mode='rt')
+    elif compress == 'zstd':
+        if zstandard is None:
+            raise RuntimeError('zstd output requires zstandard. Install it with "pip install zstandard".')
+        capture = io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(open(path, mode='rb')))
+    else:
+        capture = open(path, mode='r')
+    with capture:
+        for chunk in iter(lambda: capture.read(size), ''):
+            yield chunk
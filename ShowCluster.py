@@ -0,0 +1,432 @@
+from ShowImports import netmiko
+from multiprocessing import Process, AuthenticationError
+from multiprocessing.connection import Listener, Client
+from threading import Thread, Condition, Event, Lock
+from datetime import datetime
+from fnmatch import fnmatchcase
+from getpass import getpass
+from JunosShow import JunosShow, JUNOS_COMMANDS
+from CiscoShow import CiscoShow, CISCO_COMMANDS
+from ShowPool import run_pool, close_pool, DEFAULT_WORKERS, RETRIES
+from ShowCapture import capture_path
+from ShowSchedule import DeviceHistory
+from ShowSession import sessions
+from ShowTiming import RunReport, timing, SLOWEST
+from ShowWriter import ShowWriter
+from ShowLog import start_logging, stop_logging, share_logging, Progress
+from ShowResults import RESULTS_DB
+from DeviceInventory import load_inventory
+from ShowOptions import address
+import argparse
+import hashlib
+import os
+import secrets
+import socket
+import time
+
+PORT = 7400
+SHARDS = 32
+# Site shards larger than this are split, so one big site is spread over several collectors.
+SHARD_SIZE = 200
+HEARTBEAT = 5
+# A collector that has sent nothing, not even a heartbeat, for this long is treated as dead.
+DEAD_AFTER = 4 * HEARTBEAT
+RECONNECT = 5
+
+# vendor -> (show class, menu command table)
+VENDORS = {
+    'junos': (JunosShow, JUNOS_COMMANDS),
+    'cisco': (CiscoShow, CISCO_COMMANDS),
+}
+
+
+def cluster_key():
+    return os.environ.get('SHOW_CLUSTER_KEY', '').encode()
+
+
+def is_config(vendor, show_command):
+    return 'configuration' in show_command if vendor == 'junos' else 'run' in show_command
+
+
+def fetch(show, device, hostname):
+    # Runs in a collector's pool. The raw output goes back to the coordinator, which renders the block or
+    # stores the configuration exactly as a local run would.
+    try:
+        if show.view:
+            return hostname, show.render(show.parsed(device, hostname))
+        with sessions.checkout(device, timeout=60) as net_connect, timing.phase('command'):
+            output = net_connect.send_command(f'show {show.show}')
+        return hostname, output
+    except (netmiko.NetMikoTimeoutException, netmiko.NetMikoAuthenticationException, ValueError) as error:
+        show.failure(hostname, error)
+
+
+class Channel:
+
+    def __init__(self, conn):
+        # The heartbeat thread and the result loop share one connection.
+        self.conn = conn
+        self.lock = Lock()
+
+    def send(self, message):
+        with self.lock:
+            self.conn.send(message)
+
+
+class RemoteReport:
+
+    def __init__(self, channel, shard):
+        # Stands in for the run report in the collector's run_pool; the coordinator keeps the real one.
+        self.channel = channel
+        self.shard = shard
+
+    def add(self, record):
+        self.channel.send(('record', self.shard, record))
+
+    def stage(self, name, seconds):
+        pass
+
+
+def heartbeat(channel, stopped):
+    while not stopped.wait(HEARTBEAT):
+        try:
+            channel.send(('alive',))
+        except OSError:
+            return
+
+
+def serve_shards(conn, username, password, name, workers, sites):
+    channel = Channel(conn)
+    stopped = Event()
+    Thread(target=heartbeat, args=(channel, stopped), daemon=True).start()
+    try:
+        channel.send(('hello', name, sites, workers))
+        while True:
+            message = conn.recv()
+            if message[0] == 'stop':
+                return
+            kind, shard, vendor, show_command, view, devices, retries = message
+            print(f'{name}: shard {shard}, {len(devices)} devices')
+            show = VENDORS[vendor][0](username, password, '', show_command, view=view, echo=False)
+            jobs = [(show, dict(device, username=username, password=password), hostname)
+                    for hostname, device in devices]
+
+            def on_result(hostname, output):
+                channel.send(('result', shard, hostname, output))
+            run_pool(fetch, jobs, workers, on_result, RemoteReport(channel, shard), retries=retries)
+            channel.send(('done', shard))
+    except (EOFError, OSError):
+        print(f'{name}: lost the coordinator')
+    finally:
+        stopped.set()
+        conn.close()
+
+
+def collect(coordinator, key, username, password, name=None, workers=DEFAULT_WORKERS, sites=None, once=False,
+            log_queue=None):
+    # Collectors connect out to the coordinator, so they can sit behind NAT near their devices and join or
+    # leave a run at any time. Without once they wait for the next run when one ends.
+    name = name or f'{socket.gethostname()}:{os.getpid()}'
+    if log_queue is not None:
+        share_logging(log_queue)
+    else:
+        start_logging()
+    try:
+        while True:
+            try:
+                conn = Client(coordinator, authkey=key)
+            except OSError:
+                if once:
+                    return
+                time.sleep(RECONNECT)
+                continue
+            serve_shards(conn, username, password, name, workers, sites)
+            if once:
+                return
+    finally:
+        close_pool()
+        if log_queue is None:
+            stop_logging()
+
+
+class Coordinator:
+
+    def __init__(self, vendor, show_command, view, filename, key, listen=('0.0.0.0', PORT), selector='',
+                 dev_type='', srx='', shard_by='hash', shards=SHARDS, local=0, workers=DEFAULT_WORKERS,
+                 order='completion', echo=True, compress=None, slowest=SLOWEST, prometheus=None, retries=RETRIES,
+                 results=None):
+        self.vendor = vendor
+        self.show_command = show_command
+        self.view = view
+        self.filename = filename
+        self.key = key
+        self.listen = listen
+        self.selector = selector
+        self.dev_type = dev_type
+        self.srx = srx
+        self.shard_by = shard_by
+        self.shards = shards
+        self.local = local
+        self.workers = workers
+        self.order = order
+        self.echo = echo
+        self.compress = compress
+        self.slowest = slowest
+        self.prometheus = prometheus
+        self.retries = retries
+        self.results = results
+        self.today = datetime.now().strftime('%Y%m%d-%H%M')
+        self.show = VENDORS[vendor][0]('', '', '', show_command, view=view, selector=selector, echo=echo,
+                                       compress=compress, results=results)
+        self.config = is_config(vendor, show_command)
+        # Shard id -> {'site', 'devices', 'pending'}; queue holds the ids no collector is working on.
+        self.table = {}
+        self.queue = []
+        self.changed = Condition()
+        self.report = None
+        self.writer = None
+        self.progress = None
+
+    def select(self):
+        # The same filtered, history-ordered selection a local run would collect; credentials stay here.
+        if self.vendor == 'junos':
+            devices = self.show.select_devices(self.dev_type, self.srx)
+        else:
+            devices = self.show.select_devices()
+        selected = DeviceHistory().schedule(devices, self.show_command)
+        return [(hostname, {key: value for key, value in device.items() if key not in ('username', 'password')})
+                for hostname, device in selected]
+
+    def shard_key(self, hostname, row):
+        # A hash shard depends only on the hostname, so a device lands in the same shard on every run.
+        if self.shard_by == 'hash':
+            return None, int(hashlib.md5(hostname.encode()).hexdigest(), 16) % self.shards
+        if self.shard_by not in row:
+            raise KeyError(f'DeviceDB.csv has no column named {self.shard_by}')
+        return row[self.shard_by], row[self.shard_by]
+
+    def plan(self, selected):
+        rows = {row['HostName']: row for row in load_inventory().select({'HostName': [h for h, d in selected]})}
+        grouped = {}
+        for hostname, device in selected:
+            site, key = self.shard_key(hostname, rows[hostname])
+            grouped.setdefault(key, (site, []))[1].append((hostname, device))
+        for key, (site, devices) in sorted(grouped.items(), key=lambda item: str(item[0])):
+            for start in range(0, len(devices), SHARD_SIZE):
+                chunk = dict(devices[start:start + SHARD_SIZE])
+                self.table[len(self.table)] = {'site': site, 'devices': chunk, 'pending': set(chunk)}
+        self.queue = list(self.table)
+
+    def outstanding(self):
+        return any(shard['pending'] for shard in self.table.values())
+
+    def take(self, sites):
+        # Shards of the collector's own sites first, then any other shard so nothing waits on a busy region.
+        with self.changed:
+            while True:
+                if not self.outstanding():
+                    return None
+                if self.queue:
+                    near = [number for number in self.queue if sites and self.table[number]['site'] is not None
+                            and any(fnmatchcase(self.table[number]['site'], pattern) for pattern in sites)]
+                    number = (near or self.queue)[0]
+                    self.queue.remove(number)
+                    return number
+                self.changed.wait()
+
+    def requeue(self, number, name):
+        with self.changed:
+            pending = self.table[number]['pending']
+            if pending:
+                print(f'Collector {name} lost, {len(pending)} devices of shard {number} reassigned')
+                self.queue.append(number)
+            self.changed.notify_all()
+
+    def finish(self, number):
+        with self.changed:
+            self.table[number]['pending'].clear()
+            self.changed.notify_all()
+
+    def settle(self, number, hostname):
+        # Only the first answer for a device counts; a shard that was reassigned cannot produce it twice.
+        with self.changed:
+            pending = self.table[number]['pending']
+            if hostname not in pending:
+                return False
+            pending.discard(hostname)
+            return True
+
+    def deliver(self, hostname, output):
+        if self.config:
+            self.show.save_config(self.today, hostname, output)
+        else:
+            self.writer.put(hostname, self.show.block(hostname, output))
+
+    def serve(self, conn):
+        name, number = None, None
+        try:
+            kind, name, sites, workers = conn.recv()
+            self.progress.in_flight += workers
+            print(f'Collector {name} joined with {workers} workers')
+            while True:
+                number = self.take(sites)
+                if number is None:
+                    conn.send(('stop',))
+                    return
+                shard = self.table[number]
+                devices = [(hostname, shard['devices'][hostname]) for hostname in shard['devices']
+                           if hostname in shard['pending']]
+                conn.send(('shard', number, self.vendor, self.show_command, self.view, devices, self.retries))
+                while True:
+                    if not conn.poll(DEAD_AFTER):
+                        raise EOFError(f'no heartbeat for {DEAD_AFTER}s')
+                    message = conn.recv()
+                    if message[0] == 'record':
+                        record = message[2]
+                        self.report.add(record)
+                        with self.changed:
+                            self.progress.update(record['error'], record.get('retry'))
+                        if record['error'] and not record.get('retry'):
+                            self.settle(number, record['hostname'])
+                    elif message[0] == 'result':
+                        if self.settle(number, message[2]):
+                            self.deliver(message[2], message[3])
+                    elif message[0] == 'done':
+                        self.finish(number)
+                        number = None
+                        break
+        except (EOFError, OSError):
+            if number is not None:
+                self.requeue(number, name)
+        finally:
+            conn.close()
+
+    def accept(self, listener):
+        while True:
+            try:
+                conn = listener.accept()
+            except AuthenticationError:
+                print('Refused a collector with the wrong SHOW_CLUSTER_KEY')
+                continue
+            except OSError:
+                return
+            Thread(target=self.serve, args=(conn,), daemon=True).start()
+
+    def run(self, username=None, password=None):
+        start = datetime.now()
+        selected = self.select()
+        self.plan(selected)
+        name = f"{self.today} {self.vendor} cluster {self.filename or 'configuration'}"
+        self.report = RunReport(name, self.slowest, self.prometheus)
+        listener = Listener(self.listen, authkey=self.key)
+        host, port = listener.address
+        print(f'Coordinator listening on {host}:{port}: {len(selected)} devices in {len(self.table)} shards')
+        # Local collectors are forked before the accept and writer threads start. The log listener thread is
+        # already running, but the children only put records on its queue and never touch its file handlers.
+        local = [Process(target=collect, args=(('127.0.0.1', port), self.key, username, password,
+                                                f'local{number}', self.workers, None, True, start_logging()))
+                 for number in range(self.local)]
+        for process in local:
+            process.start()
+        path = None
+        if not self.config:
+            path = capture_path(os.path.join('output', f'{self.filename} {self.today}.txt'), self.compress)
+            self.writer = ShowWriter(path, self.order, self.echo, self.compress, self.report,
+                                     self.show.result_sink(self.report))
+        self.progress = Progress(len(selected), 0)
+        collection = datetime.now()
+        Thread(target=self.accept, args=(listener,), daemon=True).start()
+        try:
+            with self.changed:
+                while self.outstanding():
+                    self.changed.wait()
+        finally:
+            if self.writer is not None:
+                self.writer.close()
+            listener.close()
+            for process in local:
+                process.join()
+        self.progress.close()
+        self.report.stage('collection', (datetime.now() - collection).total_seconds())
+        history = DeviceHistory()
+        history.update(self.report, self.show_command)
+        history.save()
+        self.report.close()
+        print(f'Total time to run = {datetime.now() - start}')
+        if path is not None:
+            print(f'Output written to {path}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Collect a fleet show command on several collector hosts. The '
+                                                 'coordinator shards the devices and writes the usual output; '
+                                                 'collectors connect to it and run the shards.')
+    commands = parser.add_subparsers(dest='role', required=True)
+    coordinate = commands.add_parser('coordinate', help='Shard the devices and collect the results.')
+    coordinate.add_argument('command', help='Menu keyword, e.g. "bgp summary", or a command without "show".')
+    coordinate.add_argument('--vendor', choices=sorted(VENDORS), default='junos')
+    coordinate.add_argument('--filename', help='Output file name; not used for configuration backups.')
+    coordinate.add_argument('--select', dest='selector', default='',
+                            help='DeviceDB.csv filters, e.g. "site=DAL* region=south".')
+    coordinate.add_argument('--listen', default=f'0.0.0.0:{PORT}', help='Address collectors connect to.')
+    coordinate.add_argument('--shard-by', default='hash',
+                            help='hash to spread devices by hostname, or a DeviceDB.csv column such as site.')
+    coordinate.add_argument('--shards', type=int, default=SHARDS, help='Number of hash shards.')
+    coordinate.add_argument('--local', type=int, default=0,
+                            help='Collectors to start on this host as well, e.g. to test on localhost.')
+    coordinate.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Workers of each local collector.')
+    coordinate.add_argument('--order', choices=['completion', 'hostname'], default='completion')
+    coordinate.add_argument('--no-echo', dest='echo', action='store_false',
+                            help='Do not print device output to the console.')
+    coordinate.add_argument('--compress', choices=['gzip', 'zstd'])
+    coordinate.add_argument('--slowest', type=int, default=SLOWEST)
+    coordinate.add_argument('--prometheus', metavar='PATH')
+    coordinate.add_argument('--retries', type=int, default=RETRIES)
+    coordinate.add_argument('--results', nargs='?', const=RESULTS_DB, metavar='DB')
+    collector = commands.add_parser('collect', help='Run shards for a coordinator.')
+    collector.add_argument('coordinator', help='host:port of the coordinator.')
+    collector.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+    collector.add_argument('--name', help='Defaults to host:pid.')
+    collector.add_argument('--sites', help='Site patterns this collector is near, e.g. "DAL*,HOU*"; their shards '
+                                           'are given to it first.')
+    collector.add_argument('--once', action='store_true', help='Exit after one run instead of waiting for more.')
+    for role in (coordinate, collector):
+        role.add_argument('--username', default=os.environ.get('SHOW_USERNAME'),
+                          help='Defaults to $SHOW_USERNAME. The password is read from $SHOW_PASSWORD or prompted.')
+    options = vars(parser.parse_args())
+    role = options.pop('role')
+    key = cluster_key()
+    if role == 'collect':
+        if not key:
+            key = getpass('SHOW_CLUSTER_KEY: ').encode()
+        username = options.pop('username') or input('Username: ')
+        password = os.environ.get('SHOW_PASSWORD') or getpass('Password: ')
+        sites = options.pop('sites')
+        collect(address(options.pop('coordinator'), PORT), key, username, password,
+                sites=sites.split(',') if sites else None, **options)
+        return
+    if not key:
+        key = secrets.token_hex(16).encode()
+        print(f'Collectors need SHOW_CLUSTER_KEY={key.decode()}')
+    vendor = options.pop('vendor')
+    command = options.pop('command')
+    entry = VENDORS[vendor][1].get(command.lower())
+    show_command, dev_type, srx, view = entry if entry else (command, '', '', None)
+    if not is_config(vendor, show_command) and not options['filename']:
+        parser.error('--filename is required for show commands')
+    username = password = None
+    if options['local']:
+        username = options.pop('username') or input('Username: ')
+        password = os.environ.get('SHOW_PASSWORD') or getpass('Password: ')
+    options.pop('username', None)
+    listen = address(options.pop('listen'), PORT, '0.0.0.0')
+    start_logging()
+    try:
+        Coordinator(vendor, show_command, view, options.pop('filename'), key, listen, dev_type=dev_type, srx=srx,
+                    **options).run(username, password)
+    finally:
+        stop_logging()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,28 @@
+import importlib
+import sys
+import time
+
+# Seconds each deferred module took to import in this process.
+import_times = {}
+
+
+def load(name):
+    # The SSH stack is only imported when a device is contacted, so the menus start without it.
+    module = sys.modules.get(name)
+    if module is None:
+        start = time.perf_counter()
+        module = importlib.import_module(name)
+        import_times[name] = time.perf_counter() - start
+    return module
+
+
+class LazyModule:
+
+    def __init__(self, name):
+        self.name = name
+
+    def __getattr__(self, attribute):
+        return getattr(load(self.name), attribute)
+
+
+netmiko = LazyModule('netmiko')
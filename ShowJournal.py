@@ -0,0 +1,142 @@
+from datetime import datetime
+import json
+import os
+import re
+
+JOURNAL_DIR = os.path.join('output', 'runs')
+
+
+def journal_path(run, root=JOURNAL_DIR):
+    return os.path.join(root, f'{run}.jsonl')
+
+
+def run_id(today, vendor, name, root=JOURNAL_DIR):
+    # '20240131-0200 junos bgp peers' -> '20240131-020007-junos-bgp-peers-4242', usable on the command line.
+    # The process id keeps runs of different processes apart; a run of this process in the same second, such as
+    # "interfaces up" then "interfaces down" from the menu, gets the next free number appended.
+    run = re.sub(r'[^\w.-]+', '-', f'{today}{datetime.now():%S} {vendor} {name} {os.getpid()}').strip('-')
+    number = 1
+    while os.path.exists(journal_path(f'{run}-{number}' if number > 1 else run, root)):
+        number += 1
+    return f'{run}-{number}' if number > 1 else run
+
+
+def read_header(path):
+    with open(path, mode='r') as journal:
+        try:
+            return json.loads(journal.readline())
+        except ValueError:
+            return {}
+
+
+def latest_run(vendor, root=JOURNAL_DIR):
+    paths = [os.path.join(root, name) for name in os.listdir(root) if name.endswith('.jsonl')] \
+        if os.path.isdir(root) else []
+    paths = [path for path in paths if read_header(path).get('vendor') == vendor]
+    if not paths:
+        raise ValueError(f'No {vendor} runs journaled in {root}')
+    return os.path.basename(max(paths, key=os.path.getmtime))[:-len('.jsonl')]
+
+
+def resume_run(run, vendor, root=JOURNAL_DIR):
+    # 'latest' picks the vendor's most recently journaled run.
+    if run == 'latest':
+        run = latest_run(vendor, root)
+    path = journal_path(run, root)
+    if not os.path.exists(path):
+        raise ValueError(f'No journal for run {run} in {root}')
+    if read_header(path).get('vendor') != vendor:
+        raise ValueError(f'Run {run} is not a {vendor} run')
+    return RunJournal(run, root)
+
+
+class RunJournal:
+
+    def __init__(self, run, root=JOURNAL_DIR):
+        # Append-only JSON lines: the run header, then one line per device state change. The last line
+        # for a device wins, so nothing is ever rewritten and a crash can at worst tear the final line.
+        os.makedirs(root, exist_ok=True)
+        self.run = run
+        self.path = journal_path(run, root)
+        self.header = None
+        # Size of the output file when this run first wrote to it; earlier runs' blocks before it are never cut.
+        self.base = None
+        self.states = {}
+        torn = False
+        if os.path.exists(self.path):
+            with open(self.path, mode='r') as journal:
+                for line in journal:
+                    torn = not line.endswith('\n')
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if 'hostname' in entry:
+                        self.states[entry['hostname']] = entry
+                    elif 'base' in entry:
+                        self.base = entry['base']
+                    elif self.header is None:
+                        self.header = entry
+        self.file = open(self.path, mode='a')
+        if torn:
+            self.file.write('\n')
+
+    def write(self, entries):
+        # Flushed, not synced: a lost line only sends a device round again. The output itself is synced
+        # before its devices are journaled as done.
+        stamp = datetime.now().isoformat(timespec='seconds')
+        lines = []
+        for entry in entries:
+            entry = dict(entry, time=stamp)
+            if 'hostname' in entry:
+                self.states[entry['hostname']] = entry
+            lines.append(json.dumps(entry) + '\n')
+        self.file.write(''.join(lines))
+        self.file.flush()
+
+    def start(self, header, hostnames):
+        if self.header is not None:
+            raise ValueError(f'Run {self.run} is already journaled; resume it with --resume {self.run}')
+        self.header = dict(header, run=self.run)
+        self.write([self.header] + [{'hostname': hostname, 'state': 'pending'} for hostname in hostnames])
+
+    def done(self, hostnames, output=None, offset=None):
+        # offset is the size of the output file once these devices' blocks are in it.
+        self.write([{'hostname': hostname, 'state': 'done', 'output': output, 'offset': offset}
+                    for hostname in hostnames])
+
+    def failed(self, hostname, error):
+        self.write([{'hostname': hostname, 'state': 'failed', 'error': error}])
+
+    def remaining(self, failed_only=False):
+        states = ('failed',) if failed_only else ('pending', 'failed')
+        return {hostname for hostname, entry in self.states.items() if entry['state'] in states}
+
+    def offset(self):
+        # Anything past the last journaled block is a partial write from the interrupted run.
+        return max((entry['offset'] for entry in self.states.values() if entry.get('offset') is not None),
+                   default=0)
+
+    def trim(self, path):
+        # Cuts off a block the interrupted run was part way through writing before new ones are appended.
+        # A new run journals where the file ended first, so output of an earlier run in the same file stays.
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        if self.base is None:
+            self.base = self.offset() or size
+            self.write([{'base': self.base}])
+        offset = max(self.offset(), self.base)
+        if size > offset:
+            os.truncate(path, offset)
+
+    def counts(self):
+        counts = {'pending': 0, 'done': 0, 'failed': 0}
+        for entry in self.states.values():
+            counts[entry['state']] += 1
+        return counts
+
+    def close(self):
+        self.file.close()
+        counts = self.counts()
+        if counts['pending'] or counts['failed']:
+            print(f"Run {self.run}: {counts['done']} done, {counts['failed']} failed, {counts['pending']} pending. "
+                  f"Rerun them with --resume {self.run} or only the failures with --retry-failed {self.run}")
@@ -0,0 +1,135 @@
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, MemoryHandler
+from multiprocessing import Queue
+import logging
+import os
+import sys
+import time
+
+LOG_DIR = 'logs'
+LOGGERS = ('JunosShow', 'CiscoShow')
+MAX_BYTES = 5 * 1024 * 1024
+BACKUPS = 5
+BUFFER_RECORDS = 256
+FLUSH_SECONDS = 2.0
+FORMAT = '%(asctime)s %(levelname)s %(processName)s %(hostname)s %(error)s: %(message)s'
+# Seconds between redraws of the progress line.
+REDRAW = 0.1
+
+_queue = None
+_listener = None
+
+
+class _Fields(logging.Filter):
+
+    def filter(self, record):
+        record.hostname = getattr(record, 'hostname', '-')
+        record.error = getattr(record, 'error', '-')
+        return True
+
+
+class _Buffer(MemoryHandler):
+
+    def __init__(self, target):
+        # Writes in batches, but never holds a record longer than FLUSH_SECONDS once another one arrives.
+        super().__init__(BUFFER_RECORDS, flushLevel=logging.ERROR, target=target)
+        self.flushed = time.monotonic()
+
+    def shouldFlush(self, record):
+        return super().shouldFlush(record) or time.monotonic() - self.flushed > FLUSH_SECONDS
+
+    def flush(self):
+        super().flush()
+        self.flushed = time.monotonic()
+
+
+def use_queue(queue):
+    # Every process, the parent included, only puts records on the queue; it never opens the log files.
+    for name in LOGGERS:
+        logger = logging.getLogger(name)
+        logger.handlers = [QueueHandler(queue)]
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+
+
+def start_logging():
+    # One listener thread in the parent owns the log files, so workers cannot interleave or tear lines.
+    global _queue, _listener
+    if _queue is None:
+        os.makedirs(LOG_DIR, exist_ok=True)
+        handlers = []
+        for name in LOGGERS:
+            file_handler = RotatingFileHandler(os.path.join(LOG_DIR, f'{name}Failure.log'), maxBytes=MAX_BYTES,
+                                               backupCount=BACKUPS, delay=True)
+            file_handler.setFormatter(logging.Formatter(FORMAT))
+            file_handler.addFilter(_Fields())
+            buffered = _Buffer(file_handler)
+            buffered.addFilter(logging.Filter(name))
+            handlers.append(buffered)
+        _queue = Queue()
+        _listener = QueueListener(_queue, *handlers)
+        _listener.start()
+        use_queue(_queue)
+    return _queue
+
+
+def share_logging(queue):
+    # A process started by another one that already listens, such as a local collector, logs through it.
+    global _queue, _listener
+    _queue = queue
+    _listener = None
+    use_queue(queue)
+
+
+def stop_logging():
+    global _queue, _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    for handler in _listener.handlers:
+        target = handler.target
+        handler.close()
+        target.close()
+    for name in LOGGERS:
+        logging.getLogger(name).handlers = []
+    _queue = _listener = None
+
+
+class Progress:
+
+    def __init__(self, total, in_flight, stream=sys.stderr):
+        # A single rewritten console line replaces the per-device prints; only drawn on a terminal.
+        self.total = total
+        self.in_flight = in_flight
+        self.stream = stream
+        self.live = stream.isatty()
+        self.done = 0
+        self.failed = 0
+        self.retrying = 0
+        self.drawn = 0.0
+
+    def update(self, error=None, retry=False):
+        if retry:
+            self.retrying += 1
+        elif error:
+            self.failed += 1
+        else:
+            self.done += 1
+        if self.live and (time.monotonic() - self.drawn > REDRAW or self.done + self.failed == self.total):
+            self.draw()
+
+    def draw(self):
+        remaining = self.total - self.done - self.failed
+        line = (f'{self.done + self.failed}/{self.total} done  {self.failed} failed  '
+                f'{min(self.in_flight, remaining)} in flight')
+        if self.retrying:
+            line += f'  {self.retrying} retried'
+        self.stream.write('\r\x1b[K' + line)
+        self.stream.flush()
+        self.drawn = time.monotonic()
+
+    def close(self):
+        if self.live:
+            self.draw()
+            self.stream.write('\n')
+        if self.failed:
+            print(f'{self.failed} of {self.total} devices failed, details in {LOG_DIR}')
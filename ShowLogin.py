@@ -0,0 +1,86 @@
+from multiprocessing.managers import BaseManager
+import time
+
+# Device key naming its login group; removed before the device reaches netmiko.
+LOGIN_GROUP = 'login_group'
+# Logins a bucket lets through back to back before the rate applies.
+LOGIN_BURST = 1
+
+
+class TokenBuckets:
+
+    def __init__(self, rate=None, group_rate=None, burst=LOGIN_BURST):
+        # Lives in the manager process so every worker draws from the same buckets. Each bucket only
+        # keeps the time its next token is due, so a reservation is a few arithmetic operations.
+        self.rate = rate
+        self.group_rate = group_rate
+        self.burst = burst
+        self.due = {}
+
+    def reserve(self, group=None):
+        # Takes the next token of one bucket, the overall one or a group's, and returns the seconds the
+        # caller has to wait for it. Waiting happens in the caller, never in here.
+        rate = self.group_rate if group else self.rate
+        if not rate:
+            return 0.0
+        now = time.monotonic()
+        interval = 1.0 / rate
+        due = self.due.get(group, now)
+        start = max(now, due - (self.burst - 1) * interval)
+        self.due[group] = max(due, now) + interval
+        return start - now
+
+
+class LoginManager(BaseManager):
+    pass
+
+
+LoginManager.register('TokenBuckets', TokenBuckets)
+
+
+class LoginLimiter:
+
+    def __init__(self):
+        # Set from the command line in the parent; workers only get the buckets proxy.
+        self.rate = None
+        self.group_rate = None
+        self.column = None
+        self.burst = LOGIN_BURST
+        self.manager = None
+        self.buckets = None
+
+    def start(self):
+        # Only started when a rate is set, otherwise logins go straight through.
+        if self.buckets is None and (self.rate or self.group_rate):
+            self.manager = LoginManager()
+            self.manager.start()
+            self.buckets = self.manager.TokenBuckets(self.rate, self.group_rate, self.burst)
+        return self.buckets
+
+    def stop(self):
+        if self.manager is not None:
+            self.manager.shutdown()
+        self.manager = self.buckets = None
+
+    def tag(self, device, row):
+        # The group comes from an inventory column such as site or an auth server group.
+        if self.column and self.group_rate:
+            if self.column not in row:
+                raise KeyError(f'DeviceDB.csv has no column named {self.column}')
+            device[LOGIN_GROUP] = row[self.column]
+        return device
+
+    def keys(self, device):
+        # The group's token is waited for before the overall one is taken, so a slow group never books
+        # overall tokens ahead of the other groups.
+        group = device.get(LOGIN_GROUP)
+        return [group, None] if group else [None]
+
+    def wait(self, device):
+        for key in self.keys(device):
+            delay = self.buckets.reserve(key)
+            if delay > 0:
+                time.sleep(delay)
+
+
+logins = LoginLimiter()
@@ -0,0 +1,109 @@
+from ShowPool import DEFAULT_WORKERS, RETRIES
+from ShowProbe import PROBE_TIMEOUT
+from ShowParse import PARSE_TTL
+from ShowSession import sessions, MAX_SESSIONS, IDLE_TIMEOUT, SETUP_DIR
+from ShowLogin import logins, LOGIN_BURST
+from ShowTiming import SLOWEST
+from ShowResults import RESULTS_DB
+from ShowJournal import resume_run
+import importlib.util
+
+
+def add_session_options(parser):
+    # Options of every entry point that logs in to devices.
+    parser.add_argument('--max-sessions', type=int, default=MAX_SESSIONS,
+                        help='SSH sessions kept open per process for reuse between commands.')
+    parser.add_argument('--session-idle', type=int, default=IDLE_TIMEOUT,
+                        help='Seconds an unused cached session is kept open.')
+    parser.add_argument('--fast-setup', action='store_true',
+                        help=f'Remember each device\'s prompt and paging setup in {SETUP_DIR} and replay it on the '
+                             'next login instead of discovering it again; stale state falls back to the full setup.')
+    parser.add_argument('--login-rate', type=float,
+                        help='Logins a second across all workers, so the TACACS/RADIUS servers are not flooded. '
+                             'Commands on open sessions are not limited.')
+    parser.add_argument('--group-rate', type=float,
+                        help='Logins a second for each value of the --login-group column.')
+    parser.add_argument('--login-group', metavar='COLUMN', default='site',
+                        help='DeviceDB.csv column that --group-rate applies to, e.g. site or an auth server group.')
+    parser.add_argument('--login-burst', type=int, default=LOGIN_BURST,
+                        help='Logins let through back to back before the rates apply.')
+
+
+def apply_session_options(options):
+    # The session cache and login limiter are process-wide, so their options are taken out of the parsed ones.
+    sessions.max_open = options.pop('max_sessions')
+    sessions.idle_timeout = options.pop('session_idle')
+    sessions.setups.enabled = options.pop('fast_setup')
+    logins.rate = options.pop('login_rate')
+    logins.group_rate = options.pop('group_rate')
+    logins.column = options.pop('login_group')
+    logins.burst = options.pop('login_burst')
+
+
+def add_run_options(parser, menu=True):
+    # Options of the fleet runs; menu adds those only the JunosShow/CiscoShow menus take.
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help='Maximum number of devices collected at the same time.')
+    if menu:
+        parser.add_argument('--engine', choices=['process', 'async'], default='process',
+                            help='Collect with a worker process pool or with one asyncio event loop.')
+    parser.add_argument('--order', choices=['completion', 'hostname'], default='completion',
+                        help='Write output blocks as devices finish or sorted by hostname.')
+    parser.add_argument('--no-echo', dest='echo', action='store_false',
+                        help='Do not print device output to the console.')
+    add_session_options(parser)
+    if menu:
+        parser.add_argument('--stream', action='store_true',
+                            help='Write device output to disk as it arrives instead of holding it in memory.')
+    parser.add_argument('--compress', choices=['gzip', 'zstd'],
+                        help='Compress output files as they are written.')
+    if menu:
+        parser.add_argument('--parse-ttl', type=int, default=PARSE_TTL,
+                            help='Seconds parsed interface/OSPF/BGP records are reused before refetching.')
+        parser.add_argument('--select', dest='selector', default='',
+                            help='Extra DeviceDB.csv filters for fleet runs, e.g. "site=DAL* region=south".')
+    parser.add_argument('--slowest', type=int, default=SLOWEST,
+                        help='Slowest devices listed in the timing summary after each fleet run.')
+    parser.add_argument('--prometheus', metavar='PATH',
+                        help='Also write the run timings as a Prometheus textfile, e.g. for node_exporter.')
+    parser.add_argument('--retries', type=int, default=RETRIES,
+                        help='Extra attempts for devices that time out, with backoff between rounds.')
+    parser.add_argument('--probe', action='store_true',
+                        help='Check TCP port 22 of every device first and only log in to the ones that answer.')
+    parser.add_argument('--probe-timeout', type=float, default=PROBE_TIMEOUT,
+                        help='Seconds a device has to accept the probe connection.')
+    parser.add_argument('--results', nargs='?', const=RESULTS_DB, metavar='DB',
+                        help=f'Also store every device result in a SQLite database, {RESULTS_DB} by default. '
+                             'Query it with ShowResults.py.')
+    if menu:
+        runs = parser.add_mutually_exclusive_group()
+        runs.add_argument('--resume', nargs='?', const='latest', metavar='RUN_ID',
+                          help='Finish an interrupted fleet run: collect its pending and failed devices into the '
+                               'same output file. Defaults to the latest run.')
+        runs.add_argument('--retry-failed', nargs='?', const='latest', metavar='RUN_ID',
+                          help='Collect only the devices that failed in a fleet run. Defaults to the latest run.')
+
+
+def apply_run_options(parser, options, vendor=None):
+    # Returns the journal of the run to resume or retry, if any, and whether only its failed devices are retried.
+    apply_session_options(options)
+    # Checked before the credential prompts and the run journal, without importing the SSH stack.
+    if options.get('engine') == 'async' and importlib.util.find_spec('asyncssh') is None:
+        parser.error('--engine async requires asyncssh. Install it with "pip install asyncssh".')
+    if vendor is None:
+        return None, False
+    resume = options.pop('resume')
+    retry_failed = options.pop('retry_failed')
+    journal = None
+    if resume or retry_failed:
+        try:
+            journal = resume_run(resume or retry_failed, vendor)
+        except ValueError as error:
+            parser.error(str(error))
+    return journal, retry_failed is not None
+
+
+def address(text, port, host='127.0.0.1'):
+    # 'host:port', ':port' or 'host' -> (host, port)
+    name, _, number = text.rpartition(':') if ':' in text else (text, '', '')
+    return name or host, int(number or port)
@@ -0,0 +1,228 @@
+import json
+import os
+import re
+import time
+
+CACHE_DIR = os.path.join('output', 'cache')
+PARSE_TTL = 300
+
+# Interfaces the Junos up/down views have always been limited to.
+JUNOS_INTERFACES = re.compile(r'ge-|fe-|lo0\.0|gr-|te|st0|sp-|vlan|ae|reth')
+IP_ADDRESS = re.compile(r'^\d+\.\d+\.\d+\.\d+$')
+IOS_INVENTORY = re.compile(r'NAME:\s*"([^"]*)",\s*DESCR:\s*"([^"]*)"\s*'
+                           r'PID:\s*([^,]*?)\s*,\s*VID:\s*([^,]*?)\s*,\s*SN:[ \t]*(\S*)')
+
+
+def parse_junos_terse(text):
+    records = []
+    for line in text.splitlines():
+        fields = line.split()
+        if not fields or fields[0] == 'Interface':
+            continue
+        if line[0].isspace():
+            # Extra addresses of the interface above.
+            if records:
+                records[-1]['address'] = ' '.join(filter(None, [records[-1]['address'], fields[-1]]))
+            continue
+        if len(fields) < 3 or fields[1] not in ('up', 'down'):
+            continue
+        admin, link = fields[1], fields[2]
+        address = fields[4] if len(fields) > 4 else ''
+        records.append({'name': fields[0], 'admin': admin, 'link': link, 'address': address,
+                        'up': admin == 'up' and link == 'up'})
+    return records
+
+
+def parse_ios_brief(text):
+    records = []
+    for line in text.splitlines():
+        fields = line.split()
+        if len(fields) < 6 or fields[0] == 'Interface':
+            continue
+        status = ' '.join(fields[4:-1])
+        admin = 'down' if status == 'administratively down' else 'up'
+        address = fields[1] if fields[1] != 'unassigned' else ''
+        records.append({'name': fields[0], 'admin': admin, 'link': fields[-1], 'address': address,
+                        'up': admin == 'up' and fields[-1] == 'up'})
+    return records
+
+
+def parse_junos_ospf(text):
+    records = []
+    for line in text.splitlines():
+        fields = line.split()
+        if len(fields) >= 4 and IP_ADDRESS.match(fields[0]):
+            records.append({'neighbor': fields[3], 'address': fields[0], 'interface': fields[1],
+                            'state': fields[2], 'up': fields[2] == 'Full'})
+    return records
+
+
+def parse_ios_ospf(text):
+    records = []
+    for line in text.splitlines():
+        fields = line.split()
+        if len(fields) >= 6 and IP_ADDRESS.match(fields[0]):
+            records.append({'neighbor': fields[0], 'address': fields[-2], 'interface': fields[-1],
+                            'state': fields[2], 'up': fields[2].upper().startswith('FULL')})
+    return records
+
+
+def parse_junos_bgp(text):
+    records = []
+    for line in text.splitlines():
+        fields = line.split()
+        if len(fields) < 8 or not (IP_ADDRESS.match(fields[0]) or ':' in fields[0]) or not fields[1].isdigit():
+            continue
+        state = fields[-1]
+        # Established peers show their route counts (or 'Establ') instead of a state name.
+        established = state == 'Establ' or '/' in state
+        records.append({'peer': fields[0], 'asn': fields[1], 'state': 'Established' if established else state,
+                        'up': established})
+    return records
+
+
+def parse_ios_bgp(text):
+    records = []
+    for line in text.splitlines():
+        fields = line.split()
+        if len(fields) < 10 or not IP_ADDRESS.match(fields[0]) or not fields[2].isdigit():
+            continue
+        state = fields[-1]
+        established = state.isdigit()
+        records.append({'peer': fields[0], 'asn': fields[2], 'state': 'Established' if established else state,
+                        'up': established})
+    return records
+
+
+def parse_version(text):
+    # One record for the device: Junos 'show version' or Cisco IOS / IOS XE 'show version'.
+    junos = re.search(r'^Junos: (\S+)', text, re.M) or re.search(r'JUNOS \S+(?: \S+)* \[([^\]]+)\]', text)
+    if junos:
+        model = re.search(r'^Model: (\S+)', text, re.M)
+        return [{'vendor': 'juniper', 'model': model.group(1) if model else '', 'version': junos.group(1),
+                 'serial': ''}]
+    cisco = re.search(r'Cisco IOS.*?Version ([^\s,]+)', text)
+    if cisco:
+        model = re.search(r'^[Cc]isco (\S+) .*(?:processor|bytes of memory)', text, re.M) or \
+            re.search(r'^Model [Nn]umber\s*:\s*(\S+)', text, re.M)
+        serial = re.search(r'^Processor board ID (\S+)', text, re.M) or \
+            re.search(r'^System [Ss]erial [Nn]umber\s*:\s*(\S+)', text, re.M)
+        return [{'vendor': 'cisco', 'model': model.group(1) if model else '', 'version': cisco.group(1),
+                 'serial': serial.group(1) if serial else ''}]
+    return []
+
+
+def parse_junos_hardware(text):
+    # 'show chassis hardware' is fixed-width; the header line gives the column offsets.
+    records = []
+    offsets = None
+    for line in text.splitlines():
+        if line.startswith('Item') and 'Serial number' in line:
+            offsets = [line.index(name) for name in ('Version', 'Part number', 'Serial number', 'Description')]
+            continue
+        if offsets is None or not line.strip() or line.lstrip()[0] in '-={' or line.endswith(':'):
+            continue
+        bounds = [0] + offsets + [len(line)]
+        item, version, part, serial, description = (line[start:end].strip() for start, end in zip(bounds, bounds[1:]))
+        records.append({'item': item, 'version': version, 'part': part, 'serial': serial,
+                        'description': description})
+    return records
+
+
+def parse_ios_inventory(text):
+    records = []
+    for name, description, part, version, serial in IOS_INVENTORY.findall(text):
+        records.append({'item': name, 'version': version, 'part': part, 'serial': serial,
+                        'description': description})
+    return records
+
+
+def parse_hardware(text):
+    return parse_junos_hardware(text) or parse_ios_inventory(text)
+
+
+def parse_ntp_associations(text):
+    # ntpq style on Junos and IOS alike: a tally character or two, then address, refid, stratum ... offset.
+    records = []
+    for line in text.splitlines():
+        match = re.match(r'^\s*([*#+\-xo.~ ]{0,2})\s*(\S+)\s+(\S+)\s+(\d+)\s+(.*)$', line)
+        if not match:
+            continue
+        tally, peer, refid, stratum, rest = match.groups()
+        numbers = rest.split()
+        if not (IP_ADDRESS.match(peer) or '.' in peer) or len(numbers) < 5:
+            continue
+        try:
+            offset = float(numbers[-2])
+        except ValueError:
+            continue
+        # Junos puts the association type between stratum and when; IOS goes straight to when.
+        reach = numbers[-4] if numbers[-4].isdigit() else ''
+        records.append({'peer': peer, 'refid': refid, 'stratum': int(stratum), 'reach': reach, 'offset': offset,
+                        'selected': '*' in tally})
+    return records
+
+
+JUNOS_PARSERS = {
+    'interfaces terse': ('interfaces', parse_junos_terse),
+    'ospf neighbor': ('ospf', parse_junos_ospf),
+    'bgp summary': ('bgp', parse_junos_bgp),
+}
+
+CISCO_PARSERS = {
+    'ip int brie': ('interfaces', parse_ios_brief),
+    'ip ospf neigh': ('ospf', parse_ios_ospf),
+    'ip bgp summary': ('bgp', parse_ios_bgp),
+}
+
+COLUMNS = {
+    'interfaces': ('name', 'admin', 'link', 'address'),
+    'ospf': ('neighbor', 'address', 'interface', 'state'),
+    'bgp': ('peer', 'asn', 'state'),
+}
+
+
+def render(kind, view, records, names=None):
+    # Views are computed from the parsed records, so every view of a kind shares one fetch.
+    if names is not None and view in ('up', 'down'):
+        records = [record for record in records if names.search(record['name'])]
+    if view == 'summary':
+        up = sum(1 for record in records if record['up'])
+        disabled = sum(1 for record in records if record.get('admin') == 'down')
+        return f'\n{kind}: {len(records)} total, {up} up, {len(records) - up - disabled} down, {disabled} disabled\n'
+    if view == 'up':
+        records = [record for record in records if record['up']]
+    elif view == 'down':
+        records = [record for record in records if not record['up'] and record.get('admin') != 'down']
+    columns = COLUMNS[kind]
+    lines = ['  '.join(f'{column.capitalize():<24}' for column in columns).rstrip()]
+    for record in records:
+        lines.append('  '.join(f'{record[column]:<24}' for column in columns).rstrip())
+    return '\n' + '\n'.join(lines) + '\n'
+
+
+class ParseCache:
+
+    def __init__(self, ttl=PARSE_TTL, root=CACHE_DIR):
+        self.ttl = ttl
+        self.root = root
+
+    def path(self, hostname, kind):
+        return os.path.join(self.root, f'{hostname} {kind}.json')
+
+    def get(self, hostname, kind):
+        try:
+            with open(self.path(hostname, kind), mode='r') as cached:
+                entry = json.load(cached)
+        except (OSError, ValueError):
+            return None
+        if time.time() - entry['time'] > self.ttl:
+            return None
+        return entry['records']
+
+    def put(self, hostname, kind, records):
+        os.makedirs(self.root, exist_ok=True)
+        path = self.path(hostname, kind)
+        with open(f'{path}.{os.getpid()}.tmp', mode='w') as cached:
+            json.dump({'time': time.time(), 'records': records}, cached)
+        os.replace(f'{path}.{os.getpid()}.tmp', path)
@@ -0,0 +1,285 @@
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict, Counter
+from threading import Thread, Lock
+from datetime import datetime
+from getpass import getpass
+from urllib.parse import unquote
+from ShowRunner import ShowRunner, VENDORS, load_jobs
+from ShowSession import send_commands, sessions
+from ShowLogin import logins
+from ShowLog import start_logging, stop_logging
+from DeviceInventory import load_inventory, parse_selector
+from ShowOptions import add_session_options, apply_session_options, address
+import argparse
+import hashlib
+import heapq
+import json
+import os
+import random
+import re
+import time
+
+POLL_DIR = os.path.join('output', 'poll')
+PORT = 8470
+POLL_WORKERS = 16
+INTERVAL = 300
+# Each interval is stretched or shortened by up to this fraction, so polls of a group drift apart.
+JITTER = 0.1
+# Entries of the latest-state table; the least recently polled are dropped first.
+LATEST = 10000
+# Seconds between keepalives on idle sessions, so firewalls keep them open between polls.
+KEEPALIVE = 30
+# Seconds between the status lines printed while polling.
+STATUS = 60
+
+
+def load_polls(path):
+    # A ShowRunner job file where every job is a device group with its own interval, e.g.
+    # {"name": "alarms", "jobs": [{"select": "dev_type=router", "commands": ["chassis alarms", "bgp down"],
+    #                              "interval": 300, "jitter": 0.1, "ignore": "Up/Dn|uptime"}]}
+    # ignore is a pattern for lines that change on every poll, such as counters; they never count as a change.
+    polls = load_jobs(path)
+    for job in polls['jobs']:
+        if job.get('interval', INTERVAL) <= 0:
+            raise ValueError(f"Poll intervals are seconds above 0, not {job['interval']!r}")
+        re.compile(job.get('ignore') or '')
+    return polls
+
+
+class LatestHandler(BaseHTTPRequestHandler):
+
+    # GET /           counters
+    # GET /latest     every device and command with its change and poll times
+    # GET /latest/HOST  the same for one device, with the output
+    def do_GET(self):
+        poller = self.server.poller
+        parts = [unquote(part) for part in self.path.split('?')[0].strip('/').split('/') if part]
+        if not parts:
+            body = poller.status()
+        elif parts[0] == 'latest' and len(parts) == 1:
+            body = poller.latest_state()
+        elif parts[0] == 'latest' and len(parts) == 2:
+            body = poller.latest_state(parts[1])
+            if not body:
+                return self.send_error(404, f'No state for {parts[1]}')
+        else:
+            return self.send_error(404)
+        data = json.dumps(body, indent=1).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Poller:
+
+    def __init__(self, username, password, name, workers=POLL_WORKERS, latest=LATEST, echo=True, timeout=60):
+        # Polls run on threads of this one process, so every device keeps a single session in the shared
+        # cache whichever thread polls it next.
+        self.runner = ShowRunner(username, password, name, echo=False)
+        self.name = name
+        self.workers = workers
+        self.echo = echo
+        self.timeout = timeout
+        # (hostname, command) -> latest output, its digest and when it last changed and was polled.
+        self.latest = OrderedDict()
+        self.latest_max = latest
+        self.counts = Counter()
+        self.lock = Lock()
+        self.started = time.time()
+        os.makedirs(POLL_DIR, exist_ok=True)
+        self.path = os.path.join(POLL_DIR, f'{name}.jsonl')
+        self.changes = open(self.path, mode='a')
+
+    def plan(self, polls):
+        # One schedule per device and job; a device in several jobs is polled at each job's interval.
+        inventory = load_inventory()
+        schedules = []
+        for job in polls['jobs']:
+            terms = parse_selector(job.get('select', ''))
+            terms.setdefault('device_type', list(VENDORS))
+            ignore = re.compile(job['ignore']) if job.get('ignore') else None
+            for row in inventory.select(terms):
+                if row['device_type'] not in VENDORS:
+                    continue
+                commands = job['commands']
+                if isinstance(commands, dict):
+                    commands = commands.get(row['device_type'], [])
+                resolved = [self.runner.resolve(row, command) for command in commands]
+                resolved = [command for command in resolved if command is not None]
+                if not resolved:
+                    continue
+                device = self.runner.device(row)
+                device['keepalive'] = KEEPALIVE
+                schedules.append({'hostname': row['HostName'], 'device': device, 'commands': resolved,
+                                  'interval': job.get('interval', INTERVAL), 'jitter': job.get('jitter', JITTER),
+                                  'ignore': ignore, 'busy': False})
+        return schedules
+
+    def poll(self, schedule):
+        hostname = schedule['hostname']
+        device = schedule['device']
+        device_type = device['device_type']
+        shows = [self.runner.command(device_type, show_command)
+                 for keyword, show_command, dev_type, srx, view in schedule['commands']]
+        try:
+            with sessions.checkout(device, timeout=self.timeout) as net_connect:
+                outputs = send_commands(net_connect, shows)
+            polled = time.time()
+            for (keyword, show_command, dev_type, srx, view), output in zip(schedule['commands'], outputs):
+                if view:
+                    output = self.runner.render(device_type, show_command, view, output)
+                self.update(hostname, keyword, output, schedule['ignore'], polled)
+            self.count('polls')
+        except Exception as error:
+            # Unexpected errors, such as a view that fails to parse, are counted and logged like timeouts, so one
+            # device never takes down a polling thread silently.
+            self.count('failures')
+            self.runner.vendor(device_type).failure(hostname, error)
+        finally:
+            schedule['busy'] = False
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    def update(self, hostname, command, output, ignore, polled):
+        # Only outputs that differ from the previous poll, apart from ignored lines, are written.
+        lines = output.splitlines()
+        if ignore is not None:
+            lines = [line for line in lines if not ignore.search(line)]
+        digest = hashlib.sha1('\n'.join(lines).encode()).hexdigest()
+        with self.lock:
+            entry = self.latest.pop((hostname, command), None)
+            changed = entry is None or entry['digest'] != digest
+            if changed:
+                entry = {'digest': digest, 'output': output, 'changed': polled}
+                self.counts['changes'] += 1
+                self.changes.write(json.dumps({'time': datetime.fromtimestamp(polled).isoformat(timespec='seconds'),
+                                               'hostname': hostname, 'command': command, 'output': output}) + '\n')
+                self.changes.flush()
+            entry['polled'] = polled
+            self.latest[(hostname, command)] = entry
+            while len(self.latest) > self.latest_max:
+                self.latest.popitem(last=False)
+        if changed and self.echo:
+            print(f'{hostname} {command} changed')
+
+    def latest_state(self, hostname=None):
+        def when(seconds):
+            return datetime.fromtimestamp(seconds).isoformat(timespec='seconds')
+        with self.lock:
+            if hostname is None:
+                return [{'hostname': host, 'command': command, 'changed': when(entry['changed']),
+                         'polled': when(entry['polled'])} for (host, command), entry in self.latest.items()]
+            return [{'hostname': host, 'command': command, 'changed': when(entry['changed']),
+                     'polled': when(entry['polled']), 'output': entry['output']}
+                    for (host, command), entry in self.latest.items() if host == hostname]
+
+    def status(self):
+        with self.lock:
+            counts = dict(self.counts, entries=len(self.latest))
+        return dict(counts, name=self.name, uptime=round(time.time() - self.started),
+                    sessions={'hits': sessions.hits.value, 'misses': sessions.misses.value})
+
+    def status_line(self):
+        counts = self.status()
+        return (f"{datetime.now():%H:%M:%S} polls {counts.get('polls', 0)}, changes {counts.get('changes', 0)}, "
+                f"failures {counts.get('failures', 0)}, skipped {counts.get('skipped', 0)}; "
+                f"{sessions.stats()}")
+
+    def serve(self, listen):
+        server = ThreadingHTTPServer(listen, LatestHandler)
+        server.poller = self
+        server.daemon_threads = True
+        Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    def run(self, polls, listen=None):
+        schedules = self.plan(polls)
+        if not schedules:
+            print('No devices to poll.')
+            return
+        # Every session stays open between polls, up to the slowest interval without a poll.
+        sessions.max_open = max(sessions.max_open, len({schedule['hostname'] for schedule in schedules}))
+        sessions.idle_timeout = max(sessions.idle_timeout, 2 * max(schedule['interval'] for schedule in schedules))
+        # The first polls of a group are spread over its interval instead of all starting at once.
+        now = time.monotonic()
+        queue = [(now + random.uniform(0, schedule['interval']), number, schedule)
+                 for number, schedule in enumerate(schedules)]
+        heapq.heapify(queue)
+        server = self.serve(listen) if listen else None
+        print(f'Polling {len(schedules)} schedules, changes written to {self.path}'
+              + (f', latest state on http://{listen[0]}:{server.server_address[1]}/latest' if server else ''))
+        logins.start()
+        executor = ThreadPoolExecutor(self.workers)
+        status = now + STATUS
+        try:
+            while True:
+                due, number, schedule = heapq.heappop(queue)
+                while True:
+                    now = time.monotonic()
+                    if now >= status:
+                        print(self.status_line())
+                        status += STATUS
+                    if now >= due:
+                        break
+                    time.sleep(min(due, status) - now)
+                if schedule['busy']:
+                    # The previous poll is still running; this one is dropped rather than queued behind it.
+                    self.count('skipped')
+                else:
+                    schedule['busy'] = True
+                    executor.submit(self.poll, schedule)
+                jitter = schedule['jitter']
+                heapq.heappush(queue, (due + schedule['interval'] * random.uniform(1 - jitter, 1 + jitter), number,
+                                       schedule))
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+            if server is not None:
+                server.shutdown()
+            sessions.close_all()
+            logins.stop()
+            self.changes.close()
+            print(self.status_line())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Poll show commands on a schedule over sessions that stay open, '
+                                                 'writing only the outputs that changed.')
+    parser.add_argument('polls', help='JSON job file of selectors, command lists and intervals in seconds.')
+    parser.add_argument('--username', default=os.environ.get('SHOW_USERNAME'),
+                        help='Defaults to $SHOW_USERNAME. The password is read from $SHOW_PASSWORD or prompted.')
+    parser.add_argument('--workers', type=int, default=POLL_WORKERS, help='Devices polled at the same time.')
+    parser.add_argument('--latest', type=int, default=LATEST,
+                        help='Device and command entries kept in the latest-state table.')
+    parser.add_argument('--listen', default=f'127.0.0.1:{PORT}',
+                        help='Address of the HTTP endpoint serving the latest-state table; "" to turn it off.')
+    parser.add_argument('--no-echo', dest='echo', action='store_false',
+                        help='Do not print a line for every change.')
+    add_session_options(parser)
+    options = vars(parser.parse_args())
+    try:
+        polls = load_polls(options.pop('polls'))
+    except (OSError, ValueError, re.error) as error:
+        parser.error(str(error))
+    apply_session_options(options)
+    listen = options.pop('listen')
+    username = options.pop('username') or input('Username: ')
+    password = os.environ.get('SHOW_PASSWORD') or getpass('Password: ')
+    start_logging()
+    try:
+        Poller(username, password, polls['name'], **options).run(polls, address(listen, PORT) if listen else None)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_logging()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+from ShowImports import netmiko, load, import_times
+from multiprocessing import Pool, get_start_method
+from multiprocessing.util import Finalize
+from datetime import datetime
+from queue import Queue
+from ShowSession import sessions
+from ShowTiming import timing
+from ShowLog import start_logging, use_queue, Progress
+from ShowLogin import logins
+import inspect
+import random
+import time
+import zlib
+
+DEFAULT_WORKERS = 32
+RETRIES = 2
+BACKOFF = 5
+BACKOFF_CEILING = 30
+# Failures worth another attempt besides netmiko's connect timeout: the device was slow to answer or dropped the
+# channel. A rejected login will be rejected again. OSError covers netmiko's read timeouts and socket errors by
+# name, its subclasses by theirs.
+TRANSIENT = ('ReadTimeout', 'OSError', 'TimeoutError', 'timeout', 'ConnectionResetError', 'ConnectionAbortedError',
+             'BrokenPipeError', 'EOFError', 'SSHException')
+# Imported once per worker process rather than by every module that might contact a device.
+PRELOAD = ('netmiko',)
+
+_pool = []
+
+
+def _init_worker(hits, misses, max_open, idle_timeout, fast_setup, log_queue, login_buckets):
+    # Workers share the parent's hit/miss counters, log through its listener and close their cached sessions on exit.
+    # Their logins draw from the parent's token buckets.
+    use_queue(log_queue)
+    logins.buckets = login_buckets
+    sessions.hits = hits
+    sessions.misses = misses
+    sessions.max_open = max_open
+    sessions.idle_timeout = idle_timeout
+    sessions.setups.enabled = fast_setup
+    Finalize(sessions, sessions.close_all, exitpriority=10)
+    # Forked workers inherit what the parent already imported, so only their own import time is counted.
+    import_times.clear()
+    start = time.time()
+    for name in PRELOAD:
+        load(name)
+    if import_times:
+        timing.imports = (start, sum(import_times.values()))
+
+
+def get_pool(workers=DEFAULT_WORKERS):
+    # One single-process pool per worker, kept across runs, so a device always goes to the worker that may still
+    # hold its session.
+    global _pool
+    if len(_pool) != workers:
+        close_pool()
+        if get_start_method() == 'fork':
+            # Imported once here, the SSH stack is shared by every forked worker instead of loaded by each.
+            for name in PRELOAD:
+                load(name)
+        initargs = (sessions.hits, sessions.misses, sessions.max_open, sessions.idle_timeout,
+                    sessions.setups.enabled, start_logging(), logins.start())
+        _pool = [Pool(processes=1, initializer=_init_worker, initargs=initargs) for _ in range(workers)]
+    return _pool
+
+
+def close_pool(terminate=False):
+    # A clean shutdown lets the workers finish; after an interrupt or error the queued devices are dropped instead
+    # of logged in to for output nobody will read.
+    global _pool
+    for pool in _pool:
+        if terminate:
+            pool.terminate()
+        else:
+            pool.close()
+    for pool in _pool:
+        pool.join()
+    _pool = []
+    sessions.close_all()
+    logins.stop()
+
+
+def worker_for(hostname, workers):
+    # Stable across runs and processes, unlike hash() of a str.
+    return zlib.crc32(str(hostname).encode()) % workers
+
+
+def _hostname(target, args):
+    return inspect.signature(target).bind(*args).arguments.get('hostname')
+
+
+def _run_job(job):
+    # The phases the job records are sent back with its result for the parent's run report.
+    target, args = job
+    hostname = _hostname(target, args)
+    timing.start()
+    result = None
+    try:
+        result = target(*args)
+    except Exception as error:
+        # Anything the vendor handlers do not expect fails this device alone instead of the whole run.
+        owner = getattr(target, '__self__', None)
+        if hasattr(owner, 'failure'):
+            owner.failure(hostname, error)
+        else:
+            timing.fail(error)
+    record = timing.finish(hostname)
+    return result, record
+
+
+def _imap_by_host(pools, target, pending):
+    # Like imap_unordered, but each device goes to its own worker; each worker still takes its devices in order.
+    results = Queue()
+    for hostname, args in pending.items():
+        pools[worker_for(hostname, len(pools))].apply_async(_run_job, ((target, args),), callback=results.put,
+                                                            error_callback=results.put)
+    for _ in pending:
+        result = results.get()
+        if isinstance(result, BaseException):
+            raise result
+        yield result
+
+
+def run_pool(target, jobs, workers=DEFAULT_WORKERS, on_result=None, report=None, retries=0, journal=None):
+    # Feeds every job to a fixed set of worker processes instead of forking one per device, always the same worker
+    # for the same device so repeated runs find its session open.
+    # Jobs that fail transiently go round again after a jittered, bounded backoff.
+    # Final failures are journaled here; a success is journaled by whoever stores its output, which is this
+    # loop only when the job saved it itself and there is no on_result.
+    start = datetime.now()
+    done = 0
+    attempt = 0
+    imported = sum(import_times.values())
+    get_pool(workers)
+    imported = sum(import_times.values()) - imported
+    if report is not None and imported:
+        report.stage('import', imported)
+    transient = TRANSIENT + (netmiko.NetMikoTimeoutException.__name__,)
+    progress = Progress(len(jobs), workers)
+    try:
+        while jobs:
+            pools = get_pool(workers)
+            pending = {_hostname(target, args): args for args in jobs}
+            jobs = []
+            for result, record in _imap_by_host(pools, target, pending):
+                retry = attempt < retries and record['error'] in transient
+                record['retry'] = retry
+                progress.update(record['error'], retry)
+                if report is not None:
+                    report.add(record)
+                if retry:
+                    jobs.append(pending[record['hostname']])
+                    continue
+                if journal is not None:
+                    if record['error']:
+                        journal.failed(record['hostname'], record['error'])
+                    elif on_result is None:
+                        journal.done([record['hostname']])
+                if on_result is not None and result is not None:
+                    on_result(*result)
+                done += 1
+            if jobs:
+                attempt += 1
+                delay = min(BACKOFF_CEILING, BACKOFF * 2 ** (attempt - 1)) * random.uniform(0.5, 1.0)
+                print(f'Retrying {len(jobs)} devices in {delay:.1f}s (attempt {attempt + 1} of {retries + 1})')
+                time.sleep(delay)
+    except BaseException:
+        close_pool(terminate=True)
+        raise
+    finally:
+        progress.close()
+    elapsed = (datetime.now() - start).total_seconds()
+    rate = done / elapsed if elapsed else 0.0
+    print(f'Devices: {done}  Workers: {workers}  Throughput: {rate:.2f} devices/sec')
+    return done
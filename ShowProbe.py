@@ -0,0 +1,57 @@
+from ShowImports import netmiko
+from ShowSession import JUMP_HOST
+import asyncio
+import time
+
+PROBE_TIMEOUT = 2.0
+PROBE_CONCURRENCY = 512
+
+
+async def _probe(hostname, device, semaphore, timeout):
+    async with semaphore:
+        start = time.time()
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(device['ip'], device.get('port', 22)),
+                                                    timeout)
+            writer.close()
+            error = None
+        except asyncio.TimeoutError:
+            error = f'no answer on port {device.get("port", 22)} within {timeout}s'
+        except OSError as failed:
+            error = failed.strerror or str(failed)
+    return hostname, device, start, time.time() - start, error
+
+
+async def _sweep(selected, timeout, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    return await asyncio.gather(*[_probe(hostname, device, semaphore, timeout) for hostname, device in selected
+                                  if not device.get(JUMP_HOST)])
+
+
+def probe_devices(selected, on_failure, report=None, timeout=PROBE_TIMEOUT, concurrency=PROBE_CONCURRENCY):
+    # One event loop opens a plain TCP connection to every device; only the ones that answer get an SSH
+    # worker. The rest are failed straight away instead of each holding a worker until the SSH timeout.
+    start = time.monotonic()
+    # Devices behind a jump host cannot be reached from here; their channel open is the check instead.
+    live = [(hostname, device) for hostname, device in selected if device.get(JUMP_HOST)]
+    unreachable = 0
+    for hostname, device, started, seconds, error in asyncio.run(_sweep(selected, timeout, concurrency)):
+        if error is None:
+            live.append((hostname, device))
+            if report is not None:
+                report.add_phase(hostname, 'probe', seconds)
+            continue
+        unreachable += 1
+        failure = netmiko.NetMikoTimeoutException(f'{device["ip"]}: {error}')
+        if report is not None:
+            report.add({'hostname': hostname, 'seconds': seconds, 'error': type(failure).__name__,
+                        'events': [{'phase': 'probe', 'start': started, 'seconds': seconds}]})
+        on_failure(hostname, failure)
+    # Back in the scheduled order, longest expected device first.
+    order = {hostname: number for number, (hostname, device) in enumerate(selected)}
+    live.sort(key=lambda item: order[item[0]])
+    elapsed = time.monotonic() - start
+    if report is not None:
+        report.stage('probe', elapsed)
+    print(f'Probe: {len(live)} reachable, {unreachable} unreachable in {elapsed:.2f}s')
+    return live
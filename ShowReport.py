@@ -0,0 +1,287 @@
+from multiprocessing import Pool
+from collections import Counter
+from datetime import datetime
+from glob import glob
+from getpass import getpass
+from ShowParse import parse_version, parse_hardware, parse_ntp_associations
+from ShowSearch import BEGIN, COMPRESSION, contents, blocks, file_stamp
+from ShowRunner import ShowRunner
+from ShowPool import close_pool, DEFAULT_WORKERS
+from ShowLog import start_logging, stop_logging
+import argparse
+import csv
+import hashlib
+import json
+import os
+import time
+
+REPORT_DIR = os.path.join('output', 'reports')
+# Plain files larger than this are parsed in several pieces, split at block boundaries.
+CHUNK_SIZE = 8 * 1024 * 1024
+# Bumped when a parser changes, so cached records of older runs are parsed again.
+RECORDS_VERSION = 1
+# A version run by less than this share of a model's devices is an outlier, once the model has OUTLIER_MIN devices.
+OUTLIER_SHARE = 0.1
+OUTLIER_MIN = 5
+# NTP peers further off than this many milliseconds are outliers.
+NTP_OFFSET = 100.0
+# Serials that are placeholders rather than a part's own.
+NO_SERIAL = ('', 'BUILTIN', 'NONE', 'N/A')
+
+
+def version_outliers(columns):
+    models = {}
+    for hostname, model, version in zip(columns['hostname'], columns['model'], columns['version']):
+        models.setdefault(model, Counter())[version] += 1
+    outliers = []
+    for hostname, model, version in zip(columns['hostname'], columns['model'], columns['version']):
+        versions = models[model]
+        total = sum(versions.values())
+        if total >= OUTLIER_MIN and versions[version] / total < OUTLIER_SHARE:
+            outliers.append({'hostname': hostname, 'reason': f'{model} runs {versions.most_common(1)[0][0]} on '
+                                                             f'{versions.most_common(1)[0][1]} of {total}, this '
+                                                             f'device {version}'})
+    return outliers
+
+
+def hardware_outliers(columns):
+    owners = {}
+    for hostname, serial in zip(columns['hostname'], columns['serial']):
+        if serial.upper() not in NO_SERIAL:
+            owners.setdefault(serial, set()).add(hostname)
+    return [{'hostname': hostname, 'reason': f'serial {serial} also on {", ".join(sorted(hosts - {hostname}))}'}
+            for serial, hosts in sorted(owners.items()) if len(hosts) > 1 for hostname in sorted(hosts)]
+
+
+def ntp_outliers(columns):
+    synced = {hostname for hostname, selected in zip(columns['hostname'], columns['selected']) if selected}
+    outliers = [{'hostname': hostname, 'reason': 'no selected NTP peer'}
+                for hostname in sorted(set(columns['hostname']) - synced)]
+    outliers += [{'hostname': hostname, 'reason': f'peer {peer} is {offset} ms off'}
+                 for hostname, peer, offset in zip(columns['hostname'], columns['peer'], columns['offset'])
+                 if abs(offset) > NTP_OFFSET]
+    return outliers
+
+
+# kind -> (parser of one device's block, record columns, columns counted by value, outlier finder)
+REPORTS = {
+    'version': (parse_version, ('vendor', 'model', 'version', 'serial'), ('vendor', 'model', 'version'),
+                version_outliers),
+    'hardware': (parse_hardware, ('item', 'version', 'part', 'serial', 'description'), ('description', 'part'),
+                 hardware_outliers),
+    'ntp': (parse_ntp_associations, ('peer', 'refid', 'stratum', 'reach', 'offset', 'selected'),
+            ('peer', 'stratum', 'selected'), ntp_outliers),
+}
+
+# kind -> ShowRunner commands of each device type whose output the report's parser reads. The Cisco version and
+# hardware menu entries save 'show version | include image' and 'show hardware', which hold no model or parts.
+REPORT_COMMANDS = {
+    'version': {'juniper': ['show version'], 'cisco_ios': ['show version']},
+    'hardware': {'juniper': ['show chassis hardware'], 'cisco_ios': ['show inventory']},
+    'ntp': {'juniper': ['show ntp associations'], 'cisco_ios': ['show ntp associations']},
+}
+
+
+def collect(kind, selector, username, workers):
+    # One ShowRunner pass over the selected devices; returns the output file it wrote.
+    jobs = {'name': f'{kind} report', 'jobs': [{'select': selector, 'commands': REPORT_COMMANDS[kind]}]}
+    password = os.environ.get('SHOW_PASSWORD') or getpass('Password: ')
+    start_logging()
+    try:
+        return ShowRunner(username, password, jobs['name'], workers=workers, echo=False).run(jobs)
+    finally:
+        close_pool()
+        stop_logging()
+
+
+def chunks(path):
+    # Like ShowSearch.chunks, but every piece starts at a Begin line so no device block is split.
+    if os.path.splitext(path)[1] in COMPRESSION or os.path.getsize(path) <= CHUNK_SIZE:
+        return [(path, 0, None)]
+    data = contents(path)
+    ranges = []
+    begin = 0
+    while begin < len(data):
+        match = BEGIN.search(data, min(begin + CHUNK_SIZE, len(data)))
+        end = match.start() if match else len(data)
+        ranges.append((path, begin, end))
+        begin = end
+    return ranges
+
+
+def _parse_chunk(job):
+    # Records come back as columns, one list per field, which pickle and store far smaller than row dicts.
+    kind, path, begin, end = job
+    parse, fields, counted, outliers = REPORTS[kind]
+    data = contents(path)
+    if end is None:
+        end = len(data)
+    columns = {field: [] for field in ('hostname',) + fields}
+    unparsed = []
+    for hostname, start, stop in blocks(data[begin:end], path):
+        records = parse(data[begin + start:begin + stop].decode(errors='replace'))
+        if not records:
+            unparsed.append(hostname)
+        for record in records:
+            columns['hostname'].append(hostname)
+            for field in fields:
+                columns[field].append(record[field])
+    return path, begin, columns, unparsed
+
+
+class FleetReport:
+
+    def __init__(self, kind, name=None, root=REPORT_DIR, jobs=None):
+        # Parsed records of every input file are kept under root/name/, so a later run only parses the
+        # files that are new or changed since.
+        self.kind = kind
+        self.name = name or kind
+        self.root = root
+        self.cache = os.path.join(root, self.name)
+        self.jobs = jobs or os.cpu_count()
+        os.makedirs(self.cache, exist_ok=True)
+
+    def cache_path(self, path):
+        return os.path.join(self.cache, hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:16] + '.json')
+
+    def cached(self, path):
+        try:
+            with open(self.cache_path(path), mode='r') as cached:
+                entry = json.load(cached)
+        except (OSError, ValueError):
+            return None
+        stat = os.stat(path)
+        if (entry['size'], entry['mtime'], entry['records']) != (stat.st_size, stat.st_mtime_ns, RECORDS_VERSION):
+            return None
+        return entry
+
+    def store(self, path, columns, unparsed):
+        stat = os.stat(path)
+        entry = {'path': path, 'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'records': RECORDS_VERSION,
+                 'stamp': file_stamp(path), 'columns': columns, 'unparsed': unparsed}
+        temp_path = f'{self.cache_path(path)}.{os.getpid()}.tmp'
+        with open(temp_path, mode='w') as cached:
+            json.dump(entry, cached, separators=(',', ':'))
+        os.replace(temp_path, self.cache_path(path))
+        return entry
+
+    def update(self, paths):
+        # Unchanged files come from the cache; the rest are parsed in pieces across the pool and put back
+        # together in file order.
+        entries = {}
+        changed = []
+        for path in paths:
+            entry = self.cached(path)
+            if entry is None:
+                changed.append(path)
+            else:
+                entries[path] = entry
+        if changed:
+            work = [(self.kind, path, begin, end) for source in changed for path, begin, end in chunks(source)]
+            parts = {}
+            with Pool(min(self.jobs, len(work))) as pool:
+                for path, begin, columns, unparsed in pool.imap_unordered(_parse_chunk, work):
+                    parts.setdefault(path, []).append((begin, columns, unparsed))
+            for path, pieces in parts.items():
+                pieces.sort(key=lambda piece: piece[0])
+                columns = {field: [value for begin, piece, unparsed in pieces for value in piece[field]]
+                           for field in pieces[0][1]}
+                entries[path] = self.store(path, columns, [host for begin, piece, unparsed in pieces
+                                                           for host in unparsed])
+        return entries, len(changed)
+
+    def latest(self, entries):
+        # A device's records come from the newest file it appears in, so the report shows the fleet as of
+        # the latest runs even when older ones are included.
+        fields = ('hostname',) + REPORTS[self.kind][1]
+        columns = {field: [] for field in fields}
+        unparsed = []
+        seen = set()
+        for entry in sorted(entries.values(), key=lambda entry: (entry['stamp'], entry['path']), reverse=True):
+            hosts = set(entry['columns']['hostname']) | set(entry['unparsed'])
+            fresh = hosts - seen
+            for row, hostname in enumerate(entry['columns']['hostname']):
+                if hostname in fresh:
+                    for field in fields:
+                        columns[field].append(entry['columns'][field][row])
+            unparsed.extend(hostname for hostname in entry['unparsed'] if hostname in fresh)
+            seen |= hosts
+        return columns, sorted(unparsed)
+
+    def summary(self, columns, unparsed, files):
+        parse, fields, counted, outliers = REPORTS[self.kind]
+        return {
+            'kind': self.kind,
+            'time': datetime.now().isoformat(timespec='seconds'),
+            'files': files,
+            'devices': len(set(columns['hostname'])),
+            'records': len(columns['hostname']),
+            'counts': {field: dict(Counter(map(str, columns[field])).most_common()) for field in counted},
+            'distinct': {field: len(set(columns[field])) for field in fields},
+            'outliers': outliers(columns),
+            'unparsed': unparsed,
+        }
+
+    def write(self, columns, summary):
+        fields = ('hostname',) + REPORTS[self.kind][1]
+        base = os.path.join(self.root, self.name)
+        with open(f'{base}.csv', mode='w', newline='') as records:
+            writer = csv.writer(records)
+            writer.writerow(fields)
+            writer.writerows(sorted(zip(*(columns[field] for field in fields)), key=lambda row: row[0]))
+        with open(f'{base} counts.csv', mode='w', newline='') as counts:
+            writer = csv.writer(counts)
+            writer.writerow(('field', 'value', 'count'))
+            for field, values in summary['counts'].items():
+                writer.writerows((field, value, count) for value, count in values.items())
+        with open(f'{base}.json', mode='w') as summary_file:
+            json.dump(summary, summary_file, indent=1)
+        return base
+
+    def run(self, paths):
+        start = time.monotonic()
+        entries, parsed = self.update(paths)
+        columns, unparsed = self.latest(entries)
+        summary = self.summary(columns, unparsed, sorted(entries))
+        base = self.write(columns, summary)
+        print(f'Parsed {parsed} files, {len(paths) - parsed} unchanged, in {time.monotonic() - start:.2f}s')
+        print(f"{summary['devices']} devices, {summary['records']} records, {len(summary['outliers'])} outliers, "
+              f"{len(unparsed)} unparsed")
+        for field in REPORTS[self.kind][2]:
+            top = ', '.join(f'{value} {count}' for value, count in list(summary['counts'][field].items())[:5])
+            print(f'  {field}: {top}')
+        for outlier in summary['outliers'][:10]:
+            print(f"  {outlier['hostname']:<24}{outlier['reason']}")
+        print(f'Report written to {base}.csv, {base} counts.csv and {base}.json')
+        return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Summarize the device blocks of saved show output across the '
+                                                 'fleet: counts, distinct values and outliers as CSV and JSON.')
+    parser.add_argument('kind', choices=sorted(REPORTS),
+                        help='version: show version, hardware: show chassis hardware / show inventory, '
+                             'ntp: show ntp associations.')
+    parser.add_argument('files', nargs='*', help='Output files or patterns, e.g. "output/version *.txt".')
+    parser.add_argument('--name', help='Report name, so one kind can have several reports. Defaults to the kind.')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help='Processes used to parse.')
+    parser.add_argument('--collect', nargs='?', const='', metavar='SELECTOR',
+                        help='First run the commands the report parses on the DeviceDB.csv devices the selector '
+                             'picks, all of them by default, e.g. "site=DAL*", and add their output file. '
+                             'Needed for Cisco version and hardware reports, whose menu entries save too little.')
+    parser.add_argument('--username', default=os.environ.get('SHOW_USERNAME'),
+                        help='For --collect. Defaults to $SHOW_USERNAME. The password is read from $SHOW_PASSWORD '
+                             'or prompted.')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help='For --collect, maximum number of devices collected at the same time.')
+    args = parser.parse_args()
+    paths = sorted({path for pattern in args.files for path in (glob(pattern) or [pattern]) if os.path.isfile(path)})
+    if args.collect is not None:
+        paths.append(collect(args.kind, args.collect, args.username or input('Username: '), args.workers))
+    if not paths:
+        parser.error('no output files match')
+    FleetReport(args.kind, args.name, jobs=args.jobs).run(paths)
+
+
+if __name__ == '__main__':
+    main()
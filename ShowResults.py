@@ -0,0 +1,204 @@
+from datetime import datetime, timedelta
+from ShowCapture import capture_chunks
+import argparse
+import os
+import sqlite3
+
+RESULTS_DB = os.path.join('output', 'results.db')
+BATCH_SIZE = 500
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    run TEXT NOT NULL,
+    hostname TEXT NOT NULL,
+    command TEXT NOT NULL,
+    time TEXT NOT NULL,
+    seconds REAL,
+    status TEXT NOT NULL,
+    output TEXT
+);
+CREATE INDEX IF NOT EXISTS results_hostname ON results (hostname, command, time);
+CREATE INDEX IF NOT EXISTS results_command ON results (command, time);
+CREATE INDEX IF NOT EXISTS results_time ON results (time);
+'''
+
+
+def match(pattern):
+    # Only * and % are wildcards. Plain names, DAL_CORE1 included, compare with = so they use the indexes; SQLite's
+    # LIKE is case-insensitive and skips them. Returns the comparison and the value to bind to it.
+    if '%' not in pattern and '*' not in pattern:
+        return '= ?', pattern
+    return "LIKE ? ESCAPE '\\'", pattern.replace('\\', '\\\\').replace('_', '\\_').replace('*', '%')
+
+
+class ResultStore:
+
+    def __init__(self, path=RESULTS_DB):
+        # WAL lets queries read while a run is writing; NORMAL sync is safe with WAL and far fewer fsyncs.
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(SCHEMA)
+
+    def insert(self, rows):
+        # One transaction per batch instead of one per device.
+        with self.db:
+            self.db.executemany('INSERT INTO results (run, hostname, command, time, seconds, status, output) '
+                                'VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+
+    def insert_chunks(self, row, chunks):
+        # A row whose output is appended a chunk at a time, for captures too large to hold in memory.
+        with self.db:
+            row_id = self.db.execute('INSERT INTO results (run, hostname, command, time, seconds, status, output) '
+                                     "VALUES (?, ?, ?, ?, ?, ?, '')", row).lastrowid
+            for chunk in chunks:
+                self.db.execute('UPDATE results SET output = output || ? WHERE id = ?', (chunk, row_id))
+
+    def search(self, command=None, hostname=None, since=None, until=None, status=None, contains=None, limit=100):
+        # command and hostname take * or % wildcards, e.g. 'chassis*' or 'DAL%'.
+        clauses = []
+        values = []
+        for column, operator, value in (('command', 'LIKE', command), ('hostname', 'LIKE', hostname),
+                                        ('time', '>=', since), ('time', '<', until), ('status', '=', status)):
+            if value is None:
+                continue
+            if operator == 'LIKE':
+                operator, value = match(value)
+            else:
+                operator += ' ?'
+            clauses.append(f'{column} {operator}')
+            values.append(value)
+        if contains is not None:
+            clauses.append('instr(output, ?) > 0')
+            values.append(contains)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        return self.db.execute(f'SELECT * FROM results {where} ORDER BY time DESC LIMIT ?',
+                               values + [limit]).fetchall()
+
+    def latest(self, command, hostname=None):
+        # The newest result of a command per device.
+        values = [command]
+        hosts = ''
+        if hostname is not None:
+            operator, hostname = match(hostname)
+            hosts = f'AND hostname {operator}'
+            values.append(hostname)
+        return self.db.execute(f'SELECT * FROM results WHERE id IN (SELECT max(id) FROM results WHERE command = ? '
+                               f'{hosts} GROUP BY hostname) ORDER BY hostname', values).fetchall()
+
+    def failures(self, since):
+        return self.db.execute("SELECT hostname, status, count(*) AS count, max(time) AS last FROM results "
+                               "WHERE time >= ? AND status != 'ok' GROUP BY hostname, status ORDER BY count DESC",
+                               (since,)).fetchall()
+
+    def runs(self, limit=20):
+        return self.db.execute("SELECT run, command, min(time) AS started, count(*) AS devices, "
+                               "sum(status != 'ok') AS failed FROM results GROUP BY run "
+                               "ORDER BY started DESC LIMIT ?", (limit,)).fetchall()
+
+    def close(self):
+        self.db.close()
+
+
+class ResultSink:
+
+    def __init__(self, store, run, command, report=None, commands=None):
+        # Fed by the ShowWriter thread only, so the database has a single writer.
+        # commands maps each hostname of a run of several commands to them, so its failures get a row per command.
+        self.store = store
+        self.run = run
+        self.command = command
+        self.report = report
+        self.commands = commands or {}
+        self.rows = []
+
+    def device(self, hostname):
+        if self.report is None:
+            return {}
+        with self.report.lock:
+            return dict(self.report.devices.get(hostname, {}))
+
+    def add(self, hostname, output, sections=None):
+        seconds = self.device(hostname).get('seconds')
+        stamp = datetime.now().isoformat(timespec='seconds')
+        for command, text in sections or [(self.command, output)]:
+            self.rows.append((self.run, hostname, command, stamp, seconds, 'ok', text))
+        if len(self.rows) >= BATCH_SIZE:
+            self.flush()
+
+    def add_file(self, hostname, path, compress=None):
+        # The rows before it go first, so results keep their order.
+        self.flush()
+        seconds = self.device(hostname).get('seconds')
+        self.store.insert_chunks((self.run, hostname, self.command, datetime.now().isoformat(timespec='seconds'),
+                                  seconds, 'ok'), capture_chunks(path, compress))
+
+    def flush(self):
+        if self.rows:
+            self.store.insert(self.rows)
+            self.rows = []
+
+    def close(self):
+        # Failed devices never reach the writer; their final status comes from the run report.
+        if self.report is not None:
+            stamp = datetime.now().isoformat(timespec='seconds')
+            with self.report.lock:
+                failed = [(hostname, device) for hostname, device in self.report.devices.items() if device['error']]
+            for hostname, device in failed:
+                for command in self.commands.get(hostname, [self.command]):
+                    self.rows.append((self.run, hostname, command, stamp, device['seconds'], device['error'], None))
+        self.flush()
+        self.store.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Query the results database of fleet show runs.')
+    parser.add_argument('--db', default=RESULTS_DB, help='Results database written with --results.')
+    commands = parser.add_subparsers(dest='action', required=True)
+    search = commands.add_parser('search', help='List stored results, newest first.')
+    search.add_argument('--command', help='Show command without "show"; * or %% matches anything, e.g. "chassis*".')
+    search.add_argument('--host', help='Hostname; * or %% matches anything, e.g. "DAL*".')
+    search.add_argument('--days', type=float, help='Only results from the last N days.')
+    search.add_argument('--since', help='ISO time to start from, e.g. 2024-01-31 or 2024-01-31T02:00.')
+    search.add_argument('--until', help='ISO time to stop before.')
+    search.add_argument('--status', help='ok, or an exception name such as NetmikoTimeoutException.')
+    search.add_argument('--contains', help='Only results whose output contains this text.')
+    search.add_argument('--limit', type=int, default=100)
+    search.add_argument('--output', action='store_true', help='Print the stored output as well.')
+    latest = commands.add_parser('latest', help='Print the newest result of a command for every device.')
+    latest.add_argument('command')
+    latest.add_argument('--host')
+    failures = commands.add_parser('failures', help='Count failures per device.')
+    failures.add_argument('--days', type=float, default=7)
+    commands.add_parser('runs', help='List recent runs.')
+    args = parser.parse_args()
+    store = ResultStore(args.db)
+    if args.action == 'search':
+        since = args.since
+        if args.days is not None:
+            since = (datetime.now() - timedelta(days=args.days)).isoformat(timespec='seconds')
+        for row in store.search(args.command, args.host, since, args.until, args.status, args.contains,
+                                args.limit):
+            print(f"{row['time']}  {row['hostname']:<24}{row['status']:<32}{row['command']}  ({row['run']})")
+            if args.output and row['output']:
+                print(row['output'])
+    elif args.action == 'latest':
+        for row in store.latest(args.command, args.host):
+            print(f"{row['time']}  {row['hostname']:<24}{row['status']}")
+            print(row['output'] or '')
+    elif args.action == 'failures':
+        since = (datetime.now() - timedelta(days=args.days)).isoformat(timespec='seconds')
+        for row in store.failures(since):
+            print(f"{row['hostname']:<24}{row['status']:<36}{row['count']:>6}  last {row['last']}")
+    else:
+        for row in store.runs():
+            print(f"{row['started']}  {row['run']:<40}{row['devices']:>6} devices{row['failed']:>6} failed")
+    store.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+from ShowImports import netmiko
+from datetime import datetime
+from getpass import getpass
+from JunosShow import JunosShow, JUNOS_COMMANDS
+from CiscoShow import CiscoShow, CISCO_COMMANDS
+from ShowPool import run_pool, close_pool, DEFAULT_WORKERS, RETRIES
+from ShowCapture import capture_path
+from ShowSchedule import DeviceHistory
+from ShowProbe import probe_devices, PROBE_TIMEOUT
+from ShowParse import JUNOS_PARSERS, CISCO_PARSERS
+from ShowLogin import logins
+from ShowSession import send_commands, sessions, JUMP_HOST
+from ShowTiming import RunReport, timing, SLOWEST
+from ShowWriter import ShowWriter
+from ShowLog import start_logging, stop_logging
+from ShowResults import ResultStore, ResultSink
+from ConfigStore import ConfigStore
+from DeviceInventory import load_inventory, parse_selector
+from ShowOptions import add_run_options, apply_run_options
+import argparse
+import json
+import os
+
+# device_type -> (show class, menu command table, parsers for the table's views)
+VENDORS = {
+    'juniper': (JunosShow, JUNOS_COMMANDS, JUNOS_PARSERS),
+    'cisco_ios': (CiscoShow, CISCO_COMMANDS, CISCO_PARSERS),
+}
+
+
+def load_jobs(path):
+    # {"name": "nightly", "jobs": [{"select": "site=DAL*", "commands": ["bgp", "version"]},
+    #                              {"select": "dev_type=switch", "commands": {"juniper": ["vlans"]}}]}
+    with open(path, mode='r') as job_file:
+        jobs = json.load(job_file)
+    if isinstance(jobs, list):
+        jobs = {'jobs': jobs}
+    jobs.setdefault('name', os.path.splitext(os.path.basename(path))[0])
+    for job in jobs['jobs']:
+        parse_selector(job.get('select', ''))
+        if not isinstance(job.get('commands'), (list, dict)):
+            raise ValueError(f"Every job needs a commands list, not {job.get('commands')!r}")
+    return jobs
+
+
+def result_command(show_command, view):
+    # Results are stored under the command the way the JunosShow/CiscoShow menus store them.
+    return f'{show_command} [{view}]' if view else show_command
+
+
+class ShowRunner:
+
+    def __init__(self, username, password, name, workers=DEFAULT_WORKERS, order='completion', echo=True,
+                 compress=None, slowest=SLOWEST, prometheus=None, retries=RETRIES, probe=False,
+                 probe_timeout=PROBE_TIMEOUT, results=None):
+        self.user = username
+        self.passw = password
+        self.name = name
+        self.workers = workers
+        self.order = order
+        self.echo = echo
+        self.compress = compress
+        self.slowest = slowest
+        self.prometheus = prometheus
+        self.retries = retries
+        self.probe = probe
+        self.probe_timeout = probe_timeout
+        self.results = results
+        self.today = datetime.now().strftime('%Y%m%d-%H%M')
+
+    def vendor(self, device_type, show_command='', view=None):
+        show_class = VENDORS[device_type][0]
+        return show_class(self.user, self.passw, '', show_command, view=view, echo=self.echo)
+
+    def resolve(self, row, command):
+        # A menu keyword from the vendor's table, or a literal 'show ...' command.
+        device_type = row['device_type']
+        if command.lower().startswith('show '):
+            return command, command[len('show '):], '', '', None
+        entry = VENDORS[device_type][1].get(command.lower())
+        if entry is None:
+            return None
+        show_command, dev_type, srx, view = entry
+        if (dev_type and row.get('dev_type') != dev_type) or (srx and row.get('srx') != srx):
+            return None
+        return (command.lower(),) + entry
+
+    def plan(self, jobs):
+        # Every job's selector is an index lookup; a device picked by several jobs still gets one session.
+        inventory = load_inventory()
+        planned = {}
+        unknown = set()
+        for job in jobs['jobs']:
+            terms = parse_selector(job.get('select', ''))
+            terms.setdefault('device_type', list(VENDORS))
+            for row in inventory.select(terms):
+                if row['device_type'] not in VENDORS:
+                    continue
+                commands = job['commands']
+                if isinstance(commands, dict):
+                    commands = commands.get(row['device_type'], [])
+                hostname, device, planned_commands = planned.setdefault(
+                    row['HostName'], (row['HostName'], self.device(row), []))
+                for command in commands:
+                    resolved = self.resolve(row, command)
+                    if resolved is None:
+                        if command.lower() not in VENDORS[row['device_type']][1] and \
+                                not command.lower().startswith('show '):
+                            unknown.add((row['device_type'], command))
+                    elif resolved not in planned_commands:
+                        planned_commands.append(resolved)
+        for device_type, command in sorted(unknown):
+            print(f'{device_type} has no {command!r} command; use a menu keyword or a full "show ..." command.')
+        return [(hostname, device, commands) for hostname, device, commands in planned.values() if commands]
+
+    def device(self, row):
+        device = {
+            'device_type': row['device_type'],
+            'ip': row['IP_Address'],
+            'username': self.user,
+            'password': self.passw,
+        }
+        if row.get('port'):
+            device['port'] = int(row['port'])
+        if row.get(JUMP_HOST):
+            device[JUMP_HOST] = row[JUMP_HOST]
+        return logins.tag(device, row)
+
+    def command(self, device_type, show_command):
+        command = f'show {show_command}'
+        if device_type == 'juniper' and 'no-more' not in command:
+            command += ' | no-more'
+        return command
+
+    def render(self, device_type, show_command, view, output):
+        show = self.vendor(device_type, show_command, view)
+        return show.render(VENDORS[device_type][2][show_command][1](output))
+
+    def collect(self, device, hostname, commands):
+        # Every command for the device is pipelined over one session, then rendered per section.
+        device_type = device['device_type']
+        shows = [self.command(device_type, show_command) for keyword, show_command, dev_type, srx, view in commands]
+        try:
+            with sessions.checkout(device, timeout=60) as net_connect, timing.phase('command'):
+                outputs = send_commands(net_connect, shows)
+        except (netmiko.NetMikoTimeoutException, netmiko.NetMikoAuthenticationException, ValueError) as error:
+            self.vendor(device_type).failure(hostname, error)
+            return
+        sections = []
+        results = []
+        for (keyword, show_command, dev_type, srx, view), output in zip(commands, outputs):
+            if view:
+                output = self.render(device_type, show_command, view, output)
+            elif keyword == 'configuration':
+                with timing.phase('write'):
+                    entry, diff = ConfigStore().save(hostname, output, self.today)
+                output = f"\nConfiguration changed, see {ConfigStore().diff_path(hostname, self.today)}\n" if diff \
+                    else '\nConfiguration saved.\n'
+            sections.append(f'\n------- {keyword} -------\n{output}')
+            results.append((result_command(show_command, view), output))
+        return hostname, self.vendor(device_type).block(hostname, ''.join(sections)), results
+
+    def run(self, jobs):
+        start = datetime.now()
+        planned = self.plan(jobs)
+        key = f"runner {jobs['name']}"
+        history = DeviceHistory()
+        order = {hostname: commands for hostname, device, commands in planned}
+        selected = history.schedule([(hostname, device) for hostname, device, commands in planned], key)
+        report = RunReport(f"{self.today} runner {jobs['name']}", self.slowest, self.prometheus)
+        if self.probe:
+            selected = probe_devices(selected, self.failure, report, self.probe_timeout)
+        collection = datetime.now()
+        path = capture_path(os.path.join('output', f"{jobs['name']} {self.today}.txt"), self.compress)
+        results = None
+        if self.results is not None:
+            # One result per device and command, under the show command as a menu run would store it.
+            commands = {hostname: [result_command(show_command, view)
+                                   for keyword, show_command, dev_type, srx, view in planned_commands]
+                        for hostname, planned_commands in order.items()}
+            results = ResultSink(ResultStore(self.results), report.name, key, report, commands)
+        writer = ShowWriter(path, self.order, self.echo, self.compress, report, results)
+        try:
+            run_pool(self.collect, [(device, hostname, order[hostname]) for hostname, device in selected],
+                     self.workers, writer.put, report, retries=self.retries)
+        finally:
+            writer.close()
+        report.stage('collection', (datetime.now() - collection).total_seconds())
+        history.update(report, key)
+        history.save()
+        report.close()
+        print(f'Total time to run = {datetime.now() - start}')
+        print(f'Output written to {path}')
+        return path
+
+    def failure(self, hostname, error):
+        # Probe failures arrive before a session exists; both vendors log them the same way.
+        self.vendor('juniper').failure(hostname, error)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a job file of show commands against Juniper and Cisco '
+                                                 'devices in one pass.')
+    parser.add_argument('jobs', help='JSON job file of selectors and per-vendor command lists.')
+    parser.add_argument('--username', default=os.environ.get('SHOW_USERNAME'),
+                        help='Defaults to $SHOW_USERNAME. The password is read from $SHOW_PASSWORD or prompted.')
+    add_run_options(parser, menu=False)
+    options = vars(parser.parse_args())
+    jobs = load_jobs(options.pop('jobs'))
+    apply_run_options(parser, options)
+    username = options.pop('username') or input('Username: ')
+    password = os.environ.get('SHOW_PASSWORD') or getpass('Password: ')
+    start_logging()
+    try:
+        ShowRunner(username, password, jobs['name'], **options).run(jobs)
+    finally:
+        close_pool()
+        stop_logging()
+        print(sessions.stats())
+
+
+if __name__ == '__main__':
+    main()
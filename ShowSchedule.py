@@ -0,0 +1,98 @@
+from ShowImports import netmiko
+from ShowTiming import TIMING_DIR
+import json
+import math
+import os
+import time
+
+HISTORY = os.path.join(TIMING_DIR, 'history.json')
+DEFAULT_TIMEOUT = 60
+TIMEOUT_FLOOR = 15
+TIMEOUT_CEILING = 180
+# Runs in a row that timed out which still double a device's timeout.
+BACKOFF_RUNS = 4
+# Weight of the newest run in the moving averages.
+ALPHA = 0.3
+CONNECT_PHASES = ('tcp', 'auth', 'setup')
+
+
+def blend(stats, seconds):
+    # Exponentially weighted mean and mean deviation, stored as [mean, deviation].
+    if stats is None:
+        return [seconds, seconds / 2]
+    mean, deviation = stats
+    deviation += ALPHA * (abs(seconds - mean) - deviation)
+    mean += ALPHA * (seconds - mean)
+    return [mean, deviation]
+
+
+class DeviceHistory:
+
+    def __init__(self, path=HISTORY):
+        self.path = path
+        try:
+            with open(path, mode='r') as history:
+                self.devices = json.load(history)
+        except (OSError, ValueError):
+            self.devices = {}
+
+    def expected(self, hostname, command):
+        entry = self.devices.get(hostname)
+        if entry is None:
+            return None
+        if entry['failures']:
+            return self.timeout(hostname, command)
+        seconds = 0.0
+        for stats in (entry.get('connect'), entry['commands'].get(command)):
+            if stats is not None:
+                seconds += stats[0]
+        return seconds
+
+    def timeout(self, hostname, command):
+        # Room for three times a slow run of this device, within the floor and ceiling. Each run in a row that timed
+        # out doubles it, so a device that was briefly unreachable is never given less than its commands need.
+        entry = self.devices.get(hostname)
+        if entry is None:
+            return DEFAULT_TIMEOUT
+        slow = max((stats[0] + 4 * stats[1] for stats in (entry.get('connect'), entry['commands'].get(command))
+                    if stats is not None), default=DEFAULT_TIMEOUT / 3)
+        timeout = max(TIMEOUT_FLOOR, math.ceil(3 * slow))
+        return min(TIMEOUT_CEILING, timeout * 2 ** min(entry['failures'], BACKOFF_RUNS))
+
+    def schedule(self, selected, command):
+        # Longest expected jobs go first so slow devices do not start last and stretch the run.
+        # Devices without history are assumed to take as long as the median known device.
+        known = sorted(seconds for seconds in (self.expected(hostname, command) for hostname, device in selected)
+                       if seconds is not None)
+        median = known[len(known) // 2] if known else 0.0
+        ordered = []
+        for hostname, device in selected:
+            expected = self.expected(hostname, command)
+            ordered.append((median if expected is None else expected, hostname,
+                            dict(device, timeout=self.timeout(hostname, command))))
+        ordered.sort(key=lambda item: item[0], reverse=True)
+        return [(hostname, device) for expected, hostname, device in ordered]
+
+    def update(self, report, command):
+        for hostname, device in report.devices.items():
+            entry = self.devices.setdefault(hostname, {'connect': None, 'commands': {}, 'failures': 0})
+            phases = device['phases']
+            if device['error'] is None:
+                # Cached sessions skip the connect phases, so only fresh logins update that average.
+                if 'auth' in phases:
+                    entry['connect'] = blend(entry['connect'],
+                                             sum(phases.get(phase, 0.0) for phase in CONNECT_PHASES))
+                if 'command' in phases:
+                    entry['commands'][command] = blend(entry['commands'].get(command), phases['command'])
+            if device['error'] == netmiko.NetMikoTimeoutException.__name__:
+                entry['failures'] += 1
+            elif device['error'] is None:
+                entry['failures'] = 0
+            entry['time'] = time.time()
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(temp_path, mode='w') as history:
+            json.dump(self.devices, history)
+        os.replace(temp_path, self.path)
@@ -0,0 +1,368 @@
+from multiprocessing import Pool
+from array import array
+from bisect import bisect_right
+from fnmatch import fnmatchcase
+from datetime import datetime
+from ConfigStore import ConfigStore, STORE
+from ShowCapture import read_capture
+import argparse
+import mmap
+import os
+import re
+import sqlite3
+import time
+
+OUTPUT_DIR = 'output'
+INDEX = os.path.join(OUTPUT_DIR, 'index.db')
+# Run bookkeeping, the parse cache and the config store's own layout are not show output. Config backups saved
+# as plain files next to the store are; the store's objects are read separately.
+SKIP_DIRS = (os.path.join(OUTPUT_DIR, 'timing'), os.path.join(OUTPUT_DIR, 'cache'), os.path.join(STORE, 'objects'),
+             os.path.join(STORE, 'history'), os.path.join(STORE, 'diffs'))
+SUFFIXES = ('.txt', '.txt.gz', '.txt.zst')
+COMPRESSION = {'.gz': 'gzip', '.zst': 'zstd'}
+CHUNK_SIZE = 64 * 1024 * 1024
+# Junos and Cisco blocks: '--------------- Begin host ---------------' and '==================== Begin host ===='.
+BEGIN = re.compile(rb'^[-=]{5,} Begin (\S+) [-=]{5,}', re.M)
+STAMP = re.compile(r'(\d{8}-\d{4})')
+# MACs, prefixes, interface names and addresses stay whole tokens; '/' parts are indexed as well.
+TOKEN = re.compile(rb'[0-9a-z][0-9a-z_.:/-]*[0-9a-z]|[0-9a-z]')
+
+# Terms of a gram counted to pick the rarest gram of a token; past this many any of the common ones will do.
+GRAM_SAMPLE = 2000
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (id INTEGER PRIMARY KEY, path TEXT UNIQUE, size INTEGER, mtime INTEGER,
+                                  stamp TEXT);
+CREATE TABLE IF NOT EXISTS docs (file INTEGER, number INTEGER, hostname TEXT, start INTEGER, end INTEGER,
+                                 PRIMARY KEY (file, number)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS postings (term TEXT, file INTEGER, docs BLOB, PRIMARY KEY (term, file)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS postings_file ON postings (file);
+CREATE TABLE IF NOT EXISTS terms (term TEXT PRIMARY KEY) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS grams (gram TEXT, term TEXT, PRIMARY KEY (gram, term)) WITHOUT ROWID;
+'''
+
+
+def sources(root=OUTPUT_DIR, store=STORE):
+    # Saved show output and inspections, then every stored configuration version.
+    paths = []
+    for directory, names, files in os.walk(root):
+        names[:] = [name for name in names
+                    if os.path.join(directory, name) not in SKIP_DIRS and not name.endswith('.parts')]
+        paths.extend(os.path.join(directory, name) for name in files if name.endswith(SUFFIXES))
+    for directory, names, files in os.walk(os.path.join(store, 'objects')):
+        paths.extend(os.path.join(directory, name) for name in files if name.endswith('.gz'))
+    return sorted(paths)
+
+
+def contents(path):
+    # Plain files are memory-mapped so a search reads them through the page cache without copying.
+    compress = COMPRESSION.get(os.path.splitext(path)[1])
+    if compress is not None:
+        return read_capture(path, compress).encode()
+    with open(path, mode='rb') as source:
+        if os.fstat(source.fileno()).st_size == 0:
+            return b''
+        return mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def file_stamp(path):
+    match = STAMP.search(os.path.basename(path))
+    if match:
+        return match.group(1)
+    return datetime.fromtimestamp(os.path.getmtime(path)).strftime('%Y%m%d-%H%M')
+
+
+def file_host(path):
+    # Inspection files hold one device and are named '{hostname} {stamp}.txt'; config blobs are
+    # attributed to their devices from the store history at query time.
+    if os.path.dirname(path).startswith(os.path.join(STORE, 'objects')):
+        return ''
+    return os.path.basename(path).split(' ')[0].split('.')[0]
+
+
+def blocks(data, path):
+    starts = [(match.start(), match.group(1).decode(errors='replace')) for match in BEGIN.finditer(data)]
+    if not starts:
+        return [(file_host(path), 0, len(data))]
+    return [(hostname, start, starts[number + 1][0] if number + 1 < len(starts) else len(data))
+            for number, (start, hostname) in enumerate(starts)]
+
+
+def tokens(text):
+    found = set(TOKEN.findall(text.lower()))
+    for token in list(found):
+        if b'/' in token:
+            found.update(part for part in token.split(b'/') if part)
+    return {token.decode() for token in found}
+
+
+def grams(term):
+    # The three characters from each position of term, fewer at its end, so every substring of up to three
+    # characters starts one of them and a longer substring is made of them.
+    return {term[number:number + 3] for number in range(len(term))}
+
+
+def _index_file(path):
+    data = contents(path)
+    docs = blocks(data, path)
+    postings = {}
+    for number, (hostname, start, end) in enumerate(docs):
+        for token in tokens(data[start:end]):
+            postings.setdefault(token, array('I')).append(number)
+    return path, docs, {token: numbers.tobytes() for token, numbers in postings.items()}
+
+
+def config_hosts(store=STORE):
+    # digest -> [(hostname, stamp)] of every time a device's configuration changed to that version.
+    store = ConfigStore(store)
+    history_dir = os.path.join(store.root, 'history')
+    hosts = {}
+    if os.path.isdir(history_dir):
+        for name in os.listdir(history_dir):
+            hostname = name[:-len('.jsonl')]
+            for entry in store.history(hostname):
+                if entry['changed']:
+                    hosts.setdefault(entry['sha256'], []).append((hostname, entry['time']))
+    return hosts
+
+
+def expand(hits, hosts):
+    # Config blob hits carry no hostname; one hit becomes one per device that had that version.
+    for path, hostname, stamp, line in hits:
+        if hostname:
+            yield hostname, stamp, line
+            continue
+        digest = os.path.basename(os.path.dirname(path)) + os.path.basename(path)[:-len('.gz')]
+        for hostname, stamp in hosts.get(digest, ()):
+            yield hostname, stamp, line
+
+
+class ShowIndex:
+
+    def __init__(self, path=INDEX, jobs=None):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.jobs = jobs or os.cpu_count()
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(SCHEMA)
+        if self.db.execute('SELECT 1 FROM terms LIMIT 1').fetchone() is None:
+            # Indexes written before the terms table existed.
+            with self.db:
+                self.db.execute('INSERT INTO terms SELECT DISTINCT term FROM postings')
+        if self.db.execute('SELECT 1 FROM grams LIMIT 1').fetchone() is None:
+            # Or before the grams table did.
+            with self.db:
+                self.add_grams(term for term, in self.db.execute('SELECT term FROM terms').fetchall())
+
+    def add_grams(self, terms):
+        self.db.executemany('INSERT OR IGNORE INTO grams VALUES (?, ?)',
+                            sorted((gram, term) for term in terms for gram in grams(term)))
+
+    def forget(self, file_id):
+        # Returns the file's terms, for prune() once whatever replaces the file is indexed.
+        terms = [term for term, in self.db.execute('SELECT term FROM postings WHERE file = ?', (file_id,))]
+        self.db.execute('DELETE FROM postings WHERE file = ?', (file_id,))
+        self.db.execute('DELETE FROM docs WHERE file = ?', (file_id,))
+        self.db.execute('DELETE FROM files WHERE id = ?', (file_id,))
+        return terms
+
+    def prune(self, terms):
+        # Terms no file holds any more are dropped with their grams, so lookups never consider them again.
+        orphans = [term for term in terms
+                   if self.db.execute('SELECT 1 FROM postings WHERE term = ? LIMIT 1', (term,)).fetchone() is None]
+        self.db.executemany('DELETE FROM terms WHERE term = ?', ((term,) for term in orphans))
+        self.db.executemany('DELETE FROM grams WHERE gram = ? AND term = ?',
+                            ((gram, term) for term in orphans for gram in grams(term)))
+
+    def update(self):
+        # Only new or changed files are tokenized, in parallel; the parent is the single database writer.
+        start = time.monotonic()
+        known = {path: (file_id, size, mtime) for file_id, path, size, mtime in
+                 self.db.execute('SELECT id, path, size, mtime FROM files')}
+        current = sources()
+        changed = []
+        for path in current:
+            stat = os.stat(path)
+            entry = known.get(path)
+            if entry is None or entry[1:] != (stat.st_size, stat.st_mtime_ns):
+                changed.append(path)
+        with self.db:
+            for path in set(known) - set(current):
+                self.prune(self.forget(known[path][0]))
+        indexed = 0
+        if changed:
+            with Pool(min(self.jobs, len(changed))) as pool:
+                for path, docs, postings in pool.imap_unordered(_index_file, changed):
+                    stat = os.stat(path)
+                    with self.db:
+                        replaced = self.forget(known[path][0]) if path in known else []
+                        file_id = self.db.execute('INSERT INTO files (path, size, mtime, stamp) VALUES (?, ?, ?, ?)',
+                                                  (path, stat.st_size, stat.st_mtime_ns, file_stamp(path))).lastrowid
+                        self.db.executemany('INSERT INTO docs VALUES (?, ?, ?, ?, ?)',
+                                            [(file_id, number, hostname, begin, end)
+                                             for number, (hostname, begin, end) in enumerate(docs)])
+                        # Sorted rows append to the term B-tree instead of splitting pages all over it.
+                        self.db.executemany('INSERT INTO postings VALUES (?, ?, ?)',
+                                            sorted((token, file_id, numbers) for token, numbers in postings.items()))
+                        new_terms = [token for token in sorted(postings)
+                                     if self.db.execute('INSERT OR IGNORE INTO terms VALUES (?)', (token,)).rowcount]
+                        self.add_grams(new_terms)
+                        self.prune(replaced)
+                    indexed += len(docs)
+        print(f'Indexed {len(changed)} files ({indexed} blocks), {len(current) - len(changed)} unchanged, '
+              f'in {time.monotonic() - start:.2f}s')
+
+    def terms(self, token):
+        # Every indexed term containing token, also part of a MAC or address in the middle of a term. Up to three
+        # characters are the prefix of a gram, a range of the grams index; a longer token narrows to the terms
+        # holding all of its grams first.
+        if len(token) <= 3:
+            upper = token[:-1] + chr(ord(token[-1]) + 1)
+            return list({term for term, in self.db.execute('SELECT term FROM grams WHERE gram >= ? AND gram < ?',
+                                                           (token, upper))})
+        rarest = min({token[number:number + 3] for number in range(len(token) - 2)}, key=self.gram_count)
+        return [term for term, in self.db.execute('SELECT term FROM grams WHERE gram = ?', (rarest,))
+                if token in term]
+
+    def gram_count(self, gram):
+        return self.db.execute('SELECT count(*) FROM (SELECT 1 FROM grams WHERE gram = ? LIMIT ?)',
+                               (gram, GRAM_SAMPLE)).fetchone()[0]
+
+    def find(self, text, hostname=None, since=None):
+        # Every token of text is part of a term of each block holding text, so only the blocks with a term
+        # containing each token are read. Tokens inside a longer one, such as the parts of an interface name,
+        # narrow nothing further and are left out; the longest match the fewest terms and go first.
+        wanted = tokens(text.encode())
+        if not wanted:
+            return []
+        wanted = [token for token in wanted if not any(token != other and token in other for other in wanted)]
+        matches = None
+        for token in sorted(wanted, key=len, reverse=True):
+            found = set()
+            for term in self.terms(token):
+                for file_id, numbers in self.db.execute('SELECT file, docs FROM postings WHERE term = ?', (term,)):
+                    found.update((file_id, number) for number in array('I', numbers))
+            matches = found if matches is None else matches & found
+            if not matches:
+                return []
+        by_file = {}
+        for file_id, number in matches:
+            by_file.setdefault(file_id, []).append(number)
+        needle = text.lower().encode()
+        hits = []
+        for file_id, numbers in by_file.items():
+            path, stamp = self.db.execute('SELECT path, stamp FROM files WHERE id = ?', (file_id,)).fetchone()
+            data = contents(path)
+            for number in sorted(numbers):
+                host, begin, end = self.db.execute('SELECT hostname, start, end FROM docs WHERE file = ? AND '
+                                                   'number = ?', (file_id, number)).fetchone()
+                for line in data[begin:end].splitlines():
+                    if needle in line.lower():
+                        hits.append((path, host, stamp, line.decode(errors='replace').rstrip()))
+        return filter_hits(expand(hits, config_hosts()), hostname, since)
+
+    def close(self):
+        self.db.close()
+
+
+def filter_hits(hits, hostname=None, since=None):
+    return sorted(hit for hit in hits
+                  if (hostname is None or fnmatchcase(hit[0], hostname))
+                  and (since is None or hit[1] >= since))
+
+
+def _grep_chunk(job):
+    path, begin, end, pattern, flags = job
+    regex = re.compile(pattern.encode(), flags)
+    data = contents(path)
+    if end is None:
+        end = len(data)
+    # Hostnames of this chunk: the block open at its start plus any that begin inside it.
+    starts = []
+    previous = data.rfind(b' Begin ', 0, begin)
+    if previous != -1:
+        line = data.rfind(b'\n', 0, previous) + 1
+        match = BEGIN.match(data, line)
+        if match:
+            starts.append((line, match.group(1).decode(errors='replace')))
+    starts.extend((match.start(), match.group(1).decode(errors='replace'))
+                  for match in BEGIN.finditer(data, begin, end))
+    positions = [start for start, hostname in starts]
+    stamp = file_stamp(path)
+    hits = []
+    last_line = -1
+    for match in regex.finditer(data, begin, end):
+        line_start = data.rfind(b'\n', 0, match.start()) + 1
+        if line_start == last_line:
+            continue
+        last_line = line_start
+        line_end = data.find(b'\n', match.start())
+        line = data[line_start:line_end if line_end != -1 else len(data)]
+        block = bisect_right(positions, line_start) - 1
+        hostname = starts[block][1] if block >= 0 else file_host(path)
+        hits.append((path, hostname, stamp, line.decode(errors='replace').rstrip()))
+    return hits
+
+
+def chunks(path):
+    # Large plain files are split at line ends so every core gets work, not just one per file.
+    if os.path.splitext(path)[1] in COMPRESSION or os.path.getsize(path) <= CHUNK_SIZE:
+        return [(path, 0, None)]
+    data = contents(path)
+    ranges = []
+    begin = 0
+    while begin < len(data):
+        end = data.find(b'\n', min(begin + CHUNK_SIZE, len(data) - 1))
+        end = len(data) if end == -1 else end + 1
+        ranges.append((path, begin, end))
+        begin = end
+    return ranges
+
+
+def grep(pattern, ignore_case=False, hostname=None, since=None, jobs=None):
+    flags = re.IGNORECASE if ignore_case else 0
+    work = [(path, begin, end, pattern, flags) for source in sources() for path, begin, end in chunks(source)]
+    hits = []
+    if work:
+        with Pool(min(jobs or os.cpu_count(), len(work))) as pool:
+            for found in pool.imap_unordered(_grep_chunk, work):
+                hits.extend(found)
+    return filter_hits(expand(hits, config_hosts()), hostname, since)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Search saved show output, inspections and configurations.')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help='Processes used to index or search.')
+    commands = parser.add_subparsers(dest='action', required=True)
+    commands.add_parser('index', help='Index new and changed output files.')
+    find = commands.add_parser('find', help='Find lines containing text, e.g. a MAC, prefix or description, '
+                                            'through the index.')
+    find.add_argument('text')
+    find.add_argument('--no-update', dest='update', action='store_false',
+                      help='Search the index as it is without indexing new files first.')
+    grep_parser = commands.add_parser('grep', help='Regex search of every file, in parallel.')
+    grep_parser.add_argument('pattern')
+    grep_parser.add_argument('-i', dest='ignore_case', action='store_true', help='Ignore case.')
+    for command in (find, grep_parser):
+        command.add_argument('--host', help='Only these hostnames; * matches anything, e.g. "DAL*".')
+        command.add_argument('--since', help='Only output saved from this stamp on, e.g. 20240131.')
+    args = parser.parse_args()
+    start = time.monotonic()
+    if args.action == 'grep':
+        hits = grep(args.pattern, args.ignore_case, args.host, args.since, args.jobs)
+    else:
+        index = ShowIndex(jobs=args.jobs)
+        if args.action == 'index' or args.update:
+            index.update()
+        hits = index.find(args.text, args.host, args.since) if args.action == 'find' else []
+        index.close()
+    for hostname, stamp, line in hits:
+        print(f'{stamp}  {hostname:<24}{line}')
+    if args.action != 'index':
+        print(f'{len(hits)} matching lines in {time.monotonic() - start:.2f}s')
+
+
+if __name__ == '__main__':
+    main()
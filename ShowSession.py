@@ -0,0 +1,349 @@
+from ShowImports import netmiko, LazyModule
+from collections import OrderedDict
+from contextlib import contextmanager
+from multiprocessing import Value
+from threading import Lock
+from ShowTiming import timing
+from ShowLogin import logins, LOGIN_GROUP
+import json
+import os
+import re
+import socket
+import time
+
+paramiko = LazyModule('paramiko')
+
+MAX_SESSIONS = 8
+IDLE_TIMEOUT = 300
+# Device key and DeviceDB.csv column naming the bastion a device is reached through, as [user@]host[:port].
+JUMP_HOST = 'jump_host'
+# Seconds between keepalives on idle bastion transports, so they outlive the gaps between runs.
+JUMP_KEEPALIVE = 30
+SETUP_DIR = os.path.join('output', 'setup')
+# A learned setup is redone in full after a week, so it is never much older than the device's software.
+SETUP_TTL = 7 * 24 * 3600
+# Seconds a replayed setup may take beyond the full one it replaces before the learned state counts as stale.
+SETUP_MARGIN = 2
+# The terminal commands netmiko's session_preparation sends for each device type; fast setup replays them.
+SETUP_COMMANDS = {
+    'juniper': ['set cli screen-width 511', 'set cli complete-on-space off', 'set cli screen-length 0'],
+    'juniper_junos': ['set cli screen-width 511', 'set cli complete-on-space off', 'set cli screen-length 0'],
+    'cisco_ios': ['terminal width 511', 'terminal length 0'],
+}
+SETUP_ERRORS = re.compile(r'unknown command|syntax error|% ?invalid|% ?incomplete|% ?ambiguous|not found', re.I)
+PROMPT_END = re.compile(r'[>#%$]\s*$')
+
+
+class JumpHosts:
+
+    def __init__(self):
+        # One SSH transport per bastion in each process; every device session through it is a channel.
+        # Threads sharing the process take turns logging in, so a bastion never gets two transports.
+        self.clients = {}
+        self.lock = Lock()
+
+    def parse(self, spec, device):
+        user, _, host = spec.rpartition('@')
+        host, _, port = host.partition(':')
+        return user or device['username'], host, int(port or 22)
+
+    def transport(self, spec, device, timeout):
+        with self.lock:
+            return self.login(spec, device, timeout)
+
+    def login(self, spec, device, timeout):
+        client = self.clients.get(spec)
+        if client is not None and client.get_transport() is not None and client.get_transport().is_active():
+            return client.get_transport()
+        if client is not None:
+            client.close()
+        user, host, port = self.parse(spec, device)
+        # Keys and the SSH agent are tried before the device password, as ssh would.
+        client = paramiko.SSHClient()
+        client.load_system_host_keys()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        with timing.phase('jump'):
+            try:
+                client.connect(host, port, username=user, password=device['password'], timeout=timeout,
+                               auth_timeout=timeout, banner_timeout=timeout)
+            except paramiko.AuthenticationException as error:
+                raise netmiko.NetMikoAuthenticationException(f'Login to jump host {host}:{port} failed: {error}')
+            except (OSError, paramiko.SSHException) as error:
+                raise netmiko.NetMikoTimeoutException(f'Jump host {host}:{port} failed: {error}')
+        client.get_transport().set_keepalive(JUMP_KEEPALIVE)
+        self.clients[spec] = client
+        return client.get_transport()
+
+    def channel(self, spec, device, address, timeout):
+        transport = self.transport(spec, device, timeout)
+        with timing.phase('channel'):
+            try:
+                return transport.open_channel('direct-tcpip', address, ('127.0.0.1', 0), timeout=timeout)
+            except (OSError, paramiko.SSHException) as error:
+                raise netmiko.NetMikoTimeoutException(
+                    f'Channel to {address[0]}:{address[1]} through {spec} failed: {error}')
+
+    def close_all(self):
+        with self.lock:
+            while self.clients:
+                spec, client = self.clients.popitem()
+                client.close()
+
+
+class SetupCache:
+
+    def __init__(self, ttl=SETUP_TTL, root=SETUP_DIR):
+        # What each device's full session preparation found: its prompt, the terminal commands it took and how
+        # long it took. With fast setup on, later sessions replay that instead of discovering it again.
+        self.enabled = False
+        self.ttl = ttl
+        self.root = root
+
+    def path(self, device):
+        address = f"{device['ip']}_{device.get('port', 22)}".replace(':', '-')
+        return os.path.join(self.root, f'{address}.json')
+
+    def get(self, device):
+        try:
+            with open(self.path(device), mode='r') as cached:
+                state = json.load(cached)
+        except (OSError, ValueError):
+            return None
+        if time.time() - state['time'] > self.ttl or state['device_type'] != device['device_type']:
+            return None
+        return state
+
+    def put(self, device, base_prompt, seconds):
+        os.makedirs(self.root, exist_ok=True)
+        path = self.path(device)
+        state = {'time': time.time(), 'device_type': device['device_type'], 'base_prompt': base_prompt,
+                 'commands': SETUP_COMMANDS[device['device_type']], 'seconds': seconds}
+        with open(f'{path}.{os.getpid()}.tmp', mode='w') as cached:
+            json.dump(state, cached)
+        os.replace(f'{path}.{os.getpid()}.tmp', path)
+
+    def replay(self, net_connect, state):
+        # Types every command at once and reads until the learned prompt follows the echo of the last one, with
+        # no fixed sleeps. A rejected command, another prompt or no prompt in time means the state is stale.
+        commands = state['commands']
+        prompt = re.compile(r'(?:^|\n)\s*' + re.escape(state['base_prompt']) + r'[>#]\s*$')
+        net_connect.write_channel(''.join(f'{command}{net_connect.RETURN}' for command in commands))
+        deadline = time.monotonic() + state['seconds'] + SETUP_MARGIN
+        output = ''
+        while time.monotonic() < deadline:
+            data = net_connect.read_channel()
+            if not data:
+                time.sleep(0.01)
+                continue
+            output += data
+            # The login banner is still in front of the echoes and may say anything.
+            if SETUP_ERRORS.search(output.partition(commands[0])[2]):
+                return False
+            head, echo, tail = output.rpartition(commands[-1])
+            if not echo:
+                continue
+            if prompt.search(tail):
+                return True
+            if PROMPT_END.search(tail.rsplit('\n', 1)[-1]):
+                return False
+        return False
+
+    def prepare(self, device, net_connect):
+        # Returns how the session was set up, for the setup phase event of the run report.
+        if not self.enabled or device['device_type'] not in SETUP_COMMANDS:
+            net_connect._try_session_preparation()
+            return {}
+        state = self.get(device)
+        outcome = 'learned'
+        if state is not None:
+            started = time.monotonic()
+            if self.replay(net_connect, state):
+                net_connect.base_prompt = state['base_prompt']
+                return {'setup': 'cached', 'saved': state['seconds'] - (time.monotonic() - started)}
+            # The failed replay is time lost, and the full preparation starts from a quiet channel.
+            net_connect.clear_buffer()
+            outcome = 'stale'
+            lost = time.monotonic() - started
+        started = time.monotonic()
+        net_connect._try_session_preparation()
+        seconds = time.monotonic() - started
+        self.put(device, net_connect.base_prompt, seconds)
+        if outcome == 'stale':
+            return {'setup': outcome, 'saved': -lost}
+        return {'setup': outcome}
+
+
+class SessionCache:
+
+    def __init__(self, max_open=MAX_SESSIONS, idle_timeout=IDLE_TIMEOUT):
+        # Sessions are checked out by connect() and only kept once they are handed back by release().
+        # The lock only guards the bookkeeping, for threads sharing the cache; no session is opened or
+        # closed while it is held.
+        self.max_open = max_open
+        self.idle_timeout = idle_timeout
+        self.sessions = OrderedDict()
+        self.lock = Lock()
+        self.hits = Value('i', 0)
+        self.misses = Value('i', 0)
+        self.jumps = JumpHosts()
+        self.setups = SetupCache()
+
+    def key(self, device):
+        return device['ip'], device.get('port', 22), device['username'], device['device_type']
+
+    def count(self, counter):
+        with counter.get_lock():
+            counter.value += 1
+
+    def expire(self):
+        # Returns the sessions idle for too long, for the caller to close once the lock is released.
+        now = time.monotonic()
+        expired = []
+        for key, (net_connect, last_used) in list(self.sessions.items()):
+            if now - last_used > self.idle_timeout:
+                del self.sessions[key]
+                expired.append(net_connect)
+        return expired
+
+    def connect(self, device, **kwargs):
+        with self.lock:
+            expired = self.expire()
+            net_connect, last_used = self.sessions.pop(self.key(device), (None, None))
+        for idle in expired:
+            self.discard(idle)
+        if net_connect is not None and net_connect.is_alive():
+            self.count(self.hits)
+            net_connect.timeout = device.get('timeout', net_connect.timeout)
+            return net_connect
+        if net_connect is not None:
+            self.discard(net_connect)
+        self.count(self.misses)
+        return self.open(device, **kwargs)
+
+    def open(self, device, **kwargs):
+        # The steps of ConnectHandler done one at a time so TCP, SSH auth and paging setup are timed apart.
+        # A timeout scheduled for this device wins over the caller's default.
+        options = dict(kwargs, **device)
+        options.pop(LOGIN_GROUP, None)
+        jump_host = options.pop(JUMP_HOST, None)
+        address = device['ip'], device.get('port', 22)
+        if logins.buckets is not None:
+            # Held before the TCP connect, so no socket sits idle while the login waits its turn.
+            with timing.phase('queue'):
+                logins.wait(device)
+        if jump_host:
+            # A channel over the process's bastion transport stands in for the TCP connection.
+            sock = self.jumps.channel(jump_host, device, address, options.get('timeout', 100))
+        else:
+            with timing.phase('tcp'):
+                try:
+                    sock = socket.create_connection(address, timeout=options.get('timeout', 100))
+                except OSError as error:
+                    raise netmiko.NetMikoTimeoutException(
+                        f'TCP connection to {address[0]}:{address[1]} failed: {error}')
+        try:
+            net_connect = netmiko.ConnectHandler(**options, sock=sock, auto_connect=False)
+            with timing.phase('auth'):
+                net_connect._modify_connection_params()
+                net_connect.establish_connection()
+            with timing.phase('setup') as details:
+                details.update(self.setups.prepare(device, net_connect))
+        except Exception:
+            sock.close()
+            raise
+        return net_connect
+
+    @contextmanager
+    def checkout(self, device, **kwargs):
+        # connect() and release() around a block; a session that failed mid-command is not handed back,
+        # so the next connect logs in again.
+        net_connect = self.connect(device, **kwargs)
+        try:
+            yield net_connect
+        except BaseException:
+            self.discard(net_connect)
+            raise
+        self.release(device, net_connect)
+
+    def release(self, device, net_connect):
+        with self.lock:
+            # A second session to the same device, opened while the first was checked out, replaces it.
+            replaced = self.sessions.pop(self.key(device), None)
+            self.sessions[self.key(device)] = (net_connect, time.monotonic())
+            evicted = [replaced[0]] if replaced is not None else []
+            while len(self.sessions) > self.max_open:
+                key, (oldest, last_used) = self.sessions.popitem(last=False)
+                evicted.append(oldest)
+        for oldest in evicted:
+            self.discard(oldest)
+
+    def discard(self, net_connect):
+        try:
+            net_connect.disconnect()
+        except Exception:
+            pass
+
+    def close_all(self):
+        with self.lock:
+            closing = [net_connect for net_connect, last_used in self.sessions.values()]
+            self.sessions.clear()
+        for net_connect in closing:
+            self.discard(net_connect)
+        # The bastions go last, their channels carry the sessions closed above.
+        self.jumps.close_all()
+
+    def stats(self):
+        return f'Session cache: {self.hits.value} hits, {self.misses.value} misses'
+
+
+sessions = SessionCache()
+
+
+def stream_pipelined(net_connect, commands, write, timeout=None):
+    # Writes every command at once and splits the replies on the echoed prompt lines, so the
+    # device works through the list without a round-trip wait between commands. Each output line
+    # goes straight to write(index, line) so nothing larger than one line is held here.
+    if timeout is None:
+        timeout = net_connect.timeout
+    prompt = net_connect.find_prompt()
+    current = -1
+    # find_prompt() has already read the prompt that the first echoed command follows.
+    pending = prompt
+    net_connect.write_channel(''.join(f'{command}{net_connect.RETURN}' for command in commands))
+    last_data = time.monotonic()
+    while True:
+        data = net_connect.read_channel()
+        if not data:
+            if time.monotonic() - last_data > timeout:
+                raise netmiko.NetMikoTimeoutException(f'Timed out waiting for {prompt} after {commands[current]}')
+            time.sleep(0.05)
+            continue
+        last_data = time.monotonic()
+        pending += data
+        lines = pending.split('\n')
+        pending = lines.pop()
+        for line in lines:
+            line = line.rstrip('\r')
+            following = current + 1
+            if following < len(commands) and line.strip().startswith(prompt) and commands[following] in line:
+                current = following
+            elif current >= 0:
+                write(current, line + '\n')
+        if current == len(commands) - 1 and pending.strip() == prompt:
+            break
+
+
+def send_pipelined(net_connect, commands, timeout=None):
+    outputs = [[] for _ in commands]
+    stream_pipelined(net_connect, commands, lambda index, line: outputs[index].append(line), timeout)
+    return [''.join(lines) for lines in outputs]
+
+
+def send_commands(net_connect, commands, timeout=None):
+    # Falls back to one send_command per command when a device does not take typed-ahead input.
+    try:
+        return send_pipelined(net_connect, commands, timeout)
+    except netmiko.NetMikoTimeoutException:
+        net_connect.write_channel('\x03' + net_connect.RETURN)
+        net_connect.clear_buffer()
+        return [net_connect.send_command(command) for command in commands]
@@ -0,0 +1,222 @@
+from ShowImports import netmiko
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from threading import Lock
+import json
+import os
+import time
+
+TIMING_DIR = os.path.join('output', 'timing')
+PHASES = ('import', 'probe', 'queue', 'jump', 'channel', 'tcp', 'auth', 'setup', 'command', 'write')
+SLOWEST = 10
+
+
+def percentiles(values):
+    if not values:
+        return None
+    values = sorted(values)
+
+    def rank(pct):
+        return round(values[min(len(values) - 1, int(len(values) * pct / 100))], 4)
+    return {'count': len(values), 'p50': rank(50), 'p95': rank(95), 'p99': rank(99), 'max': round(values[-1], 4)}
+
+
+class DeviceTiming:
+
+    def __init__(self):
+        # Collects the phases of the device a worker is busy with; idle outside start()/finish().
+        self.events = None
+        self.error = None
+        self.started = None
+        # (start, seconds) of the worker's preload, charged to the first device it collects.
+        self.imports = None
+
+    def start(self):
+        self.events = []
+        self.error = None
+        self.started = time.monotonic()
+        if self.imports is not None:
+            start, seconds = self.imports
+            self.events.append({'phase': 'import', 'start': start, 'seconds': seconds})
+            self.imports = None
+
+    @contextmanager
+    def phase(self, name):
+        # The caller may add details about how the phase went to the dict it gets, e.g. the setup outcome.
+        start = time.time()
+        began = time.monotonic()
+        details = {}
+        try:
+            yield details
+        finally:
+            if self.events is not None:
+                self.events.append(dict(details, phase=name, start=start, seconds=time.monotonic() - began))
+
+    def fail(self, error):
+        self.error = type(error).__name__
+
+    def finish(self, hostname):
+        record = {'hostname': hostname, 'seconds': time.monotonic() - self.started, 'events': self.events,
+                  'error': self.error}
+        self.events = None
+        return record
+
+
+timing = DeviceTiming()
+
+
+class RunReport:
+
+    def __init__(self, name, slowest=SLOWEST, prometheus=None, root=TIMING_DIR):
+        # Parent side of a fleet run: every device record and phase event is appended to one JSONL file.
+        os.makedirs(root, exist_ok=True)
+        self.name = name
+        self.path = os.path.join(root, f'{name}.jsonl')
+        self.slowest = slowest
+        self.prometheus = prometheus
+        self.started = time.monotonic()
+        self.phases = {phase: [] for phase in PHASES}
+        self.devices = {}
+        self.failures = Counter()
+        self.retries = 0
+        self.stages = {}
+        # Sessions by how fast setup prepared them, the setup seconds replays saved and those stale state lost.
+        self.setups = Counter()
+        self.setup_saved = 0.0
+        self.setup_lost = 0.0
+        self.lock = Lock()
+        self.events = open(self.path, mode='a')
+
+    def event(self, hostname, phase, start, seconds, **details):
+        self.phases.setdefault(phase, []).append(seconds)
+        device = self.devices.setdefault(hostname, {'seconds': 0.0, 'phases': {}, 'error': None})
+        device['phases'][phase] = device['phases'].get(phase, 0.0) + seconds
+        if 'setup' in details:
+            self.setups[details['setup']] += 1
+            if details['setup'] == 'cached':
+                self.setup_saved += details['saved']
+            elif details['setup'] == 'stale':
+                self.setup_lost -= details['saved']
+        if 'saved' in details:
+            details['saved'] = round(details['saved'], 4)
+        self.events.write(json.dumps(dict(details, run=self.name, hostname=hostname, phase=phase,
+                                          time=datetime.fromtimestamp(start).isoformat(timespec='milliseconds'),
+                                          seconds=round(seconds, 4))) + '\n')
+
+    def add(self, record):
+        with self.lock:
+            for event in record['events'] or ():
+                self.event(record['hostname'], **event)
+            device = self.devices.setdefault(record['hostname'], {'seconds': 0.0, 'phases': {}, 'error': None})
+            device['seconds'] += record['seconds']
+            device['error'] = record['error']
+            if record.get('retry'):
+                self.retries += 1
+            elif record['error']:
+                self.failures[record['error']] += 1
+            self.events.write(json.dumps({'run': self.name, 'hostname': record['hostname'], 'phase': 'device',
+                                          'seconds': round(record['seconds'], 4), 'error': record['error'],
+                                          'retry': record.get('retry', False)}) + '\n')
+
+    def add_phase(self, hostname, phase, seconds):
+        # Phases timed in the parent, such as the ShowWriter file writes.
+        with self.lock:
+            self.event(hostname, phase, time.time() - seconds, seconds)
+
+    def stage(self, name, seconds):
+        # Wall time of a whole step of the run, such as the probe sweep or the collection.
+        with self.lock:
+            self.stages[name] = seconds
+            self.events.write(json.dumps({'run': self.name, 'stage': name, 'seconds': round(seconds, 4)}) + '\n')
+
+    def logins(self):
+        # Every login attempt records an auth phase; the rejected ones end the device with an auth failure.
+        return len(self.phases.get('auth', ())), self.failures.get(netmiko.NetMikoAuthenticationException.__name__, 0)
+
+    def summary(self):
+        lines = [f'\nRun timing ({len(self.devices)} devices, events in {self.path})',
+                 f"{'Phase':<10}{'Count':>8}{'p50':>10}{'p95':>10}{'p99':>10}{'Max':>10}"]
+        for phase, values in self.phases.items():
+            stats = percentiles(values)
+            if stats:
+                lines.append(f"{phase:<10}{stats['count']:>8}{stats['p50']:>10.3f}{stats['p95']:>10.3f}"
+                             f"{stats['p99']:>10.3f}{stats['max']:>10.3f}")
+        slowest = sorted(self.devices.items(), key=lambda item: item[1]['seconds'], reverse=True)[:self.slowest]
+        if slowest:
+            lines.append(f'Slowest {len(slowest)} devices:')
+            for hostname, device in slowest:
+                phases = ', '.join(f'{phase} {seconds:.2f}' for phase, seconds in device['phases'].items())
+                failed = f"  [{device['error']}]" if device['error'] else ''
+                lines.append(f"  {hostname:<24}{device['seconds']:>8.2f}s  {phases}{failed}")
+        if self.failures:
+            lines.append('Failures: ' + ', '.join(f'{name} {count}' for name, count in self.failures.most_common()))
+        attempts, rejected = self.logins()
+        if attempts:
+            lines.append(f'Logins: {attempts}, {rejected} rejected ({rejected / attempts:.1%})')
+        if self.setups:
+            cached = self.setups['cached']
+            per_device = f' ({self.setup_saved / cached:.2f}s a cached device)' if cached else ''
+            lost = f', {self.setup_lost:.2f}s lost on stale state' if self.setups['stale'] else ''
+            lines.append(f"Fast setup: {cached} cached, {self.setups['stale']} stale, {self.setups['learned']} "
+                         f'learned; {self.setup_saved:.2f}s of setup saved{per_device}{lost}')
+        if self.retries:
+            lines.append(f'Retried attempts: {self.retries}')
+        if self.stages:
+            lines.append('Stages: ' + ', '.join(f'{name} {seconds:.2f}s' for name, seconds in self.stages.items()))
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self):
+        # node_exporter textfile collector format, replaced atomically so a scrape never sees half a file.
+        lines = ['# HELP show_phase_seconds Per-device phase durations of the last run.',
+                 '# TYPE show_phase_seconds summary']
+        for phase, values in self.phases.items():
+            stats = percentiles(values)
+            if not stats:
+                continue
+            for quantile in ('p50', 'p95', 'p99'):
+                lines.append(f'show_phase_seconds{{phase="{phase}",quantile="0.{quantile[1:]}"}} {stats[quantile]}')
+            lines.append(f'show_phase_seconds_sum{{phase="{phase}"}} {round(sum(values), 4)}')
+            lines.append(f'show_phase_seconds_count{{phase="{phase}"}} {len(values)}')
+        lines += ['# HELP show_run_devices Devices in the last run.', '# TYPE show_run_devices gauge',
+                  f'show_run_devices {len(self.devices)}',
+                  '# HELP show_run_seconds Wall time of the last run.', '# TYPE show_run_seconds gauge',
+                  f'show_run_seconds {round(time.monotonic() - self.started, 3)}',
+                  '# HELP show_run_failures Failed devices in the last run by exception class.',
+                  '# TYPE show_run_failures gauge']
+        lines += [f'show_run_failures{{exception="{name}"}} {count}' for name, count in self.failures.items()]
+        attempts, rejected = self.logins()
+        lines += ['# HELP show_run_logins Login attempts of the last run.', '# TYPE show_run_logins gauge',
+                  f'show_run_logins {attempts}',
+                  '# HELP show_run_logins_rejected Logins of the last run the devices rejected.',
+                  '# TYPE show_run_logins_rejected gauge', f'show_run_logins_rejected {rejected}']
+        if self.setups:
+            lines += ['# HELP show_run_setups Sessions of the last run by how fast setup prepared them.',
+                      '# TYPE show_run_setups gauge']
+            lines += [f'show_run_setups{{outcome="{outcome}"}} {count}' for outcome, count in self.setups.items()]
+            lines += ['# HELP show_run_setup_saved_seconds Setup time fast setup saved in the last run, net of losses.',
+                      '# TYPE show_run_setup_saved_seconds gauge',
+                      f'show_run_setup_saved_seconds {round(self.setup_saved - self.setup_lost, 3)}']
+        lines += ['# HELP show_stage_seconds Wall time of each step of the last run.',
+                  '# TYPE show_stage_seconds gauge']
+        lines += [f'show_stage_seconds{{stage="{name}"}} {round(seconds, 3)}' for name, seconds in self.stages.items()]
+        temp_path = f'{self.prometheus}.{os.getpid()}.tmp'
+        with open(temp_path, mode='w') as textfile:
+            textfile.write('\n'.join(lines) + '\n')
+        os.replace(temp_path, self.prometheus)
+
+    def close(self):
+        self.events.close()
+        if self.prometheus:
+            self.write_prometheus()
+        print(self.summary())
+
+
+def read_phases(path):
+    phases = {}
+    with open(path, mode='r') as events:
+        for line in events:
+            event = json.loads(line)
+            if event.get('phase', 'device') != 'device':
+                phases.setdefault(event['phase'], []).append(event['seconds'])
+    return phases
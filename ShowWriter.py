@@ -0,0 +1,104 @@
+from queue import Queue, Empty
+from threading import Thread
+from ShowCapture import compress_bytes
+import os
+import shutil
+import time
+
+BUFFER_SIZE = 1024 * 1024
+
+
+class ShowWriter:
+
+    def __init__(self, path, order='completion', echo=True, compress=None, report=None, results=None,
+                 journal=None):
+        # Only this thread touches the output file, the console and the results database, so blocks never
+        # interleave and the database has a single writer.
+        self.path = path
+        self.order = order
+        self.echo = echo
+        self.compress = compress
+        self.report = report
+        self.results = results
+        self.journal = journal
+        self.queue = Queue(maxsize=1000)
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def put(self, hostname, output, sections=None):
+        # sections are the (command, output) pairs of a block of several commands, stored as a result each.
+        self.queue.put((hostname, output, None, sections))
+
+    def put_file(self, hostname, path):
+        # A capture streamed to disk by a worker; it is copied in and removed, never read into memory.
+        self.queue.put((hostname, None, path, None))
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+    def flush_blocks(self, save_file, blocks):
+        # Blocks are written together; each device is charged an equal share of the write.
+        started = time.monotonic()
+        save_file.write(compress_bytes(''.join(output for hostname, output in blocks).encode(), self.compress))
+        if self.report is not None:
+            seconds = (time.monotonic() - started) / len(blocks)
+            for hostname, output in blocks:
+                self.report.add_phase(hostname, 'write', seconds)
+
+    def write(self, save_file, batch):
+        blocks = []
+        for hostname, output, path, sections in batch:
+            if path is None:
+                if self.echo:
+                    print(output)
+                if self.results is not None:
+                    self.results.add(hostname, output, sections)
+                blocks.append((hostname, output))
+                continue
+            if blocks:
+                self.flush_blocks(save_file, blocks)
+                blocks = []
+            if self.results is not None:
+                self.results.add_file(hostname, path, self.compress)
+            started = time.monotonic()
+            with open(path, mode='rb') as capture:
+                shutil.copyfileobj(capture, save_file, BUFFER_SIZE)
+            os.remove(path)
+            if self.report is not None:
+                self.report.add_phase(hostname, 'write', time.monotonic() - started)
+            if self.echo:
+                print(f'{hostname}: output saved to {self.path}')
+        if blocks:
+            self.flush_blocks(save_file, blocks)
+        if self.results is not None:
+            self.results.flush()
+        if self.journal is not None and batch:
+            # The blocks are on disk before the journal calls their devices done.
+            save_file.flush()
+            os.fsync(save_file.fileno())
+            self.journal.done([hostname for hostname, output, path, sections in batch], self.path, save_file.tell())
+
+    def run(self):
+        held = []
+        with open(self.path, mode='ab', buffering=BUFFER_SIZE) as save_file:
+            finished = False
+            while not finished:
+                batch = [self.queue.get()]
+                while True:
+                    try:
+                        batch.append(self.queue.get_nowait())
+                    except Empty:
+                        break
+                if None in batch:
+                    batch = batch[:batch.index(None)]
+                    finished = True
+                if self.order == 'hostname':
+                    held.extend(batch)
+                elif batch:
+                    self.write(save_file, batch)
+            if held:
+                held.sort(key=lambda item: item[0])
+                self.write(save_file, held)
+        if self.results is not None:
+            self.results.close()